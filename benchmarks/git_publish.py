@@ -0,0 +1,125 @@
+"""Benchmark deploy_site publishing: git subprocesses vs in-process objects.
+
+Builds a throwaway repository holding N ``record_<id>`` folders plus a bare
+remote, then repeatedly publishes a small batch of new galleries with
+
+* ``subprocess``: the original ``git add deploy_site/`` / ``git diff --staged``
+  / ``git commit`` / ``git push`` sequence, and
+* ``objects``: ``core.utils.git_publisher.GitObjectPublisher``, keeping the
+  index in sync, and
+* ``objects-noindex``: the same without index maintenance, as used on a
+  publish-only deploy clone (``DEPLOY_UPDATE_INDEX=False``).
+
+Usage::
+
+    python -m benchmarks.git_publish --sizes 1000 10000 100000 --batch 20 --rounds 5
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+
+from core.utils.git_publisher import GitObjectPublisher
+
+PAGE = "<!DOCTYPE html><html><body><h1>Documents for {name}</h1></body></html>\n"
+
+
+def git(cwd, *args):
+    subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True)
+
+
+def write_gallery(site_dir, record_id):
+    folder = os.path.join(site_dir, f'record_{record_id}')
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, 'index.html'), 'w') as f:
+        f.write(PAGE.format(name=record_id))
+    return f'deploy_site/record_{record_id}'
+
+
+def setup_repo(root, size):
+    remote = os.path.join(root, 'remote.git')
+    work = os.path.join(root, 'work')
+    git(root, 'init', '-q', '--bare', '-b', 'main', remote)
+    git(root, 'init', '-q', '-b', 'main', work)
+    git(work, 'config', 'user.email', 'bench@example.com')
+    git(work, 'config', 'user.name', 'Bench')
+    git(work, 'remote', 'add', 'origin', remote)
+
+    site_dir = os.path.join(work, 'deploy_site')
+    for _ in range(size):
+        write_gallery(site_dir, uuid.uuid4())
+    git(work, 'add', 'deploy_site/')
+    git(work, 'commit', '-q', '-m', 'Seed galleries')
+    git(work, 'push', '-q', 'origin', 'main')
+    return work, site_dir
+
+
+def publish_subprocess(work, paths):
+    subprocess.run(['git', 'add', 'deploy_site/'], cwd=work, check=True)
+    result = subprocess.run(['git', 'diff', '--staged', '--quiet'], cwd=work, capture_output=True)
+    if result.returncode != 0:
+        subprocess.run(['git', 'commit', '-q', '-m', 'Deploy batch'], cwd=work, check=True)
+    subprocess.run(['git', 'push', '-q', 'origin', 'main'], cwd=work, check=True, capture_output=True)
+
+
+def publish_objects(work, paths):
+    with GitObjectPublisher(work) as publisher:
+        publisher.publish(paths, 'Deploy batch', 'origin', 'main')
+
+
+def publish_objects_noindex(work, paths):
+    with GitObjectPublisher(work, update_index=False) as publisher:
+        publisher.publish(paths, 'Deploy batch', 'origin', 'main')
+
+
+METHODS = (
+    ('subprocess', publish_subprocess),
+    ('objects', publish_objects),
+    ('objects-noindex', publish_objects_noindex),
+)
+
+
+def run(size, batch, rounds):
+    root = tempfile.mkdtemp(prefix='bench_git_publish_')
+    try:
+        started = time.perf_counter()
+        work, site_dir = setup_repo(root, size)
+        print(f"\n{size:>7} record folders (setup {time.perf_counter() - started:.1f}s)")
+
+        timings = {name: [] for name, _publish in METHODS}
+        # The no-index variant leaves the index stale, so it runs last
+        for name, publish in METHODS:
+            for _ in range(rounds):
+                paths = [write_gallery(site_dir, uuid.uuid4()) for _ in range(batch)]
+                t0 = time.perf_counter()
+                publish(work, paths)
+                timings[name].append(time.perf_counter() - t0)
+
+        baseline = statistics.median(timings['subprocess'])
+        for name, values in timings.items():
+            median = statistics.median(values)
+            print(
+                f"  {name:<16} median {median * 1000:8.1f} ms"
+                f"   min {min(values) * 1000:8.1f} ms   max {max(values) * 1000:8.1f} ms"
+                f"   {baseline / median:5.1f}x"
+            )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--batch', type=int, default=20, help='galleries published per round')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.batch, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark QR rasterization: qrcode's PIL image factory vs the NumPy path.
+
+For every QR version and box size, both paths start from the same made
+``qrcode.QRCode`` and produce PNG bytes:
+
+* ``pil``: ``qr.make_image(fill_color="black", back_color="white")`` and
+  ``img.save(blob, 'PNG')``, as before ``core.utils.qr_raster``;
+* ``numpy-1bit`` / ``numpy-8bit``: ``qr_raster.render_png`` at each depth.
+
+Every case is checked for pixel equality against the PIL output first.
+Version 5 is the smallest that holds a gallery URL, which is what
+``QR_CODE_VERSION = 1`` grows to with ``fit=True``.
+
+Usage::
+
+    python -m benchmarks.qr_raster --versions 5 10 25 40 --box-sizes 4 10 20 --rounds 50
+"""
+import argparse
+import statistics
+import time
+from io import BytesIO
+
+import numpy as np
+import qrcode
+from PIL import Image
+
+from core.utils import qr_raster
+
+
+def make_qr(version, box_size, border):
+    qr = qrcode.QRCode(
+        version=version, error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size, border=border,
+    )
+    qr.add_data('https://teal-rugelach-4d0f54.netlify.app/record_00000000-0000-0000-0000-000000000000/')
+    qr.make(fit=False)
+    return qr
+
+
+def pil_png(qr):
+    blob = BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(blob, 'PNG')
+    return blob.getvalue()
+
+
+def pixels(png):
+    return np.asarray(Image.open(BytesIO(png)).convert('L'))
+
+
+def timed(func, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--versions', type=int, nargs='+', default=[5, 10, 25, 40])
+    parser.add_argument('--box-sizes', type=int, nargs='+', default=[4, 10, 20])
+    parser.add_argument('--border', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    modes = {
+        'pil': pil_png,
+        'numpy-1bit': lambda qr: qr_raster.render_png(qr, qr.box_size, bit_depth=1),
+        'numpy-8bit': lambda qr: qr_raster.render_png(qr, qr.box_size, bit_depth=8),
+    }
+    print(f"{'version':>7} {'box':>4} {'pixels':>11} " + ' '.join(f"{m + ' ms':>14}" for m in modes)
+          + f" {'speedup':>8} {'pil bytes':>10} {'1bit bytes':>11}")
+    for version in args.versions:
+        for box_size in args.box_sizes:
+            qr = make_qr(version, box_size, args.border)
+            reference = pil_png(qr)
+            outputs = {mode: func(qr) for mode, func in modes.items()}
+            for mode, png in outputs.items():
+                if not np.array_equal(pixels(png), pixels(reference)):
+                    raise SystemExit(f"{mode} output differs from PIL at version {version}, box {box_size}")
+
+            times = {mode: timed(lambda: func(qr), args.rounds) for mode, func in modes.items()}
+            side = pixels(reference).shape[0]
+            print(
+                f"{version:>7} {box_size:>4} {f'{side}x{side}':>11} "
+                + ' '.join(f"{times[m]:>14.2f}" for m in modes)
+                + f" {times['pil'] / times['numpy-1bit']:>7.1f}x"
+                + f" {len(reference):>10} {len(outputs['numpy-1bit']):>11}"
+            )
+
+
+if __name__ == '__main__':
+    main()
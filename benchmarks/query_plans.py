@@ -0,0 +1,180 @@
+"""EXPLAIN plans and latencies of the hot lookups, with and without their indexes.
+
+Creates a throwaway test database, seeds ``--users`` users with
+``--records`` records and ``--orders`` orders each (plus one power user
+with ``--power-orders`` orders, a print queue and a webhook backlog), then
+for every query below prints its plan and median latency twice: with the
+indexes from ``HOT_PATH_INDEXES`` dropped ("before") and in place
+("after"). A plan that falls back to a scan, or a latency that grows, shows
+up as a regression.
+
+Usage::
+
+    DJANGO_SETTINGS_MODULE=rto_project.settings.test \\
+        python -m benchmarks.query_plans --users 2000 --power-orders 20000
+
+The queries are built the way the views build them, so they follow the
+code; on PostgreSQL the plans are ``EXPLAIN`` output instead of SQLite's
+``EXPLAIN QUERY PLAN``.
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import timedelta
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rto_project.settings.test')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from core.models import Order, PrintOrder, RTORecord  # noqa: E402
+from core.serializers import OrderSerializer, RTORecordSerializer  # noqa: E402
+from core.utils.dashboard_stats import dashboard_stats_query  # noqa: E402
+from payments.models import WebhookEvent  # noqa: E402
+
+HOT_PATH_INDEXES = [
+    (RTORecord, 'record_owner_keyset_idx'),
+    (RTORecord, 'record_owner_status_idx'),
+    (Order, 'order_user_keyset_idx'),
+    (Order, 'order_user_type_idx'),
+    (Order, 'order_payment_id_idx'),
+    (PrintOrder, 'print_order_queue_idx'),
+    (WebhookEvent, 'webhook_pending_idx'),
+]
+CARD_TYPES = [Order.OrderType.PVC_CARD, Order.OrderType.NFC_CARD]
+
+
+def hot_queries(user, payment_ids):
+    """``(name, queryset)`` for each lookup, as its view or job issues it."""
+    records = RTORecord.objects.filter(owner=user)
+    orders = Order.objects.filter(user=user)
+    return [
+        ('dashboard records', records.order_by('-created_at')[:10]),
+        ('dashboard stats', dashboard_stats_query(user.pk)),
+        ('orders page', orders.filter(order_type__in=CARD_TYPES).order_by('-created_at')),
+        ('api records page', RTORecordSerializer.setup_eager_loading(records).order_by('-created_at', '-pk')[:21]),
+        ('api orders page', OrderSerializer.setup_eager_loading(orders).order_by('-created_at', '-pk')[:21]),
+        ('refund lookup', Order.objects.filter(payment_provider_payment_id__in=payment_ids)),
+        ('print queue', PrintOrder.objects.filter(status=PrintOrder.Status.PENDING).order_by('created_at', 'pk')[:500]),
+        ('webhook backlog', WebhookEvent.objects.filter(processed=False).order_by('received_at')[:500]),
+    ]
+
+
+def seed(users, records_per_user, orders_per_user, power_orders):
+    User = get_user_model()
+    User.objects.bulk_create(
+        [User(username=f'user{i}', email=f'user{i}@example.com') for i in range(users)], batch_size=1000,
+    )
+    owners = list(User.objects.all())
+    power_user = owners[0]
+    now = timezone.now()
+
+    records = []
+    for i, owner in enumerate(owners):
+        for j in range(records_per_user):
+            records.append(RTORecord(
+                owner=owner, name=f'Record {i}-{j}', contact_no='9999999999', address='-', record_type='rto',
+                status=[RTORecord.Status.PENDING, RTORecord.Status.APPROVED][j % 2],
+            ))
+    RTORecord.objects.bulk_create(records, batch_size=1000)
+    first_record = {}
+    for record in RTORecord.objects.only('pk', 'owner_id'):
+        first_record.setdefault(record.owner_id, record)
+
+    types = list(Order.OrderType.values)
+    orders = []
+    for owner in owners:
+        count = power_orders if owner is power_user else orders_per_user
+        for k in range(count):
+            number = len(orders)
+            orders.append(Order(
+                user=owner, rto_record=first_record[owner.pk], order_id=f'order_{number}',
+                order_type=types[number % len(types)], amount=150, total_amount=150,
+                payment_status=Order.Status.COMPLETED, payment_provider='razorpay',
+                payment_provider_payment_id=f'pay_{number}',
+            ))
+    Order.objects.bulk_create(orders, batch_size=1000)
+    # auto_now_add stamps them all alike; spread them so ORDER BY created_at has work to do
+    for minutes, start in enumerate(range(0, len(orders), 1000)):
+        Order.objects.filter(pk__gt=start, pk__lte=start + 1000).update(created_at=now - timedelta(minutes=minutes))
+
+    card_orders = Order.objects.filter(order_type__in=CARD_TYPES).only('pk', 'rto_record_id')
+    PrintOrder.objects.bulk_create(
+        [PrintOrder(order=order, rto_record_id=order.rto_record_id,
+                    status=PrintOrder.Status.PENDING if i % 10 == 0 else PrintOrder.Status.DELIVERED)
+         for i, order in enumerate(card_orders)],
+        batch_size=1000,
+    )
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(event_id=f'evt_{i}', provider='razorpay', event_type='payment.captured',
+                      raw_data={}, processed=i % 20 != 0)
+         for i in range(len(orders))],
+        batch_size=1000,
+    )
+    return power_user, [f'pay_{i}' for i in range(0, len(orders), max(1, len(orders) // 100))]
+
+
+def set_indexes(present):
+    with connection.schema_editor() as editor:
+        for model, name in HOT_PATH_INDEXES:
+            index = next(index for index in model._meta.indexes if index.name == name)
+            (editor.add_index if present else editor.remove_index)(model, index)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def measure(queryset, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        list(queryset.all())
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--records', type=int, default=3, help="Records per user")
+    parser.add_argument('--orders', type=int, default=5, help="Orders per user")
+    parser.add_argument('--power-orders', type=int, default=20000, help="Orders of the user whose pages are queried")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        started = time.perf_counter()
+        user, payment_ids = seed(args.users, args.records, args.orders, args.power_orders)
+        print(f"Seeded {Order.objects.count()} orders and {RTORecord.objects.count()} records "
+              f"in {time.perf_counter() - started:.1f}s\n")
+
+        results = {}
+        for label, present in (('before', False), ('after', True)):
+            set_indexes(present)
+            for name, queryset in hot_queries(user, payment_ids):
+                results.setdefault(name, {})[label] = (queryset.explain(), measure(queryset, args.repeat))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    for name, runs in results.items():
+        print(f"== {name}")
+        for label, (plan, _) in runs.items():
+            print(f"  {label}:")
+            for line in plan.splitlines():
+                print(f"    {line}")
+    print(f"\n{'query':<18} {'before ms':>10} {'after ms':>9} {'speedup':>8}")
+    for name, runs in results.items():
+        before, after = runs['before'][1], runs['after'][1]
+        print(f"{name:<18} {before:>10.2f} {after:>9.2f} {before / after:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark order creation: a new razorpay.Client per call vs the pooled client.
+
+Both modes create orders against ``payments.stub_gateway.RazorpayStub``
+with optional added latency:
+
+* ``per-call``: ``razorpay.Client(auth=...)`` built for every order, as the
+  views used to do;
+* ``pooled``: one ``payments.gateway`` client reused for every order.
+
+The stub counts TCP connections, so the output shows how many handshakes
+each mode needs (against the real API each one is also a TLS handshake).
+
+Usage::
+
+    python -m benchmarks.razorpay_gateway --orders 500 --threads 8 --latency 0.005
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+settings.configure(
+    RAZORPAY_KEY_ID='rzp_test_bench', RAZORPAY_KEY_SECRET='bench_secret',
+    RAZORPAY_BASE_URL='', RAZORPAY_CONNECT_TIMEOUT=3.05, RAZORPAY_READ_TIMEOUT=10,
+    RAZORPAY_MAX_RETRIES=2, RAZORPAY_RETRY_BACKOFF=0.25, RAZORPAY_POOL_SIZE=10,
+)
+
+import razorpay  # noqa: E402
+
+from payments.gateway import build_razorpay_client  # noqa: E402
+from payments.stub_gateway import RazorpayStub  # noqa: E402
+
+
+def run(make_client, orders, threads):
+    def create(i):
+        client = make_client()
+        started = time.perf_counter()
+        client.order.create({'amount': 200, 'currency': 'INR', 'receipt': f'bench_{i}'})
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = sorted(pool.map(create, range(orders)))
+    return time.perf_counter() - started, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds the stub adds per request")
+    args = parser.parse_args()
+
+    print(f"{'mode':>9} {'orders/s':>9} {'mean ms':>8} {'p95 ms':>7} {'connections':>12}")
+    for mode in ('per-call', 'pooled'):
+        with RazorpayStub(latency=args.latency) as stub:
+            if mode == 'pooled':
+                pooled = build_razorpay_client(base_url=stub.base_url)
+                make_client = lambda: pooled  # noqa: E731
+            else:
+                make_client = lambda: razorpay.Client(  # noqa: E731
+                    auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET), base_url=stub.base_url,
+                )
+            elapsed, latencies = run(make_client, args.orders, args.threads)
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            print(
+                f"{mode:>9} {args.orders / elapsed:>9.0f} {statistics.mean(latencies):>8.2f} "
+                f"{p95:>7.2f} {stub.stats['connections']:>12}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Benchmark SQLite under concurrent workers: stock settings vs the tuned profile.
+
+Each profile gets a fresh database file, ``--users`` users with a record,
+an order and a logged-in session each, then ``--processes`` forked worker
+processes (like gunicorn's sync workers, one connection each) send
+``--requests`` requests apiece through the full middleware stack, mixing:
+
+* ``GET core:dashboard`` (session read and save, dashboard queries);
+* ``GET orders-list`` (API page);
+* ``POST payments:razorpay_webhook`` (a signed event insert).
+
+Profiles:
+
+* ``stock``: ``django.db.backends.sqlite3`` with a rollback journal,
+  deferred ``BEGIN``, the default 5s busy timeout and no write retries;
+* ``tuned``: the ``DATABASES`` settings (WAL, ``synchronous=NORMAL``,
+  ``BEGIN IMMEDIATE``, busy timeout) and the retrying session and webhook
+  writes.
+
+For each profile it prints throughput, latency percentiles, failed
+requests (5xx; on SQLite under load, "database is locked") and how many
+writes were retried after waiting out the busy timeout. Lock waits within
+the timeout show up in the latency tail.
+
+Usage::
+
+    python -m benchmarks.sqlite_concurrency --processes 8 --requests 300
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROFILES = ('stock', 'tuned')
+WEBHOOK_SECRET = 'whsec_bench'
+
+
+def configure(profile, path):
+    """Point the test settings at ``path`` with ``profile``'s database settings, then set Django up."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rto_project.settings.test')
+    from django.conf import settings
+
+    database = settings.DATABASES['default']
+    database['NAME'] = path
+    if profile == 'stock':
+        database['ENGINE'] = 'django.db.backends.sqlite3'
+        database['OPTIONS'] = {}
+        settings.SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+        settings.DB_WRITE_RETRIES = 0
+    else:
+        pragmas = {**settings.SQLITE_PRAGMAS, 'busy_timeout': 5000}
+        database['OPTIONS']['init_command'] = ';'.join(f'PRAGMA {k}={v}' for k, v in pragmas.items())
+    settings.RAZORPAY_WEBHOOK_SECRET = WEBHOOK_SECRET
+    settings.QUERY_BUDGET_STRICT = False
+    settings.ALLOWED_HOSTS = ['*']
+
+    import django
+    django.setup()
+
+
+def seed(users):
+    from django.contrib.auth import get_user_model
+    from django.core.management import call_command
+    from django.test import Client
+
+    from core.models import Order, RTORecord
+
+    call_command('migrate', verbosity=0)
+    sessions = []
+    for i in range(users):
+        user = get_user_model().objects.create_user(
+            username=f'bench{i}', email=f'bench{i}@example.com', password='x',
+        )
+        record = RTORecord.objects.create(
+            owner=user, name=f'Bench {i}', contact_no='9999999999', address='-', record_type='rto',
+        )
+        Order.objects.create(
+            user=user, rto_record=record, order_id=f'order_bench_{i}',
+            order_type=Order.OrderType.QR_DOWNLOAD, amount=2, total_amount=2,
+        )
+        client = Client()
+        client.force_login(user)
+        sessions.append(client.cookies['sessionid'].value)
+    return sessions
+
+
+def worker(index, sessions, requests):
+    """Send ``requests`` requests as one worker process.
+
+    Returns its ``(latency ms, status)`` pairs and the number of retried writes.
+    """
+    from django.core.cache import cache
+    from django.db import connections
+    from django.test import Client
+    from django.urls import reverse
+
+    from core.utils.db_retry import lock_retries
+    from payments.webhooks import PROCESS_SCHEDULED_KEY
+
+    connections.close_all()
+    # Batched webhook processing runs on Celery in production
+    cache.set(PROCESS_SCHEDULED_KEY, True, None)
+    urls = [reverse('core:dashboard'), reverse('orders-list'), reverse('payments:razorpay_webhook')]
+    results = []
+    for n in range(requests):
+        client = Client(raise_request_exception=False)
+        client.cookies['sessionid'] = sessions[(index + n) % len(sessions)]
+        url = urls[n % len(urls)]
+        started = time.perf_counter()
+        if url == urls[2]:
+            body = json.dumps({'event': 'payment.captured', 'payload': {}, 'id': f'evt_{index}_{n}'}).encode()
+            signature = hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+            response = client.post(url, body, content_type='application/json', headers={
+                'X-Razorpay-Signature': signature, 'X-Razorpay-Event-Id': f'evt_{index}_{n}',
+            })
+        else:
+            response = client.get(url)
+        results.append(((time.perf_counter() - started) * 1000, response.status_code))
+    return results, sum(lock_retries.values())
+
+
+def run_profile(profile, args):
+    """Child process: one profile against a fresh database; prints a JSON summary."""
+    import multiprocessing
+    import logging
+
+    directory = tempfile.mkdtemp(prefix='rto_sqlite_bench_')
+    try:
+        configure(profile, os.path.join(directory, 'bench.sqlite3'))
+        logging.disable(logging.CRITICAL)  # 500s are counted, not logged
+        sessions = seed(args.users)
+
+        from django.db import connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        started = time.perf_counter()
+        with context.Pool(args.processes) as pool:
+            outcomes = pool.starmap(worker, [(i, sessions, args.requests) for i in range(args.processes)])
+        elapsed = time.perf_counter() - started
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    latencies = sorted(ms for results, _ in outcomes for ms, _ in results)
+    statuses = [status for results, _ in outcomes for _, status in results]
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(json.dumps({
+        'profile': profile,
+        'requests': len(latencies),
+        'per_second': len(latencies) / elapsed,
+        'p50': quantiles[49], 'p95': quantiles[94], 'p99': quantiles[98], 'max': latencies[-1],
+        'errors': sum(status >= 500 for status in statuses),
+        'retries': sum(retries for _, retries in outcomes),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=300, help="Requests per process")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--profile', choices=PROFILES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        return run_profile(args.profile, args)
+
+    # Each profile runs in its own interpreter, since settings are fixed at setup
+    print(f"{'profile':>8} {'req/s':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'max ms':>7} {'5xx':>7} {'retries':>8}")
+    for profile in PROFILES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.sqlite_concurrency', '--profile', profile,
+             '--processes', str(args.processes), '--requests', str(args.requests), '--users', str(args.users)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{profile:>8} {result['per_second']:>7.0f} {result['p50']:>7.1f} {result['p95']:>7.1f} "
+              f"{result['p99']:>7.1f} {result['max']:>7.0f} {result['errors']:>7} {result['retries']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark Razorpay webhook ingestion and batched processing.
+
+Creates a throwaway test database with ``--orders`` paid orders, then
+
+* ``ingest``: posts one signed ``payment.captured`` webhook per order to
+  ``payments:razorpay_webhook`` (plus ``--duplicates`` redeliveries each)
+  through the middleware stack from ``--threads`` threads, each with its own
+  database connection, with processing held back as it is within a batch
+  window;
+* ``process``: drains the stored events with ``process_webhook_events``.
+  The post-payment pipeline it enqueues runs on the Celery workers in
+  production, so it is left out of the timing.
+
+Usage::
+
+    DJANGO_SETTINGS_MODULE=rto_project.settings.test \\
+        python -m benchmarks.webhook_ingest --orders 5000 --duplicates 1 --threads 4
+
+Every webhook is a separate commit, so on SQLite the ingest rate is bound by
+the journal's fsync; see ``DATABASES`` for the journal settings.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rto_project.settings.test')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+from django.core.handlers.base import BaseHandler  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from core.models import Order, RTORecord  # noqa: E402
+from payments.models import WebhookEvent  # noqa: E402
+from payments.stub_gateway import RazorpayStub  # noqa: E402
+from payments.webhooks import PROCESS_SCHEDULED_KEY, process_webhook_events  # noqa: E402
+
+
+def make_webhooks(stub, count):
+    user = get_user_model().objects.create_user(username='bench', email='bench@example.com', password='x')
+    record = RTORecord.objects.create(owner=user, name='Bench', contact_no='9999999999', address='-', record_type='rto')
+    webhooks = []
+    orders = []
+    for i in range(count):
+        order = stub.create_order({'amount': 200, 'currency': 'INR'}, {})[1]
+        checkout = stub.pay(order['id'])
+        orders.append(Order(
+            user=user, rto_record=record, order_id=order['id'], order_type=Order.OrderType.QR_DOWNLOAD,
+            amount=2, total_amount=2, payment_status=Order.Status.PENDING, payment_provider='razorpay',
+        ))
+        webhooks.append(stub.webhook('payment.captured', checkout['razorpay_payment_id']))
+    Order.objects.bulk_create(orders, batch_size=500)
+    return webhooks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--duplicates', type=int, default=1, help="Redeliveries per event")
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with override_settings(RAZORPAY_WEBHOOK_SECRET='whsec_bench'), RazorpayStub() as stub:
+            webhooks = make_webhooks(stub, args.orders)
+            handler = BaseHandler()
+            handler.load_middleware()
+            factory = RequestFactory()
+            url = reverse('payments:razorpay_webhook')
+            cache.set(PROCESS_SCHEDULED_KEY, True, None)
+
+            def deliver(webhook):
+                body, headers = webhook
+                for _ in range(1 + args.duplicates):
+                    request = factory.post(url, body, content_type='application/json', headers=headers)
+                    assert handler.get_response(request).status_code == 200
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.threads) as pool:
+                list(pool.map(deliver, webhooks, chunksize=max(1, args.orders // args.threads)))
+            ingest = time.perf_counter() - started
+            requests = args.orders * (1 + args.duplicates)
+            stored = WebhookEvent.objects.count()
+
+            started = time.perf_counter()
+            with mock.patch('payments.webhooks.enqueue_post_payment'):
+                processed = process_webhook_events(batch_size=args.batch_size)
+            process = time.perf_counter() - started
+            cache.delete(PROCESS_SCHEDULED_KEY)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(f"{'stage':>8} {'items':>7} {'seconds':>8} {'per second':>11}")
+    print(f"{'ingest':>8} {requests:>7} {ingest:>8.2f} {requests / ingest:>11.0f}   ({stored} events stored)")
+    print(f"{'process':>8} {processed:>7} {process:>8.2f} {processed / process:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,20 @@
+from datetime import timedelta
+
 from django.contrib import admin
-from .models import RTORecord, Order, PrintOrder
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from .models import RTORecord, Order, PrintOrder, DeployBatch, GalleryRender, DailyOrderRollup
+from .utils.print_sheets import print_sheet_response
+from .utils.query_budget import AdminQueryBudgetMixin
+from .utils.rollups import order_analytics
+
+ANALYTICS_PERIODS = [7, 30, 90, 365]
 
 @admin.register(RTORecord)
-class RTORecordAdmin(admin.ModelAdmin):
+class RTORecordAdmin(AdminQueryBudgetMixin, admin.ModelAdmin):
     list_display = ['name', 'owner', 'record_type', 'status', 'created_at']
+    list_select_related = ['owner']
+    changelist_query_budget = 6
     list_filter = ['status', 'record_type', 'created_at']
     search_fields = ['name', 'contact_no', 'owner__email']
     readonly_fields = ['id', 'created_at', 'updated_at', 'reviewed_at']
@@ -32,14 +43,84 @@ class RTORecordAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(AdminQueryBudgetMixin, admin.ModelAdmin):
     list_display = ['order_id', 'user', 'order_type', 'total_amount', 'payment_status', 'created_at']
+    # Without this the change list joins every order's record as well
+    list_select_related = ['user']
+    changelist_query_budget = 6
     list_filter = ['order_type', 'payment_status', 'payment_provider', 'created_at']
     search_fields = ['order_id', 'user__email', 'rto_record__name']
     readonly_fields = ['order_id', 'total_amount', 'created_at', 'updated_at', 'completed_at']
 
 @admin.register(PrintOrder)
-class PrintOrderAdmin(admin.ModelAdmin):
+class PrintOrderAdmin(AdminQueryBudgetMixin, admin.ModelAdmin):
     list_display = ['order', 'status', 'tracking_number', 'shipping_partner', 'created_at']
+    # Order.__str__ shows the user's email
+    list_select_related = ['order__user']
+    changelist_query_budget = 6
     list_filter = ['status', 'shipping_partner', 'created_at']
     search_fields = ['order__order_id', 'tracking_number']
+    actions = ['download_print_sheet', 'mark_in_production']
+    
+    @admin.action(description="Download production sheet (PDF) for selected cards")
+    def download_print_sheet(self, request, queryset):
+        print_orders = queryset.select_related('order', 'rto_record').order_by('created_at')
+        filename = f"print_sheet_{timezone.now():%Y%m%d_%H%M%S}.pdf"
+        return print_sheet_response(print_orders.iterator(chunk_size=500), filename)
+    
+    @admin.action(description="Mark selected pending cards as in production")
+    def mark_in_production(self, request, queryset):
+        updated = queryset.filter(status=PrintOrder.Status.PENDING).update(
+            status=PrintOrder.Status.IN_PRODUCTION, updated_at=timezone.now()
+        )
+        self.message_user(request, f"{updated} print orders marked as in production.")
+
+@admin.register(DeployBatch)
+class DeployBatchAdmin(AdminQueryBudgetMixin, admin.ModelAdmin):
+    list_display = ['id', 'status', 'commit_sha', 'created_at', 'pushed_at']
+    changelist_query_budget = 6
+    list_filter = ['status', 'created_at']
+    search_fields = ['commit_sha', 'deploys__record__id']
+    readonly_fields = ['status', 'commit_sha', 'error', 'created_at', 'pushed_at']
+
+@admin.register(GalleryRender)
+class GalleryRenderAdmin(AdminQueryBudgetMixin, admin.ModelAdmin):
+    list_display = ['record', 'template_hash', 'output_hash', 'deployed_hash', 'rendered_at']
+    list_select_related = ['record']
+    changelist_query_budget = 6
+    search_fields = ['record__id', 'record__name']
+    readonly_fields = ['record', 'input_hash', 'template_hash', 'output_hash', 'deployed_hash', 'rendered_at']
+
+@admin.register(DailyOrderRollup)
+class OrderAnalyticsAdmin(admin.ModelAdmin):
+    """Revenue and completion analytics, read from the daily rollups only."""
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+    
+    def changelist_view(self, request, extra_context=None):
+        try:
+            days = int(request.GET.get('days', 30))
+        except ValueError:
+            days = 30
+        days = min(max(days, 1), 3660)
+        end = timezone.localdate()
+        start = end - timedelta(days=days - 1)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Order analytics',
+            'opts': self.model._meta,
+            'days': days,
+            'periods': ANALYTICS_PERIODS,
+            'start': start,
+            'end': end,
+            **order_analytics(start, end),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, 'admin/core/order_analytics.html', context)
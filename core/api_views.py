@@ -3,27 +3,33 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
-from django.http import HttpResponse
 from django.conf import settings
 from django.shortcuts import get_object_or_404
-import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-import razorpay
 import hmac
 import hashlib
 
+from .utils.order_utils import checkout_order, get_or_create_gateway_order
+
 from .models import RTORecord, Order, PrintOrder
 from .serializers import RTORecordSerializer, OrderSerializer, QRGenerationSerializer, PaymentSerializer
+from .utils.http_utils import stored_file_response
+from .utils.query_budget import QueryBudgetMixin
+from .utils.qr_pdf import get_qr_pdf, qr_pdf_version
 
-class RTORecordViewSet(viewsets.ModelViewSet):
+class RTORecordViewSet(QueryBudgetMixin, viewsets.ModelViewSet):
     """API for RTO Record Management with full functionality."""
     serializer_class = RTORecordSerializer
     permission_classes = [IsAuthenticated]
     parser_classes = [MultiPartParser, FormParser]
+    # Session, user and the page (or the record), plus a count in ?page= mode
+    query_budgets = {'list': 4, 'retrieve': 3}
     
     def get_queryset(self):
-        return RTORecord.objects.filter(owner=self.request.user)
+        queryset = RTORecord.objects.filter(owner=self.request.user)
+        if self.action in ('list', 'retrieve'):
+            # Writes and the QR actions need the whole row
+            queryset = self.serializer_class.setup_eager_loading(queryset)
+        return queryset
     
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
@@ -45,7 +51,7 @@ class RTORecordViewSet(viewsets.ModelViewSet):
             qr_url = record.generate_qr_code()
             return Response({
                 'success': True,
-                'qr_code_url': qr_url,
+                'qr_code_url': request.build_absolute_uri(qr_url),
                 'record_id': record.id,
                 'message': 'QR code generated successfully!'
             })
@@ -57,55 +63,24 @@ class RTORecordViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def download_qr_pdf(self, request, pk=None):
-        """Generate PDF with QR code for ₹2 payment."""
+        """PDF with QR code for ₹2 payment, stored once per record version."""
         record = self.get_object()
         
-        if not record.qr_code_image:
+        if not record.has_qr_code:
             return Response(
                 {'error': 'Generate QR code first'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         
         try:
-            # Create PDF with QR code
-            buffer = io.BytesIO()
-            p = canvas.Canvas(buffer, pagesize=letter)
-            width, height = letter
-            
-            # Add title
-            p.setFont("Helvetica-Bold", 20)
-            p.drawString(50, height - 80, f"RTO Record QR Code")
-            
-            # Add user info
-            p.setFont("Helvetica-Bold", 14)
-            p.drawString(50, height - 120, f"Name: {record.name}")
-            p.drawString(50, height - 145, f"Contact: {record.contact_no}")
-            p.drawString(50, height - 170, f"Record Type: {record.get_record_type_display()}")
-            
-            # Add QR code image to PDF
-            qr_image_path = record.qr_code_image.path
-            p.drawImage(qr_image_path, 50, height - 450, width=300, height=300)
-            
-            # Add instructions
-            p.setFont("Helvetica", 12)
-            p.drawString(50, height - 480, "Scan this QR code to view all uploaded documents")
-            p.drawString(50, height - 500, f"Record ID: {record.id}")
-            p.drawString(50, height - 520, f"Generated on: {record.created_at.strftime('%Y-%m-%d %H:%M')}")
-            
-            # Add footer
-            p.setFont("Helvetica-Oblique", 10)
-            p.drawString(50, 50, "© RTO Record Management System - Digitally Generated Document")
-            
-            p.showPage()
-            p.save()
-            buffer.seek(0)
-            
-            # Return PDF response
-            response = HttpResponse(content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="RTO_QR_Code_{record.name}_{record.id}.pdf"'
-            response.write(buffer.getvalue())
-            
-            return response
+            version = qr_pdf_version(record)
+            # Built (or rebuilt after an edit) only when the client's copy is stale
+            return stored_file_response(
+                request, lambda: get_qr_pdf(record, version), f'"{version}"',
+                filename=f"RTO_QR_Code_{record.name}_{record.id}.pdf",
+                content_type='application/pdf',
+                max_age=settings.QR_PDF_CACHE_MAX_AGE,
+            )
             
         except Exception as e:
             return Response(
@@ -121,50 +96,37 @@ class PaymentViewSet(viewsets.ViewSet):
     def create_razorpay_order(self, request):
         """Create Razorpay order for payment processing."""
         try:
-            client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-            
             serializer = PaymentSerializer(data=request.data)
             if not serializer.is_valid():
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
             
-            amount = int(float(serializer.validated_data['amount']) * 100)  # Convert to paisa
+            amount = serializer.validated_data['amount']  # rupees
             order_type = serializer.validated_data['order_type']
             record_id = serializer.validated_data['record_id']
             
             # Verify record belongs to user
             record = get_object_or_404(RTORecord, id=record_id, owner=request.user)
             
-            # Create order in Razorpay
-            razorpay_order = client.order.create({
-                'amount': amount,
-                'currency': 'INR',
-                'receipt': f'{order_type}_{record_id}_{request.user.id}',
-                'notes': {
-                    'user_id': request.user.id,
-                    'record_id': str(record_id),
-                    'order_type': order_type
-                }
-            })
-            
-            # Create order in our database
-            order = Order.objects.create(
-                user=request.user,
-                rto_record=record,
-                order_id=razorpay_order['id'],
-                order_type=order_type,
-                amount=amount/100,  # Convert paisa to rupees
-                total_amount=amount/100,
-                payment_provider='razorpay',
-                payment_provider_id=razorpay_order['id'],
+            # Reuses a pending order for the same record, type and amount
+            order, _created = get_or_create_gateway_order(
+                request.user, record, order_type, amount,
+                gateway_data={
+                    'receipt': f'{order_type}_{record_id}_{request.user.id}',
+                    'notes': {
+                        'user_id': request.user.id,
+                        'record_id': str(record_id),
+                        'order_type': order_type
+                    },
+                },
                 delivery_address=serializer.validated_data.get('delivery_address', ''),
                 delivery_phone=serializer.validated_data.get('delivery_phone', ''),
-                delivery_pincode=serializer.validated_data.get('delivery_pincode', '')
+                delivery_pincode=serializer.validated_data.get('delivery_pincode', ''),
             )
             
             return Response({
                 'success': True,
-                'order_id': razorpay_order['id'],
-                'amount': amount,
+                'order_id': order.order_id,
+                'amount': checkout_order(order)['amount'],
                 'currency': 'INR',
                 'key': settings.RAZORPAY_KEY_ID,
                 'name': 'RTO Record Management',
@@ -205,7 +167,7 @@ class PaymentViewSet(viewsets.ViewSet):
             
             if generated_signature == signature:
                 # Payment successful - update order
-                order = Order.objects.get(payment_provider_id=order_id, user=request.user)
+                order = Order.objects.get(order_id=order_id, user=request.user)
                 order.payment_status = 'completed'
                 order.save()
                 
@@ -240,10 +202,11 @@ class PaymentViewSet(viewsets.ViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class OrderViewSet(viewsets.ReadOnlyModelViewSet):
+class OrderViewSet(QueryBudgetMixin, viewsets.ReadOnlyModelViewSet):
     """API for viewing user orders."""
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    query_budgets = {'list': 4, 'retrieve': 3}
     
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        return self.serializer_class.setup_eager_loading(Order.objects.filter(user=self.request.user))
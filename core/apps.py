@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Connects the receivers that invalidate the dashboard counters
+        from .utils import dashboard_stats  # noqa: F401
@@ -0,0 +1,71 @@
+"""Impose pending PVC/NFC card orders onto N-up production sheets.
+
+Usage:
+    python manage.py build_print_sheets --output sheets.pdf
+    python manage.py build_print_sheets --order-type nfc_card --per-sheet 8 --mark-in-production
+
+Cards are printed oldest order first. ``--mark-in-production`` moves exactly
+the printed orders out of the pending queue, so the next run starts after them.
+"""
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import Order, PrintOrder
+from core.utils.print_sheets import SheetLayout, write_print_sheets
+
+CARD_ORDER_TYPES = [Order.OrderType.PVC_CARD, Order.OrderType.NFC_CARD]
+
+
+class Command(BaseCommand):
+    help = "Write a PDF of print-ready card sheets for pending print orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="PDF path (default: print_sheets_<timestamp>.pdf)")
+        parser.add_argument('--order-type', choices=CARD_ORDER_TYPES)
+        parser.add_argument('--status', choices=PrintOrder.Status.values, default=PrintOrder.Status.PENDING)
+        parser.add_argument('--limit', type=int, help="Print at most this many cards")
+        parser.add_argument('--page-size', default=settings.PRINT_SHEET_PAGE_SIZE)
+        parser.add_argument('--per-sheet', type=int, help="Cards per sheet (default: as many as fit)")
+        parser.add_argument('--mark-in-production', action='store_true',
+                            help="Move the printed pending orders to in production")
+
+    def handle(self, *args, **options):
+        try:
+            layout = SheetLayout(options['page_size'], per_sheet=options['per_sheet'])
+        except (AttributeError, ValueError) as e:
+            raise CommandError(f"Invalid sheet layout: {e}")
+
+        print_orders = PrintOrder.objects.filter(
+            status=options['status'],
+            order__order_type__in=[options['order_type']] if options['order_type'] else CARD_ORDER_TYPES,
+        ).select_related('order', 'rto_record').order_by('created_at', 'pk')
+        if options['limit']:
+            print_orders = print_orders[:options['limit']]
+        # Pinned up front so orders arriving mid-run are neither printed nor marked
+        ids = list(print_orders.values_list('pk', flat=True))
+        if not ids:
+            self.stdout.write("No print orders to print")
+            return
+
+        output = options['output'] or f"print_sheets_{timezone.now():%Y%m%d_%H%M%S}.pdf"
+        tmp_path = f'{output}.tmp'
+        with open(tmp_path, 'wb') as f:
+            count = write_print_sheets(
+                PrintOrder.objects.filter(pk__in=ids).select_related('order', 'rto_record')
+                .order_by('created_at', 'pk').iterator(chunk_size=500),
+                f, layout,
+            )
+        os.replace(tmp_path, output)
+        sheets = -(-count // layout.per_sheet)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} cards on {sheets} sheets ({layout.per_sheet} per sheet) to {output}"
+        ))
+
+        if options['mark_in_production']:
+            updated = PrintOrder.objects.filter(pk__in=ids, status=PrintOrder.Status.PENDING).update(
+                status=PrintOrder.Status.IN_PRODUCTION, updated_at=timezone.now()
+            )
+            self.stdout.write(f"Marked {updated} print orders as in production")
@@ -0,0 +1,172 @@
+"""Move existing gallery folders in deploy_site into the configured layout.
+
+Usage:
+    python manage.py migrate_deploy_layout               # to DEPLOY_SITE_LAYOUT
+    python manage.py migrate_deploy_layout --layout sharded --dry-run
+
+Moved galleries get ``_redirects`` rules serving them at their old URL, so
+QR codes already printed keep working; the QR codes themselves are then
+regenerated for the new URLs.
+"""
+import os
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import GalleryRender, RTORecord
+from core.utils.deploy_utils import deploy_lock, publish_paths
+from core.utils.gallery_utils import (
+    SHARD_ROOT, _file_hash, generate_qr_code_for_record, get_gallery_dir,
+    get_gallery_url, write_redirects,
+)
+
+LAYOUTS = ['flat', 'sharded']
+
+
+def _parse_uuid(value):
+    try:
+        return str(uuid.UUID(value))
+    except ValueError:
+        return None
+
+
+def find_gallery_folders(site_dir):
+    """Yield ``(record_id, path)`` for every gallery folder in either layout."""
+    with os.scandir(site_dir) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.name.startswith('record_'):
+                record_id = _parse_uuid(entry.name[len('record_'):])
+                if record_id:
+                    yield record_id, entry.path
+
+    shard_root = os.path.join(site_dir, SHARD_ROOT)
+    if not os.path.isdir(shard_root):
+        return
+    for first in os.scandir(shard_root):
+        if not first.is_dir():
+            continue
+        for second in os.scandir(first.path):
+            if not second.is_dir():
+                continue
+            for entry in os.scandir(second.path):
+                record_id = _parse_uuid(entry.name)
+                if entry.is_dir() and record_id:
+                    yield record_id, entry.path
+
+
+class Command(BaseCommand):
+    help = "Move deploy_site gallery folders into the flat or sharded layout and publish the result"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--layout', choices=LAYOUTS,
+                            help="Target layout (default: DEPLOY_SITE_LAYOUT)")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would move")
+        parser.add_argument('--no-deploy', action='store_true', help="Skip the commit and push")
+
+    def handle(self, *args, **options):
+        layout = options['layout'] or settings.DEPLOY_SITE_LAYOUT
+        if layout not in LAYOUTS:
+            raise CommandError(f"Unknown layout {layout!r}")
+        if layout != settings.DEPLOY_SITE_LAYOUT and not options['dry_run']:
+            raise CommandError(
+                f"DEPLOY_SITE_LAYOUT is {settings.DEPLOY_SITE_LAYOUT!r}; set it to {layout!r} "
+                "first so new renders and gallery URLs use the same layout"
+            )
+        site_dir = settings.DEPLOY_SITE_DIR
+
+        folders = list(find_gallery_folders(site_dir))
+        known_ids = {
+            str(pk) for pk in RTORecord.objects.filter(pk__in=[rid for rid, _ in folders])
+            .values_list('pk', flat=True)
+        }
+
+        moves, orphans = [], 0
+        for record_id, path in folders:
+            if record_id not in known_ids:
+                # Without a record there is no routing rule, so leave it where it is served today
+                orphans += 1
+                continue
+            target = get_gallery_dir(record_id, layout)
+            if os.path.normpath(path) != os.path.normpath(target):
+                moves.append((record_id, path, target))
+
+        self.stdout.write(
+            f"{len(folders)} gallery folders, {len(moves)} to move into the {layout} layout, "
+            f"{orphans} without a record left in place"
+        )
+        if options['dry_run']:
+            return
+
+        # Keep batched deploys from committing a half-moved tree
+        with deploy_lock():
+            self._migrate(site_dir, layout, moves, options['no_deploy'])
+
+    def _migrate(self, site_dir, layout, moves, no_deploy):
+        for i, (record_id, path, target) in enumerate(moves, 1):
+            if os.path.exists(target):
+                raise CommandError(f"{target} already exists; refusing to overwrite it with {path}")
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(path, target)
+            if i % 1000 == 0:
+                self.stdout.write(f"  moved {i}/{len(moves)}")
+        self._remove_empty_shards(site_dir)
+        self._record_manifest([record_id for record_id, _, _ in moves])
+
+        if write_redirects(
+            (self._site_path(site_dir, path), self._site_path(site_dir, target)) for _, path, target in moves
+        ):
+            self.stdout.write(f"Added _redirects rules for {len(moves)} moved galleries")
+        refreshed = self._refresh_qr_targets()
+        self.stdout.write(f"Regenerated {refreshed} QR codes whose gallery URL changed")
+
+        if moves and not no_deploy:
+            sha = publish_paths(
+                [site_dir],
+                f"Move {len(moves)} document galleries into the {layout} layout",
+            )
+            self.stdout.write(self.style.SUCCESS(f"Published {sha}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Done"))
+
+    def _site_path(self, site_dir, path):
+        return os.path.relpath(path, site_dir).replace(os.sep, '/')
+
+    def _remove_empty_shards(self, site_dir):
+        shard_root = os.path.join(site_dir, SHARD_ROOT)
+        for dirpath, dirnames, filenames in os.walk(shard_root, topdown=False):
+            if not os.listdir(dirpath):
+                os.rmdir(dirpath)
+
+    def _record_manifest(self, record_ids):
+        """Add manifest rows for moved folders rendered before the manifest existed.
+
+        The empty input hash makes the next render rebuild the page, while
+        the output hash lets deploys skip it until its bytes actually change.
+        """
+        existing = set(
+            str(pk) for pk in GalleryRender.objects.filter(record_id__in=record_ids)
+            .values_list('record_id', flat=True)
+        )
+        rows = []
+        for record_id in record_ids:
+            if record_id in existing:
+                continue
+            output_hash = _file_hash(os.path.join(get_gallery_dir(record_id), 'index.html'))
+            rows.append(GalleryRender(
+                record_id=record_id, input_hash='', template_hash='',
+                output_hash=output_hash, deployed_hash=output_hash,
+            ))
+        GalleryRender.objects.bulk_create(rows, batch_size=1000)
+
+    def _refresh_qr_targets(self):
+        """Regenerate QR codes only for records whose public gallery URL changed."""
+        refreshed = 0
+        for record in RTORecord.objects.exclude(gallery_html_url='').iterator(chunk_size=1000):
+            url = get_gallery_url(record)
+            if record.gallery_html_url == url:
+                continue
+            record.gallery_html_url = url
+            generate_qr_code_for_record(record, url)  # saves the record
+            refreshed += 1
+        return refreshed
@@ -0,0 +1,130 @@
+"""Copy every table of the SQLite database into the PostgreSQL one.
+
+Usage:
+    DATABASE_URL=postgres://... python manage.py migrate
+    DATABASE_URL=postgres://... python manage.py migrate_sqlite_to_postgres
+    DATABASE_URL=postgres://... python manage.py migrate_sqlite_to_postgres --source /srv/rto/db.sqlite3 --truncate
+
+Both databases must be on the same migrations. Rows are streamed from
+SQLite in ``--batch-size`` batches and loaded with ``COPY ... FROM STDIN``,
+all in one transaction, so a failed run leaves PostgreSQL as it was. Keys
+are copied as they are and the id sequences are moved past them afterwards.
+
+Content types and permissions, which ``migrate`` creates on its own, are
+replaced by the SQLite ones so their ids match the rows pointing at them.
+Any other table must be empty unless ``--truncate`` is given.
+"""
+import io
+import sqlite3
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+
+# Filled in by ``migrate`` itself, so they are never empty on the target
+REGENERATED = (ContentType, Permission)
+
+
+def csv_value(value):
+    """One field of a ``COPY ... (FORMAT csv)`` row: NULL is an unquoted empty field."""
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        return '\\x' + value.hex()
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+class Command(BaseCommand):
+    help = "Copy the data of the SQLite database into the PostgreSQL DATABASE_URL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(settings.BASE_DIR / 'db.sqlite3'), help="SQLite file to copy from")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Rows per COPY")
+        parser.add_argument('--truncate', action='store_true', help="Empty tables that already have rows")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The default database is not PostgreSQL; set DATABASE_URL")
+        try:
+            source = sqlite3.connect(f"file:{options['source']}?mode=ro", uri=True)
+        except sqlite3.OperationalError as exc:
+            raise CommandError(f"Cannot open {options['source']}: {exc}")
+        try:
+            self.check_migrations(source)
+            models = self.models_to_copy(source)
+            with transaction.atomic():
+                self.empty_tables(models, options['truncate'])
+                for model in models:
+                    started = time.perf_counter()
+                    copied = self.copy_table(source, model, options['batch_size'])
+                    self.stdout.write(f"{model._meta.db_table}: {copied} rows in {time.perf_counter() - started:.1f}s")
+                with connection.cursor() as cursor:
+                    for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                        cursor.execute(sql)
+                self.verify(source, models)
+        finally:
+            source.close()
+        self.stdout.write(self.style.SUCCESS(f"Copied {len(models)} tables"))
+
+    def check_migrations(self, source):
+        executor = MigrationExecutor(connection)
+        if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            raise CommandError("PostgreSQL has unapplied migrations; run migrate first")
+        try:
+            rows = source.execute('SELECT app, name FROM django_migrations').fetchall()
+        except sqlite3.OperationalError:
+            raise CommandError("The source is not a migrated Django database")
+        missing = set(executor.loader.applied_migrations) - set(rows)
+        if missing:
+            names = ', '.join(sorted(f'{app}.{name}' for app, name in missing))
+            raise CommandError(f"The source database is missing migrations: {names}")
+
+    def models_to_copy(self, source):
+        tables = {name for name, in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return [
+            model for model in apps.get_models(include_auto_created=True)
+            if model._meta.managed and not model._meta.proxy and model._meta.db_table in tables
+        ]
+
+    def empty_tables(self, models, truncate):
+        if not truncate:
+            for model in models:
+                if model not in REGENERATED and model._base_manager.exists():
+                    raise CommandError(
+                        f"{model._meta.db_table} already has rows; pass --truncate to replace them"
+                    )
+        tables = ', '.join(connection.ops.quote_name(model._meta.db_table) for model in models)
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {tables} RESTART IDENTITY CASCADE')
+
+    def copy_table(self, source, model, batch_size):
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(field.column) for field in model._meta.local_concrete_fields)
+        table = quote(model._meta.db_table)
+        rows = source.execute(f'SELECT {columns} FROM {table}')
+        copied = 0
+        with connection.cursor() as cursor:
+            while batch := rows.fetchmany(batch_size):
+                buffer = io.StringIO()
+                for row in batch:
+                    buffer.write(','.join(map(csv_value, row)) + '\n')
+                buffer.seek(0)
+                cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+                copied += len(batch)
+        return copied
+
+    def verify(self, source, models):
+        for model in models:
+            table = model._meta.db_table
+            expected, = source.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}').fetchone()
+            copied = model._base_manager.count()
+            if copied != expected:
+                raise CommandError(f"{table}: copied {copied} rows but the source has {expected}")
@@ -0,0 +1,27 @@
+"""Bring the analytics rollup tables up to date.
+
+Usage:
+    python manage.py refresh_rollups          # days changed since the last run
+    python manage.py refresh_rollups --full   # rebuild every day
+
+The Celery beat schedule runs the incremental refresh every few minutes;
+``--full`` is for the first run and after bulk data fixes that bypassed
+``updated_at``.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from core.utils.rollups import refresh_rollups
+
+
+class Command(BaseCommand):
+    help = "Refresh the daily order and transaction rollups"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Recompute every day instead of changed ones")
+
+    def handle(self, *args, **options):
+        refreshed = refresh_rollups(full=options['full'])
+        if refreshed is None:
+            raise CommandError("Another rollup refresh is running")
+        for name, days in refreshed.items():
+            self.stdout.write(f"{name}: recomputed {days} days")
@@ -0,0 +1,196 @@
+"""Re-render existing static galleries after a template or rendering change.
+
+Usage:
+    python manage.py regenerate_galleries --only-stale
+    python manage.py regenerate_galleries --record-type school --created-after 2024-01-01 --workers 8
+
+Records are streamed in primary key order and rendered in a process pool.
+After every chunk the manifest is saved and a checkpoint is written, so an
+interrupted run resumes where it stopped when started again with the same
+filters. Every changed page is published in a single deploy at the end.
+"""
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import GalleryDeploy, GalleryRender, RTORecord
+from core.utils.deploy_utils import flush_gallery_deploys
+from core.utils.gallery_utils import gallery_template_hash, get_gallery_dir, static_galleries_enabled
+from core.utils.render_pool import init_worker, render_gallery_job
+
+
+class Command(BaseCommand):
+    help = "Re-render static document galleries in parallel and publish them in one deploy"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--record-type', choices=RTORecord.RecordType.values)
+        parser.add_argument('--created-after', type=date.fromisoformat, help="YYYY-MM-DD, inclusive")
+        parser.add_argument('--created-before', type=date.fromisoformat, help="YYYY-MM-DD, exclusive")
+        parser.add_argument('--only-stale', action='store_true',
+                            help="Only galleries rendered with older templates or never recorded")
+        parser.add_argument('--force', action='store_true', help="Re-render even up-to-date pages")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--checkpoint', help="Checkpoint file (default: under DEPLOY_REPO_DIR/.deploy_tmp)")
+        parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint")
+        parser.add_argument('--no-deploy', action='store_true', help="Render only; deploy later")
+
+    def handle(self, *args, **options):
+        if not static_galleries_enabled():
+            raise CommandError("GALLERY_BACKEND is not 'static'; the gallery view re-renders on its own")
+
+        template_hash = gallery_template_hash()
+        filters = {
+            'record_type': options['record_type'],
+            'created_after': options['created_after'] and options['created_after'].isoformat(),
+            'created_before': options['created_before'] and options['created_before'].isoformat(),
+            'only_stale': options['only_stale'],
+            'force': options['force'],
+            'template_hash': template_hash,
+        }
+        checkpoint_path = options['checkpoint'] or os.path.join(
+            settings.DEPLOY_REPO_DIR, '.deploy_tmp', 'regenerate_galleries.json'
+        )
+        checkpoint = self._load_checkpoint(checkpoint_path, filters, options['restart'])
+
+        records = self._records(options, template_hash)
+        if checkpoint['last_pk']:
+            records = records.filter(pk__gt=checkpoint['last_pk'])
+        total = records.count()
+        self.stdout.write(
+            f"{total} galleries to check"
+            + (f" (resuming after {checkpoint['processed']} done)" if checkpoint['processed'] else "")
+        )
+
+        started = time.monotonic()
+        processed = rendered = 0
+        pool = None
+        if options['workers'] > 1:
+            pool = ProcessPoolExecutor(
+                max_workers=options['workers'], mp_context=get_context('spawn'), initializer=init_worker,
+            )
+        try:
+            stream = records.order_by('pk').iterator(chunk_size=options['chunk_size'])
+            while chunk := list(itertools.islice(stream, options['chunk_size'])):
+                chunk_rendered = self._render_chunk(chunk, template_hash, options['force'], pool)
+                rendered += chunk_rendered
+                processed += len(chunk)
+
+                checkpoint['last_pk'] = str(chunk[-1].pk)
+                checkpoint['processed'] += len(chunk)
+                checkpoint['rendered'] += chunk_rendered
+                self._save_checkpoint(checkpoint_path, checkpoint)
+
+                elapsed = time.monotonic() - started
+                rate = processed / elapsed if elapsed else 0
+                eta = (total - processed) / rate if rate else 0
+                self.stdout.write(
+                    f"  {processed}/{total} checked, {rendered} re-rendered, "
+                    f"{rate:.0f} records/s, ETA {eta:.0f}s"
+                )
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        if options['no_deploy']:
+            self.stdout.write(self.style.SUCCESS(f"Re-rendered {rendered} galleries; not deployed"))
+        else:
+            self._deploy()
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    def _records(self, options, template_hash):
+        # Only records that already have a gallery
+        records = RTORecord.objects.filter(Q(gallery_render__isnull=False) | ~Q(gallery_html_url=''))
+        if options['record_type']:
+            records = records.filter(record_type=options['record_type'])
+        if options['created_after']:
+            records = records.filter(created_at__date__gte=options['created_after'])
+        if options['created_before']:
+            records = records.filter(created_at__date__lt=options['created_before'])
+        if options['only_stale']:
+            records = records.exclude(gallery_render__template_hash=template_hash)
+        return records
+
+    def _render_chunk(self, chunk, template_hash, force, pool):
+        """Render a chunk and save its manifest rows; returns how many pages changed."""
+        manifests = {
+            render.record_id: render
+            for render in GalleryRender.objects.filter(record_id__in=[record.pk for record in chunk])
+        }
+        jobs = []
+        for record in chunk:
+            render = manifests.get(record.pk)
+            manifest = render and (render.input_hash, render.template_hash, render.output_hash)
+            page_path = os.path.join(get_gallery_dir(record.pk), 'index.html')
+            jobs.append((record, page_path, manifest, template_hash, force))
+
+        results = pool.map(render_gallery_job, jobs, chunksize=16) if pool else map(render_gallery_job, jobs)
+
+        now = timezone.now()
+        updated, created = [], []
+        for record_id, hashes in results:
+            if hashes is None:
+                continue
+            input_hash, output_hash = hashes
+            render = manifests.get(record_id) or GalleryRender(record_id=record_id)
+            render.input_hash, render.template_hash = input_hash, template_hash
+            render.output_hash, render.rendered_at = output_hash, now
+            (updated if record_id in manifests else created).append(render)
+        GalleryRender.objects.bulk_update(
+            updated, ['input_hash', 'template_hash', 'output_hash', 'rendered_at'], batch_size=500,
+        )
+        GalleryRender.objects.bulk_create(created, batch_size=500)
+        return len(updated) + len(created)
+
+    def _deploy(self):
+        """Queue every page that differs from what is live and publish it as one batch."""
+        pending = GalleryDeploy.objects.filter(batch__isnull=True)
+        undeployed = list(
+            GalleryRender.objects.undeployed()
+            .exclude(record_id__in=pending.values('record_id'))
+            .values_list('record_id', flat=True)
+        )
+        GalleryDeploy.objects.bulk_create(
+            [GalleryDeploy(record_id=record_id) for record_id in undeployed], batch_size=500,
+        )
+        pending = pending.count()
+        if not pending:
+            self.stdout.write(self.style.SUCCESS("Every gallery is already live"))
+            return
+        batches = flush_gallery_deploys(max_size=pending)
+        if batches:
+            self.stdout.write(self.style.SUCCESS(
+                f"Published {pending} galleries in {batches[0].commit_sha}"
+            ))
+        else:
+            self.stdout.write(self.style.WARNING(
+                "Another deploy is running; the regenerated galleries join its next batch"
+            ))
+
+    def _load_checkpoint(self, path, filters, restart):
+        fresh = {'filters': filters, 'last_pk': None, 'processed': 0, 'rendered': 0}
+        if restart or not os.path.exists(path):
+            return fresh
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('filters') != filters:
+            self.stdout.write("Checkpoint was written for different options; starting over")
+            return fresh
+        return checkpoint
+
+    def _save_checkpoint(self, path, checkpoint):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
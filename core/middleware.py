@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+class StatementTimeoutMiddleware:
+    """Cap each request's queries with PostgreSQL's ``statement_timeout``.
+
+    Page views and API reads get ``DB_STATEMENT_TIMEOUTS['read']``, writes
+    ``['write']`` and the admin ``['admin']``, so a runaway query fails that
+    request instead of holding a worker and its connection. The setting is
+    reset afterwards, since the connection outlives the request. Not used on
+    SQLite.
+    """
+
+    def __init__(self, get_response):
+        if connection.vendor != 'postgresql':
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def request_type(self, request):
+        if request.path.startswith('/admin/'):
+            return 'admin'
+        return 'read' if request.method in READ_METHODS else 'write'
+
+    def __call__(self, request):
+        timeout = settings.DB_STATEMENT_TIMEOUTS[self.request_type(request)]
+        with connection.cursor() as cursor:
+            cursor.execute('SET statement_timeout = %s', [timeout])
+        try:
+            return self.get_response(request)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('RESET statement_timeout')
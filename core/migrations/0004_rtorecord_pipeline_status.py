@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-16 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rtorecord',
+            name='pipeline_status',
+            field=models.JSONField(blank=True, default=dict, help_text='Per-stage status of the post-payment pipeline'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.7 on 2026-10-16 23:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_rtorecord_pipeline_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeployBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('pushed', 'Pushed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('commit_sha', models.CharField(blank=True, max_length=40)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('pushed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Deploy Batch',
+                'verbose_name_plural': 'Deploy Batches',
+                'db_table': 'deploy_batch',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='GalleryDeploy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_at', models.DateTimeField(auto_now_add=True)),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deploys', to='core.deploybatch')),
+                ('record', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='gallery_deploys', to='core.rtorecord')),
+            ],
+            options={
+                'verbose_name': 'Gallery Deploy',
+                'verbose_name_plural': 'Gallery Deploys',
+                'db_table': 'gallery_deploy',
+                'ordering': ['requested_at'],
+            },
+        ),
+    ]
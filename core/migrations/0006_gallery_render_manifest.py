@@ -0,0 +1,30 @@
+# Generated by Django 5.0.7 on 2026-10-16 23:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_deploy_batches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GalleryRender',
+            fields=[
+                ('record', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='gallery_render', serialize=False, to='core.rtorecord')),
+                ('input_hash', models.CharField(help_text='Hash of record fields and document URLs', max_length=64)),
+                ('template_hash', models.CharField(db_index=True, help_text='Hash of the gallery templates', max_length=64)),
+                ('output_hash', models.CharField(help_text='Hash of the written index.html', max_length=64)),
+                ('deployed_hash', models.CharField(blank=True, help_text='Output hash of the last deployed page', max_length=64)),
+                ('rendered_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Gallery Render',
+                'verbose_name_plural': 'Gallery Renders',
+                'db_table': 'gallery_render',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-16 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_gallery_render_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rtorecord',
+            name='qr_payload',
+            field=models.TextField(blank=True, help_text='Data encoded in the QR code; the QR endpoint renders from it'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-17 00:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_rtorecord_qr_payload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['rto_record', 'order_type', 'payment_status', 'created_at'], name='order_reuse_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.0.7 on 2026-10-17 00:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_order_reuse_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('order_type', models.CharField(choices=[('qr_download', 'QR Download'), ('pvc_card', 'PVC Card'), ('nfc_card', 'NFC Card')], max_length=20)),
+                ('payment_status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('refunded', 'Refunded')], max_length=20)),
+                ('provider', models.CharField(max_length=20)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': 'Order Analytics',
+                'verbose_name_plural': 'Order Analytics',
+                'db_table': 'daily_order_rollup',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupDirtyDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rollup', models.CharField(max_length=50)),
+                ('day', models.DateField()),
+            ],
+            options={
+                'db_table': 'rollup_dirty_day',
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('watermark', models.DateTimeField(blank=True, help_text='Source rows changed since then are pending', null=True)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'rollup_state',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='order_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='order_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyorderrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'order_type', 'payment_status', 'provider'), name='daily_order_rollup_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='rollupdirtyday',
+            constraint=models.UniqueConstraint(fields=('rollup', 'day'), name='rollup_dirty_day_key'),
+        ),
+    ]
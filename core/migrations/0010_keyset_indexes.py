@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-17 00:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_order_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='order_user_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rtorecord',
+            index=models.Index(fields=['owner', 'created_at', 'id'], name='record_owner_keyset_idx'),
+        ),
+    ]
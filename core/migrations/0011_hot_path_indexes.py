@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-17 00:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'order_type', 'created_at'], name='order_user_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_provider_payment_id'], name='order_payment_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='printorder',
+            index=models.Index(fields=['status', 'created_at'], name='print_order_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rtorecord',
+            index=models.Index(fields=['owner', 'status'], name='record_owner_status_idx'),
+        ),
+    ]
@@ -5,14 +5,13 @@ from django.contrib.auth import get_user_model
 from django.core.validators import FileExtensionValidator
 from django.utils import timezone
 from django.urls import reverse
-import qrcode
-from io import BytesIO
-from django.core.files import File
-from PIL import Image
 import json
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from core.utils.change_tracking import ChangeTrackingMixin
+from core.utils.qr_utils import save_qr_to_record
+
 
 User = get_user_model()
 
@@ -23,12 +22,16 @@ def upload_to_user_folder(instance, filename):
     filename = f"{uuid.uuid4()}.{ext}"
     return f"user_uploads/{instance.owner.id}/{filename}"
 
-class RTORecord(models.Model):
+class RTORecord(ChangeTrackingMixin, models.Model):
     """Main RTO record model storing all document information."""
     
     # NEW FIELDS for Cloudinary + Netlify integration
     gallery_html_url = models.URLField(blank=True, help_text="Netlify hosted gallery URL")
     cloudinary_urls = models.JSONField(default=list, help_text="Cloudinary document URLs")
+    pipeline_status = models.JSONField(
+        default=dict, blank=True,
+        help_text="Per-stage status of the post-payment pipeline"
+    )
     
     class RecordType(models.TextChoices):
         RC = 'rc', 'RC Record'
@@ -41,6 +44,13 @@ class RTORecord(models.Model):
         APPROVED = 'approved', 'Approved'
         REJECTED = 'rejected', 'Rejected'
     
+    class StageStatus(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        RETRYING = 'retrying', 'Retrying'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+    
     # Basic Information
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rto_records')
@@ -81,6 +91,10 @@ class RTORecord(models.Model):
         upload_to='qr_codes/', blank=True, null=True,
         help_text="Generated QR code image"
     )
+    qr_payload = models.TextField(
+        blank=True,
+        help_text="Data encoded in the QR code; the QR endpoint renders from it"
+    )
     pdf_card_filepath = models.CharField(
         max_length=500, blank=True,
         help_text="Path to generated PDF card"
@@ -101,6 +115,12 @@ class RTORecord(models.Model):
         verbose_name = 'RTO Record'
         verbose_name_plural = 'RTO Records'
         ordering = ['-created_at']
+        indexes = [
+            # Dashboard record list and API keyset pages (core.pagination)
+            models.Index(fields=['owner', 'created_at', 'id'], name='record_owner_keyset_idx'),
+            # Dashboard counts (core.utils.dashboard_stats)
+            models.Index(fields=['owner', 'status'], name='record_owner_status_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} - {self.get_record_type_display()} ({self.get_status_display()})"
@@ -123,32 +143,39 @@ class RTORecord(models.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
         
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(json.dumps(qr_data))
-        qr.make(fit=True)
-        
-        # Create QR image
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Save to model
-        blob = BytesIO()
-        img.save(blob, 'PNG')
-        blob.seek(0)
-        
-        self.qr_code_image.save(
-            f'qr_{self.id}.png',
-            File(blob),
-            save=False
-        )
+        # Rendered once per payload and reused from the QR cache
+        save_qr_to_record(self, json.dumps(qr_data))
         self.save()
         
-        return self.qr_code_image.url
+        return self.get_qr_code_url()
+
+    @property
+    def has_qr_code(self):
+        """Whether a QR code was generated (the image itself is an optional cache)."""
+        return bool(self.qr_payload or self.qr_code_image)
+
+    def get_qr_code_url(self):
+        return reverse('core:record_qr', kwargs={'record_id': self.id})
+
+    def get_stage_status(self, stage):
+        """Return the recorded status of a post-payment pipeline stage."""
+        return self.pipeline_status.get(stage, {}).get('status')
+
+    def is_stage_done(self, stage, run):
+        """Check whether a pipeline stage already completed for this run."""
+        entry = self.pipeline_status.get(stage, {})
+        return entry.get('status') == self.StageStatus.DONE and entry.get('run') == run
+
+    def set_stage_status(self, stage, status, run='', error='', save=True):
+        """Record the status of a single post-payment pipeline stage."""
+        self.pipeline_status[stage] = {
+            'status': status,
+            'run': run,
+            'error': error,
+            'updated_at': timezone.now().isoformat(),
+        }
+        if save:
+            self.save(update_fields=['pipeline_status'])
 
     def get_document_count(self):
         """Get count of uploaded documents."""
@@ -164,13 +191,8 @@ class RTORecord(models.Model):
         return self.get_document_count() > 0
     
     def save(self, *args, **kwargs):
-        if self.pk:
-            try:
-                old_record = RTORecord.objects.get(pk=self.pk)
-            except RTORecord.DoesNotExist:
-                old_record = None
-            if old_record and old_record.status != self.status and self.status in ['approved', 'rejected']:
-                self.reviewed_at = timezone.now()
+        if not self._state.adding and self.has_changed('status') and self.status in ['approved', 'rejected']:
+            self.reviewed_at = timezone.now()
         super().save(*args, **kwargs)
 
 # core/models.py
@@ -190,7 +212,7 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
     else:
         instance.core_profile.save()
         
-class Order(models.Model):
+class Order(ChangeTrackingMixin, models.Model):
     """Order model for handling payments and delivery."""
     
     class Status(models.TextChoices):
@@ -237,6 +259,19 @@ class Order(models.Model):
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
         ordering = ['-created_at']
+        indexes = [
+            # Pending order reuse lookup (core.utils.order_utils)
+            models.Index(fields=['rto_record', 'order_type', 'payment_status', 'created_at'], name='order_reuse_idx'),
+            # Analytics rollups (core.utils.rollups)
+            models.Index(fields=['updated_at'], name='order_updated_idx'),
+            models.Index(fields=['created_at'], name='order_created_idx'),
+            # API keyset pages (core.pagination)
+            models.Index(fields=['user', 'created_at', 'id'], name='order_user_keyset_idx'),
+            # Card orders page (orders_view)
+            models.Index(fields=['user', 'order_type', 'created_at'], name='order_user_type_idx'),
+            # Refund webhooks find orders by payment id (payments.webhooks)
+            models.Index(fields=['payment_provider_payment_id'], name='order_payment_id_idx'),
+        ]
     
     def __str__(self):
         return f"Order {self.order_id} - {self.user.email} - ₹{self.total_amount}"
@@ -258,7 +293,7 @@ class Order(models.Model):
         """Generate unique order ID."""
         return f"RTO{timezone.now().strftime('%Y%m%d')}{uuid.uuid4().hex[:8].upper()}"
 
-class PrintOrder(models.Model):
+class PrintOrder(ChangeTrackingMixin, models.Model):
     """Print order model for tracking physical card production and delivery."""
     
     class Status(models.TextChoices):
@@ -293,6 +328,173 @@ class PrintOrder(models.Model):
         verbose_name = 'Print Order'
         verbose_name_plural = 'Print Orders'
         ordering = ['-created_at']
+        indexes = [
+            # Print queue, oldest first (build_print_sheets)
+            models.Index(fields=['status', 'created_at'], name='print_order_queue_idx'),
+        ]
+    
+    # Stamped when the status moves to the key
+    STATUS_TIMESTAMPS = {
+        Status.PRINTED: 'printed_at',
+        Status.SHIPPED: 'shipped_at',
+        Status.DELIVERED: 'delivered_at',
+    }
     
     def __str__(self):
         return f"Print Order {self.order.order_id} - {self.get_status_display()}"
+    
+    def save(self, *args, **kwargs):
+        timestamp = self.STATUS_TIMESTAMPS.get(self.status)
+        if timestamp and not getattr(self, timestamp) and self.has_changed('status'):
+            setattr(self, timestamp, timezone.now())
+        super().save(*args, **kwargs)
+
+
+class DeployBatch(models.Model):
+    """A single deploy_site commit and push covering one or more galleries."""
+    
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        PUSHED = 'pushed', 'Pushed'
+        FAILED = 'failed', 'Failed'
+    
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    commit_sha = models.CharField(max_length=40, blank=True)
+    error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    pushed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'deploy_batch'
+        verbose_name = 'Deploy Batch'
+        verbose_name_plural = 'Deploy Batches'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Deploy batch {self.pk} - {self.get_status_display()}"
+    
+    @property
+    def record_ids(self):
+        return [str(record_id) for record_id in self.deploys.values_list('record_id', flat=True)]
+
+
+class GalleryDeploy(models.Model):
+    """A record gallery waiting for, or covered by, a deploy batch."""
+    
+    record = models.ForeignKey(RTORecord, on_delete=models.CASCADE, related_name='gallery_deploys')
+    batch = models.ForeignKey(
+        DeployBatch, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='deploys'
+    )
+    requested_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'gallery_deploy'
+        verbose_name = 'Gallery Deploy'
+        verbose_name_plural = 'Gallery Deploys'
+        ordering = ['requested_at']
+    
+    def __str__(self):
+        return f"Gallery deploy for {self.record_id}"
+
+
+class GalleryRenderQuerySet(models.QuerySet):
+    def stale(self, template_hash):
+        """Entries rendered with a different gallery template than ``template_hash``."""
+        return self.exclude(template_hash=template_hash)
+
+    def undeployed(self):
+        """Entries whose latest render has not been published yet."""
+        return self.exclude(deployed_hash=models.F('output_hash'))
+
+
+class GalleryRender(models.Model):
+    """Render manifest entry for a record's static gallery page.
+
+    Maps a record to the hash of the inputs its page was rendered from and to
+    the hash of the written file, so unchanged pages are neither re-rendered,
+    re-written nor re-deployed.
+    """
+    
+    record = models.OneToOneField(
+        RTORecord, on_delete=models.CASCADE, primary_key=True, related_name='gallery_render'
+    )
+    input_hash = models.CharField(max_length=64, help_text="Hash of record fields and document URLs")
+    template_hash = models.CharField(max_length=64, db_index=True, help_text="Hash of the gallery templates")
+    output_hash = models.CharField(max_length=64, help_text="Hash of the written index.html")
+    deployed_hash = models.CharField(max_length=64, blank=True, help_text="Output hash of the last deployed page")
+    rendered_at = models.DateTimeField(auto_now=True)
+    
+    objects = GalleryRenderQuerySet.as_manager()
+    
+    class Meta:
+        db_table = 'gallery_render'
+        verbose_name = 'Gallery Render'
+        verbose_name_plural = 'Gallery Renders'
+    
+    def __str__(self):
+        return f"Gallery render for {self.record_id}"
+    
+    @property
+    def needs_deploy(self):
+        return self.output_hash != self.deployed_hash
+
+
+class RollupState(models.Model):
+    """How far a rollup table has been brought up to date (see ``core.utils.rollups``)."""
+    
+    name = models.CharField(max_length=50, unique=True)
+    watermark = models.DateTimeField(null=True, blank=True, help_text="Source rows changed since then are pending")
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'rollup_state'
+    
+    def __str__(self):
+        return f"{self.name} rollup up to {self.watermark}"
+
+
+class RollupDirtyDay(models.Model):
+    """A day whose rollup must be recomputed although no remaining row changed, e.g. after a delete."""
+    
+    rollup = models.CharField(max_length=50)
+    day = models.DateField()
+    
+    class Meta:
+        db_table = 'rollup_dirty_day'
+        constraints = [models.UniqueConstraint(fields=['rollup', 'day'], name='rollup_dirty_day_key')]
+    
+    @classmethod
+    def mark(cls, rollup, moment):
+        cls.objects.bulk_create([cls(rollup=rollup, day=timezone.localdate(moment))], ignore_conflicts=True)
+
+
+class DailyOrderRollup(models.Model):
+    """Orders created on a day, by type, payment status and provider."""
+    
+    day = models.DateField()
+    order_type = models.CharField(max_length=20, choices=Order.OrderType.choices)
+    payment_status = models.CharField(max_length=20, choices=Order.Status.choices)
+    provider = models.CharField(max_length=20)
+    orders = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'daily_order_rollup'
+        verbose_name = 'Order Analytics'
+        verbose_name_plural = 'Order Analytics'
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'order_type', 'payment_status', 'provider'], name='daily_order_rollup_key'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.day} {self.order_type} {self.payment_status}: {self.orders}"
+
+
+@receiver(post_delete, sender=Order)
+def mark_order_rollup_dirty(sender, instance, **kwargs):
+    RollupDirtyDay.mark('orders', instance.created_at)
@@ -0,0 +1,142 @@
+"""Keyset pagination for the REST API list endpoints.
+
+Pages are walked on ``(created_at, id)`` descending, the models' default
+ordering with the primary key as a tie-breaker, so each page is one indexed
+range query:
+
+    WHERE created_at < :c OR (created_at = :c AND id < :id)
+    ORDER BY created_at DESC, id DESC LIMIT :page_size + 1
+
+There is no ``COUNT(*)`` and no ``OFFSET`` scan, and rows inserted while a
+client is paging land before its cursor instead of shifting later pages.
+The ``next`` and ``previous`` links carry opaque cursors; clients should
+follow them rather than build their own.
+
+Requests with a ``page`` parameter keep the old page-number behaviour
+(with ``count``) for existing integrations.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+    fallback_class = PageNumberPagination
+
+    def __init__(self):
+        self.fallback = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.fallback_class.page_query_param in request.query_params:
+            self.fallback = self.fallback_class()
+            self.fallback.page_size = api_settings.PAGE_SIZE
+            self.fallback.page_size_query_param = self.page_size_query_param
+            self.fallback.max_page_size = self.max_page_size
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+        reverse = cursor is not None and cursor['reverse']
+
+        if cursor is not None:
+            created_at, pk = cursor['position']
+            if reverse:
+                after = Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk)
+            else:
+                after = Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+            queryset = queryset.filter(after)
+        ordering = ('created_at', 'pk') if reverse else ('-created_at', '-pk')
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+
+        more = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        if reverse:
+            page.reverse()
+            self.has_next, self.has_previous = True, more
+        else:
+            self.has_next, self.has_previous = more, cursor is not None
+        # An empty page (past either end) links back from the cursor itself
+        edge = cursor['position'] if cursor else None
+        self.first = (page[0].created_at, page[0].pk) if page else edge
+        self.last = (page[-1].created_at, page[-1].pk) if page else edge
+        return page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            created_at = parse_datetime(data['c'])
+            pk = model._meta.pk.to_python(data['i'])
+            reverse = bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None or pk is None:
+            raise NotFound(self.invalid_cursor_message)
+        return {'position': (created_at, pk), 'reverse': reverse}
+
+    def encode_cursor(self, position, reverse=False):
+        created_at, pk = position
+        # Records have UUID keys, orders integer ones
+        data = {'c': created_at.isoformat(), 'i': str(pk)}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.fallback:
+            return self.fallback.get_next_link()
+        if not self.has_next or self.last is None:
+            return None
+        return self.encode_cursor(self.last)
+
+    def get_previous_link(self):
+        if self.fallback:
+            return self.fallback.get_previous_link()
+        if not self.has_previous or self.first is None:
+            return None
+        return self.encode_cursor(self.first, reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.fallback:
+            return self.fallback.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        if self.fallback:
+            return self.fallback.get_paginated_response_schema(schema)
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
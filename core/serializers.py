@@ -19,6 +19,17 @@ class RTORecordSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'qr_code_image']
     
+    # Model fields read when serializing, for ``.only()`` on list queries
+    model_fields = [
+        'id', 'name', 'contact_no', 'address', 'record_type', 'status',
+        'rc_photo', 'insurance_doc', 'pu_check_doc', 'driving_license_doc',
+        'qr_code_image', 'qr_payload', 'created_at', 'updated_at',
+    ]
+    
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        return queryset.only(*cls.model_fields)
+    
     def get_document_count(self, obj):
         return obj.get_document_count()
     
@@ -26,8 +37,10 @@ class RTORecordSerializer(serializers.ModelSerializer):
         return obj.has_documents()
     
     def get_qr_code_url(self, obj):
-        if obj.qr_code_image:
-            return obj.qr_code_image.url
+        if obj.has_qr_code:
+            request = self.context.get('request')
+            url = obj.get_qr_code_url()
+            return request.build_absolute_uri(url) if request else url
         return None
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -44,6 +57,13 @@ class OrderSerializer(serializers.ModelSerializer):
             'rto_record_details'
         ]
         read_only_fields = ['order_id', 'created_at', 'updated_at', 'total_amount']
+    
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """Join each order's record in the same query, loading only the serialized columns."""
+        record_fields = [f'rto_record__{name}' for name in RTORecordSerializer.model_fields]
+        fields = [name for name in cls.Meta.fields if name != 'rto_record_details']
+        return queryset.select_related('rto_record').only(*fields, 'rto_record', *record_fields)
 
 class QRGenerationSerializer(serializers.Serializer):
     """Serializer for QR code generation requests."""
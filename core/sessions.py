@@ -0,0 +1,16 @@
+"""Database sessions whose saves survive a briefly locked SQLite database.
+
+``SESSION_SAVE_EVERY_REQUEST`` makes every request write its session, so on
+SQLite the session save is the write most likely to meet another worker's
+lock. ``atomic_with_retry`` retries it instead of failing the request.
+"""
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+
+from core.utils.db_retry import atomic_with_retry
+
+
+class SessionStore(DBSessionStore):
+
+    @atomic_with_retry
+    def save(self, must_create=False):
+        super().save(must_create=must_create)
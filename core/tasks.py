@@ -0,0 +1,174 @@
+"""Background jobs for the post-payment pipeline.
+
+``verify_payment`` only records the payment and enqueues these stages; the
+slow work (gallery rendering, QR generation, git deploy, admin email) runs on
+the Celery workers. Deploys are batched: the deploy stage only queues the
+gallery, and a single flush job commits and pushes every queued gallery. With
+``GALLERY_BACKEND = 'django'`` the render and deploy stages have nothing to
+do, since the gallery view renders on request.
+
+Every stage is safe to retry: it records its progress in
+``RTORecord.pipeline_status`` and is skipped once it has completed for the
+same run (the order that triggered the pipeline).
+"""
+import logging
+
+from celery import chain, shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from core.utils.deploy_utils import flush_gallery_deploys, queue_gallery_deploy
+from core.utils.email_utils import send_order_notification_to_admin
+from core.utils.rollups import refresh_rollups
+from core.utils.gallery_utils import (
+    generate_qr_code_for_record, generate_static_html, get_gallery_url, static_galleries_enabled,
+)
+
+from .models import GalleryRender, RTORecord
+
+logger = logging.getLogger(__name__)
+
+STAGE_RENDER = 'render_gallery'
+STAGE_QR = 'generate_qr'
+STAGE_DEPLOY = 'deploy_gallery'
+STAGE_NOTIFY = 'notify_admin'
+
+PIPELINE_STAGES = [STAGE_RENDER, STAGE_QR, STAGE_DEPLOY, STAGE_NOTIFY]
+
+DEPLOY_FLUSH_SCHEDULED_KEY = 'gallery_deploy_flush_scheduled'
+
+TASK_OPTIONS = {
+    'bind': True,
+    'autoretry_for': (Exception,),
+    'dont_autoretry_for': (RTORecord.DoesNotExist,),
+    'retry_backoff': True,
+    'retry_backoff_max': 300,
+    'retry_jitter': True,
+    'max_retries': 5,
+    'acks_late': True,
+}
+
+
+def _run_stage(task, record_id, run, stage, func):
+    """Run ``func(record)`` once per run for a stage and record the outcome."""
+    record = RTORecord.objects.get(pk=record_id)
+    if record.is_stage_done(stage, run):
+        logger.info("Skipping %s for record %s: already done", stage, record_id)
+        return record_id
+
+    record.set_stage_status(stage, RTORecord.StageStatus.RUNNING, run=run)
+    try:
+        func(record)
+    except Exception as e:
+        if task.request.retries >= task.max_retries:
+            status = RTORecord.StageStatus.FAILED
+        else:
+            status = RTORecord.StageStatus.RETRYING
+        record.set_stage_status(stage, status, run=run, error=str(e))
+        logger.exception("Stage %s failed for record %s", stage, record_id)
+        raise
+
+    record.set_stage_status(stage, RTORecord.StageStatus.DONE, run=run)
+    return record_id
+
+
+@shared_task(**TASK_OPTIONS)
+def render_gallery_task(self, record_id, run):
+    def render(record):
+        # The Django-served gallery renders on request instead
+        if static_galleries_enabled():
+            generate_static_html(record)
+
+    return _run_stage(self, record_id, run, STAGE_RENDER, render)
+
+
+@shared_task(**TASK_OPTIONS)
+def generate_qr_task(self, record_id, run):
+    def generate(record):
+        generate_qr_code_for_record(record, get_gallery_url(record))
+
+    return _run_stage(self, record_id, run, STAGE_QR, generate)
+
+
+@shared_task(**TASK_OPTIONS)
+def deploy_gallery_task(self, record_id, run):
+    def deploy(record):
+        if static_galleries_enabled():
+            schedule_gallery_deploy(record)
+
+    return _run_stage(self, record_id, run, STAGE_DEPLOY, deploy)
+
+
+@shared_task(**TASK_OPTIONS)
+def flush_gallery_deploys_task(self):
+    cache.delete(DEPLOY_FLUSH_SCHEDULED_KEY)
+    return [batch.pk for batch in flush_gallery_deploys()]
+
+
+def schedule_gallery_deploy(record):
+    """Queue a record's gallery for the next batched deploy.
+
+    Galleries whose current render is already published are skipped. The
+    first record queued in a window schedules a flush at the end of
+    ``DEPLOY_BATCH_WINDOW``; a full batch is flushed straight away.
+    """
+    render = GalleryRender.objects.filter(record=record).first()
+    if render is not None and not render.needs_deploy:
+        logger.info("Gallery for record %s is already deployed", record.id)
+        return
+    pending = queue_gallery_deploy(record)
+    if pending >= settings.DEPLOY_BATCH_MAX_SIZE:
+        flush_gallery_deploys_task.apply_async()
+    elif cache.add(DEPLOY_FLUSH_SCHEDULED_KEY, True, timeout=settings.DEPLOY_BATCH_WINDOW):
+        flush_gallery_deploys_task.apply_async(countdown=settings.DEPLOY_BATCH_WINDOW)
+
+
+@shared_task(**TASK_OPTIONS)
+def notify_admin_task(self, record_id, run, order_type):
+    def notify(record):
+        if order_type not in ['pvc', 'nfc'] or not record.address.strip():
+            return
+        if not send_order_notification_to_admin(record, order_type, get_gallery_url(record)):
+            raise RuntimeError("Admin notification email was not sent")
+
+    return _run_stage(self, record_id, run, STAGE_NOTIFY, notify)
+
+
+@shared_task(bind=True, acks_late=True)
+def refresh_rollups_task(self):
+    return refresh_rollups()
+
+
+def build_post_payment_pipeline(record_id, run, order_type):
+    """Celery signature running every post-payment stage in order."""
+    record_id = str(record_id)
+    return chain(
+        render_gallery_task.si(record_id, run),
+        generate_qr_task.si(record_id, run),
+        deploy_gallery_task.si(record_id, run),
+        notify_admin_task.si(record_id, run, order_type),
+    )
+
+
+def enqueue_post_payment(order, order_type):
+    """Queue the post-payment pipeline for a paid order after commit.
+
+    The order id is the pipeline run id, so a redelivered or retried job for
+    the same payment never repeats a finished stage, while a later order for
+    the same record runs the pipeline again.
+    """
+    record = order.rto_record
+    run = order.order_id
+    for stage in PIPELINE_STAGES:
+        if not record.is_stage_done(stage, run):
+            record.set_stage_status(stage, RTORecord.StageStatus.QUEUED, run=run, save=False)
+    update_fields = ['pipeline_status']
+    if not static_galleries_enabled():
+        # record_gallery_view serves the page as soon as the order is paid
+        record.gallery_html_url = get_gallery_url(record)
+        update_fields.append('gallery_html_url')
+    record.save(update_fields=update_fields)
+
+    pipeline = build_post_payment_pipeline(record.id, run, order_type)
+    transaction.on_commit(pipeline.apply_async)
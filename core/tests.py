@@ -1,3 +1,1603 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import qrcode
+from celery.exceptions import Retry
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+
+from .models import (
+    RTORecord, Order, PrintOrder, Profile, DeployBatch, GalleryDeploy, GalleryRender,
+    DailyOrderRollup, RollupDirtyDay, RollupState,
+)
+from .serializers import OrderSerializer
+from .tasks import PIPELINE_STAGES, build_post_payment_pipeline, schedule_gallery_deploy
+from .utils import dashboard_stats, deploy_utils, gallery_utils, print_sheets, qr_pdf, qr_raster, qr_utils, rollups
+from .utils.dashboard_stats import compute_dashboard_stats, get_dashboard_stats
+from .utils.email_utils import send_order_notification_to_admin
+from .utils.db_retry import atomic_with_retry
+from .utils.deploy_utils import deploy_lock, flush_gallery_deploys, queue_gallery_deploy
+from .utils.gallery_utils import (
+    generate_static_html, get_gallery_dir, get_gallery_url, get_stale_galleries,
+)
+from .utils.git_publisher import GitObjectPublisher
+from .utils.query_budget import QueryBudgetExceeded
+from .utils.rollups import refresh_rollups
+
+User = get_user_model()
+
+
+def razorpay_signature(order_id, payment_id):
+    return hmac.new(
+        settings.RAZORPAY_KEY_SECRET.encode(),
+        f"{order_id}|{payment_id}".encode(),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+def git(cwd, *args):
+    return subprocess.run(
+        ['git', *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+
+class LocalGitRemoteMixin:
+    """Point deploy_site publishing at a throwaway repo with a bare remote."""
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp(prefix='rto_deploy_')
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.repo_dir = os.path.join(root, 'work')
+        self.remote_dir = os.path.join(root, 'remote.git')
+        git(root, 'init', '-q', '--bare', '-b', 'main', self.remote_dir)
+        git(root, 'init', '-q', '-b', 'main', self.repo_dir)
+        git(self.repo_dir, 'config', 'user.email', 'deploy@example.com')
+        git(self.repo_dir, 'config', 'user.name', 'Deploy Bot')
+        git(self.repo_dir, 'remote', 'add', 'origin', self.remote_dir)
+
+        overrides = override_settings(
+            DEPLOY_REPO_DIR=self.repo_dir,
+            DEPLOY_SITE_DIR=os.path.join(self.repo_dir, 'deploy_site'),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def remote_commits(self):
+        return git(self.remote_dir, 'rev-list', 'main').splitlines()
+
+    def remote_files(self):
+        return git(self.remote_dir, 'ls-tree', '-r', '--name-only', 'main').splitlines()
+
+
+class PostPaymentPipelineTests(LocalGitRemoteMixin, TestCase):
+    """verify_payment hands the slow work to the (eager) job queue."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234'
+        )
+        self.client.force_login(self.user)
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999',
+            address='12 MG Road', record_type='rto',
+            rc_photo='https://res.cloudinary.com/demo/rc.jpg',
+        )
+        self.order = Order.objects.create(
+            user=self.user, rto_record=self.record, order_id='order_test_1',
+            order_type=Order.OrderType.PVC_CARD, amount=100,
+            payment_provider='razorpay',
+        )
+
+    def verify(self, referrer='/records/x/payment/pvc_card/'):
+        payload = {
+            'razorpay_order_id': self.order.order_id,
+            'razorpay_payment_id': 'pay_test_1',
+            'razorpay_signature': razorpay_signature(self.order.order_id, 'pay_test_1'),
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(
+                reverse('core:verify_payment'), json.dumps(payload),
+                content_type='application/json', HTTP_REFERER=referrer,
+            )
+
+    def test_verify_payment_runs_every_stage(self):
+        response = self.verify()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(len(self.remote_commits()), 1)
+
+        self.record.refresh_from_db()
+        for stage in PIPELINE_STAGES:
+            self.assertEqual(self.record.get_stage_status(stage), RTORecord.StageStatus.DONE)
+        self.assertTrue(self.record.qr_code_image)
+        self.assertTrue(self.record.gallery_html_url.endswith(f'/record_{self.record.id}/'))
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(GALLERY_BACKEND='django')
+    def test_django_served_gallery_is_live_without_a_deploy(self):
+        with mock.patch('core.tasks.build_post_payment_pipeline'):
+            self.verify()
+        self.record.refresh_from_db()
+        self.assertEqual(
+            self.record.gallery_html_url,
+            f"{settings.GALLERY_SITE_URL}/gallery/{self.record.id}/",
+        )
+
+        self.verify()
+        self.assertEqual(git(self.remote_dir, 'for-each-ref'), '')
+        self.assertFalse(os.path.exists(get_gallery_dir(self.record.id)))
+        self.assertEqual(self.client.get(self.record.gallery_html_url).status_code, 200)
+
+    def test_rerunning_a_pipeline_skips_finished_stages(self):
+        self.verify()
+        build_post_payment_pipeline(self.record.id, self.order.order_id, 'pvc').apply_async()
+
+        self.assertEqual(GalleryDeploy.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @mock.patch('core.tasks.schedule_gallery_deploy', side_effect=[RuntimeError('push rejected'), None])
+    def test_failed_stage_is_marked_for_retry_and_resumes(self, deploy):
+        # Eager mode surfaces the retry request instead of sleeping on it
+        with self.assertRaises(Retry):
+            self.verify()
+
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.get_stage_status('deploy_gallery'), RTORecord.StageStatus.RETRYING)
+        self.assertEqual(self.record.pipeline_status['deploy_gallery']['error'], 'push rejected')
+
+        with mock.patch('core.tasks.generate_static_html') as render:
+            build_post_payment_pipeline(self.record.id, self.order.order_id, 'pvc').apply_async()
+
+        render.assert_not_called()
+        self.assertEqual(deploy.call_count, 2)
+        self.record.refresh_from_db()
+        for stage in PIPELINE_STAGES:
+            self.assertEqual(self.record.get_stage_status(stage), RTORecord.StageStatus.DONE)
+
+
+class DeployBatcherTests(LocalGitRemoteMixin, TestCase):
+    """Dirty galleries are published with one commit and one push per batch."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234'
+        )
+        self.records = [
+            RTORecord.objects.create(
+                owner=self.user, name=f'Owner {i}', contact_no='9999999999',
+                address='12 MG Road', record_type='rto',
+                rc_photo=f'https://res.cloudinary.com/demo/rc_{i}.jpg',
+            )
+            for i in range(3)
+        ]
+        for record in self.records:
+            generate_static_html(record)
+            queue_gallery_deploy(record)
+
+    def test_burst_is_published_in_a_single_push(self):
+        batches = flush_gallery_deploys()
+
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(len(self.remote_commits()), 1)
+        self.assertEqual(batches[0].commit_sha, self.remote_commits()[0])
+        self.assertCountEqual(batches[0].record_ids, [str(r.id) for r in self.records])
+        for record in self.records:
+            self.assertIn(f'deploy_site/record_{record.id}/index.html', self.remote_files())
+            record.refresh_from_db()
+            self.assertTrue(record.gallery_html_url)
+
+    def test_batches_are_capped_at_max_size(self):
+        batches = flush_gallery_deploys(max_size=2)
+
+        self.assertEqual([len(batch.record_ids) for batch in batches], [2, 1])
+        self.assertEqual(len(self.remote_commits()), 2)
+
+    def test_requeueing_a_pending_record_is_coalesced(self):
+        queue_gallery_deploy(self.records[0])
+
+        self.assertEqual(GalleryDeploy.objects.count(), 3)
+
+    def test_failed_push_requeues_records(self):
+        git(self.repo_dir, 'remote', 'set-url', 'origin', os.path.join(self.repo_dir, 'missing.git'))
+
+        with self.assertRaises(Exception):
+            flush_gallery_deploys()
+
+        batch = DeployBatch.objects.get()
+        self.assertEqual(batch.status, DeployBatch.Status.FAILED)
+        self.assertEqual(GalleryDeploy.objects.filter(batch__isnull=True).count(), 3)
+        self.assertFalse(RTORecord.objects.exclude(gallery_html_url='').exists())
+
+        # Once the remote is reachable the already-made commit is pushed
+        git(self.repo_dir, 'remote', 'set-url', 'origin', self.remote_dir)
+        flush_gallery_deploys()
+        self.assertEqual(len(self.remote_commits()), 1)
+        self.assertFalse(RTORecord.objects.filter(gallery_html_url='').exists())
+
+    def test_render_finishing_after_the_commit_is_not_marked_deployed(self):
+        record = self.records[0]
+        real_publish = deploy_utils.publish_batch
+
+        def publish_then_rerender(record_ids):
+            sha = real_publish(record_ids)
+            # A render lands between the push and the deployed_hash update
+            RTORecord.objects.filter(pk=record.pk).update(name='Renamed')
+            generate_static_html(RTORecord.objects.get(pk=record.pk))
+            return sha
+
+        with mock.patch.object(deploy_utils, 'publish_batch', side_effect=publish_then_rerender):
+            flush_gallery_deploys()
+
+        renders = {render.record_id: render for render in GalleryRender.objects.all()}
+        self.assertTrue(renders[record.pk].needs_deploy)
+        self.assertFalse(any(renders[other.pk].needs_deploy for other in self.records[1:]))
+
+    def test_working_tree_is_left_clean(self):
+        flush_gallery_deploys()
+
+        self.assertEqual(git(self.repo_dir, 'status', '--porcelain'), '')
+
+    def test_flush_during_a_running_deploy_folds_into_it(self):
+        with deploy_lock():
+            self.assertEqual(flush_gallery_deploys(), [])
+        self.assertEqual(git(self.remote_dir, 'for-each-ref'), '')
+        self.assertEqual(GalleryDeploy.objects.filter(batch__isnull=True).count(), 3)
+
+        self.assertEqual(len(flush_gallery_deploys()), 1)
+        git(self.remote_dir, 'fsck', '--strict')
+
+
+class RenderManifestTests(LocalGitRemoteMixin, TestCase):
+    """Unchanged galleries are neither re-rendered, re-written nor re-deployed."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234'
+        )
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999',
+            address='12 MG Road', record_type='rto',
+            rc_photo='https://res.cloudinary.com/demo/rc.jpg',
+        )
+        self.page = os.path.join(get_gallery_dir(self.record.id), 'index.html')
+        self.addCleanup(gallery_utils.gallery_template_hash.cache_clear)
+
+    def test_unchanged_record_skips_render_and_write(self):
+        self.assertTrue(generate_static_html(self.record))
+        mtime = os.stat(self.page).st_mtime_ns
+
+        with mock.patch.object(gallery_utils, 'render_to_string') as render:
+            self.assertFalse(generate_static_html(self.record))
+        render.assert_not_called()
+        self.assertEqual(os.stat(self.page).st_mtime_ns, mtime)
+
+    def test_changed_inputs_rerender(self):
+        generate_static_html(self.record)
+        self.record.insurance_doc = 'https://res.cloudinary.com/demo/insurance.pdf'
+        self.record.save()
+
+        self.assertTrue(generate_static_html(self.record))
+        with open(self.page, encoding='utf-8') as f:
+            self.assertIn('insurance.pdf', f.read())
+
+    def test_deployed_page_is_not_queued_again(self):
+        generate_static_html(self.record)
+        schedule_gallery_deploy(self.record)
+        self.assertEqual(len(self.remote_commits()), 1)
+        self.assertFalse(GalleryRender.objects.get(record=self.record).needs_deploy)
+
+        generate_static_html(self.record)
+        schedule_gallery_deploy(self.record)
+        self.assertEqual(GalleryDeploy.objects.count(), 1)
+
+    def test_template_change_marks_galleries_stale(self):
+        generate_static_html(self.record)
+        self.assertFalse(get_stale_galleries().exists())
+
+        gallery_utils.gallery_template_hash.cache_clear()
+        with mock.patch.object(gallery_utils, 'GALLERY_RENDER_VERSION', 2):
+            self.assertEqual(list(get_stale_galleries().values_list('record_id', flat=True)), [self.record.id])
+
+
+class RegenerateGalleriesTests(LocalGitRemoteMixin, TestCase):
+    """Bulk re-rendering after a template change ends in one deploy."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234'
+        )
+        self.records = [
+            RTORecord.objects.create(
+                owner=self.user, name=f'Owner {i}', contact_no='9999999999',
+                address='12 MG Road', record_type='rto',
+                rc_photo=f'https://res.cloudinary.com/demo/rc_{i}.jpg',
+            )
+            for i in range(4)
+        ]
+        for record in self.records:
+            generate_static_html(record)
+            queue_gallery_deploy(record)
+        flush_gallery_deploys()
+        self.addCleanup(gallery_utils.gallery_template_hash.cache_clear)
+
+        # A template change: new render version, new page bytes
+        gallery_utils.gallery_template_hash.cache_clear()
+        patcher = mock.patch.object(gallery_utils, 'GALLERY_RENDER_VERSION', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        render_to_string = gallery_utils.render_to_string
+        patcher = mock.patch.object(
+            gallery_utils, 'render_to_string', lambda *a, **kw: render_to_string(*a, **kw) + '<!-- v2 -->'
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def regenerate(self, *args):
+        call_command('regenerate_galleries', '--workers', '1', '--chunk-size', '1', *args, stdout=io.StringIO())
+
+    def test_stale_galleries_are_published_in_one_commit(self):
+        self.regenerate('--only-stale')
+
+        self.assertFalse(get_stale_galleries().exists())
+        self.assertFalse(GalleryRender.objects.undeployed().exists())
+        self.assertEqual(len(self.remote_commits()), 2)
+        for record in self.records:
+            page = git(self.remote_dir, 'show', f'main:deploy_site/record_{record.id}/index.html')
+            self.assertIn('<!-- v2 -->', page)
+
+    def test_interrupted_run_resumes_from_the_checkpoint(self):
+        from core.management.commands.regenerate_galleries import Command
+
+        render_chunk = Command._render_chunk
+        calls = []
+
+        def flaky(command, chunk, *args):
+            calls.append(chunk[0].pk)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            return render_chunk(command, chunk, *args)
+
+        with mock.patch.object(Command, '_render_chunk', flaky), self.assertRaises(KeyboardInterrupt):
+            self.regenerate('--only-stale')
+        self.assertEqual(get_stale_galleries().count(), 2)
+        self.assertEqual(len(self.remote_commits()), 1)
+
+        calls.clear()
+        with mock.patch.object(Command, '_render_chunk', flaky):
+            self.regenerate('--only-stale')
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(get_stale_galleries().exists())
+        self.assertEqual(len(self.remote_commits()), 2)
+
+    def test_process_pool_updates_the_manifest(self):
+        call_command('regenerate_galleries', '--workers', '2', stdout=io.StringIO())
+
+        self.assertFalse(get_stale_galleries().exists())
+        self.assertFalse(GalleryRender.objects.undeployed().exists())
+
+    def test_created_at_filter(self):
+        RTORecord.objects.filter(pk=self.records[0].pk).update(created_at='2020-06-01T00:00:00Z')
+
+        self.regenerate('--created-before', '2021-01-01')
+        self.assertEqual(
+            sorted(get_stale_galleries().values_list('record_id', flat=True)),
+            sorted(r.pk for r in self.records[1:]),
+        )
+
+
+class QRCacheTests(TestCase):
+    """QR images are rendered once per payload and reused everywhere."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix='rto_qr_')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        qr_utils._cached_png.cache_clear()
+        self.addCleanup(qr_utils._cached_png.cache_clear)
+
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234'
+        )
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999',
+            address='12 MG Road', record_type='rto',
+        )
+        self.url = get_gallery_url(self.record)
+        render_qr_png = qr_utils.render_qr_png
+        patcher = mock.patch.object(qr_utils, 'render_qr_png', side_effect=render_qr_png)
+        self.render = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unchanged_url_is_not_rendered_or_saved_again(self):
+        gallery_utils.generate_qr_code_for_record(self.record, self.url)
+        name = self.record.qr_code_image.name
+
+        gallery_utils.generate_qr_code_for_record(self.record, self.url)
+        self.assertEqual(self.render.call_count, 1)
+        self.assertEqual(self.record.qr_code_image.name, name)
+
+    def test_storage_tier_survives_a_cold_process(self):
+        png, key = qr_utils.get_qr_png(self.url)
+        qr_utils._cached_png.cache_clear()
+
+        self.assertEqual(qr_utils.get_qr_png(self.url), (png, key))
+        self.assertEqual(self.render.call_count, 1)
+        self.assertNotEqual(qr_utils.get_qr_png(self.url, box_size=4)[1], key)
+
+    def test_admin_email_reuses_the_record_qr_code(self):
+        gallery_utils.generate_qr_code_for_record(self.record, self.url)
+
+        self.assertTrue(send_order_notification_to_admin(self.record, 'pvc', self.url))
+        self.assertEqual(self.render.call_count, 1)
+        _name, attachment, mimetype = mail.outbox[0].attachments[0]
+        self.assertEqual(mimetype, 'image/png')
+        with self.record.qr_code_image.open('rb') as f:
+            self.assertEqual(attachment, f.read())
+
+    def test_changed_url_replaces_the_old_image(self):
+        gallery_utils.generate_qr_code_for_record(self.record, self.url)
+        old_name = self.record.qr_code_image.name
+
+        gallery_utils.generate_qr_code_for_record(self.record, self.url + '?v=2')
+        self.assertNotEqual(self.record.qr_code_image.name, old_name)
+        self.assertFalse(self.record.qr_code_image.storage.exists(old_name))
+
+
+@skipUnless(qr_raster.numpy_available(), "NumPy is not installed")
+class QRRasterTests(SimpleTestCase):
+    """The NumPy rasterizer draws exactly the pixels qrcode's PIL path does."""
+
+    def pixels(self, png):
+        import numpy as np
+        return np.asarray(Image.open(io.BytesIO(png)).convert('L'))
+
+    def test_pixels_match_the_pil_image_factory(self):
+        for version, box_size in [(5, 4), (5, 10), (10, 10)]:
+            qr = qrcode.QRCode(version=version, box_size=box_size, border=4)
+            qr.add_data('https://example.com/record_1/')
+            qr.make(fit=False)
+            blob = io.BytesIO()
+            qr.make_image(fill_color="black", back_color="white").save(blob, 'PNG')
+
+            for bit_depth in (1, 8):
+                with self.subTest(version=version, box_size=box_size, bit_depth=bit_depth):
+                    png = qr_raster.render_png(qr, box_size, bit_depth=bit_depth)
+                    self.assertEqual(Image.open(io.BytesIO(png)).mode, '1' if bit_depth == 1 else 'L')
+                    self.assertTrue((self.pixels(png) == self.pixels(blob.getvalue())).all())
+
+    def test_rasterizer_setting_switches_paths(self):
+        params = qr_utils.qr_params()
+        with override_settings(QR_RASTERIZER='pil'):
+            pil = qr_utils.render_qr_png('https://example.com/record_1/', params)
+        with override_settings(QR_RASTERIZER='numpy'):
+            fast = qr_utils.render_qr_png('https://example.com/record_1/', params)
+        self.assertNotEqual(fast, pil)
+        self.assertTrue((self.pixels(fast) == self.pixels(pil)).all())
+
+
+class RecordQREndpointTests(TestCase):
+    """The QR endpoint renders PNG or SVG on demand from the record's payload."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix='rto_qr_')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media_root, QR_PERSIST_IMAGES=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234'
+        )
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999',
+            address='12 MG Road', record_type='rto',
+        )
+        self.payload = get_gallery_url(self.record)
+        gallery_utils.generate_qr_code_for_record(self.record, self.payload)
+        self.url = reverse('core:record_qr', kwargs={'record_id': self.record.id})
+        self.client.force_login(self.user)
+
+    def test_payload_is_stored_without_writing_an_image(self):
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.qr_payload, self.payload)
+        self.assertFalse(self.record.qr_code_image)
+        self.assertTrue(self.record.has_qr_code)
+
+    def test_png_matches_the_cached_renderer(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Accept', response['Vary'])
+        served = Image.open(io.BytesIO(response.content)).convert('L')
+        expected = Image.open(io.BytesIO(qr_utils.get_qr_png(self.payload)[0])).convert('L')
+        self.assertEqual(served.size, expected.size)
+        self.assertEqual(list(served.getdata()), list(expected.getdata()))
+
+    def test_svg_from_query_or_accept_header(self):
+        by_query = self.client.get(self.url, {'format': 'svg'})
+        by_accept = self.client.get(self.url, HTTP_ACCEPT='image/svg+xml')
+
+        for response in (by_query, by_accept):
+            self.assertEqual(response['Content-Type'], 'image/svg+xml')
+            self.assertTrue(response.content.startswith(b'<svg '))
+        self.assertEqual(by_query.content, by_accept.content)
+        # Browsers accept image/* as well, so an <img> still gets PNG
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='image/webp,image/*')['Content-Type'], 'image/png')
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='text/html').status_code, 406)
+
+    def test_size_picks_the_largest_box_that_fits(self):
+        response = self.client.get(self.url, {'size': 300, 'download': 1})
+
+        width, height = Image.open(io.BytesIO(response.content)).size
+        modules = len(qr_utils.get_qr_modules(self.payload, 1, 'L')) + 8
+        self.assertEqual(width, height)
+        self.assertEqual(width, 300 // modules * modules)
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(self.client.get(self.url, {'size': 'huge'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'format': 'gif'}).status_code, 400)
+
+    def test_etag_revalidates_and_tracks_the_variant(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with mock.patch('core.views.render_qr', return_value=(b'png', 'key')) as render:
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(self.url, {'size': 200}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        render.assert_called_once()  # only for the body of the 200
+        self.assertNotEqual(self.client.get(self.url, {'format': 'svg'})['ETag'], etag)
+        self.assertNotEqual(self.client.get(self.url, {'size': 200})['ETag'], etag)
+
+    def test_only_the_owner_or_staff_can_fetch_it(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='pass1234')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        other.is_staff = True
+        other.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class PrintSheetTests(TestCase):
+    """Pending card orders are imposed N-up onto PDF production sheets."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix='rto_print_')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        for cached in (qr_utils._cached_png, print_sheets._qr_image):
+            cached.cache_clear()
+            self.addCleanup(cached.cache_clear)
+
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234', is_staff=True,
+            is_superuser=True,
+        )
+        for i in range(13):
+            record = RTORecord.objects.create(
+                owner=self.user, name=f'Card Holder {i}', contact_no='9999999999',
+                address='12 MG Road', record_type='rto', qr_payload=f'https://example.com/gallery/{i}/',
+            )
+            order = Order.objects.create(
+                user=self.user, rto_record=record, order_id=f'order_card_{i}',
+                order_type=Order.OrderType.PVC_CARD if i % 2 else Order.OrderType.NFC_CARD,
+                amount=100, payment_provider='razorpay', payment_status=Order.Status.COMPLETED,
+            )
+            PrintOrder.objects.create(order=order, rto_record=record)
+
+    def page_count(self, pdf):
+        self.assertTrue(pdf.startswith(b'%PDF-'))
+        return len(re.findall(rb'/Type /Page\b', pdf))
+
+    def test_layout_fits_ten_cards_on_a4(self):
+        layout = print_sheets.SheetLayout('A4')
+        self.assertEqual((layout.columns, layout.rows), (2, 5))
+        xs, ys = layout.cut_lines()
+        self.assertEqual((len(xs), len(ys)), (4, 10))
+        with self.assertRaises(ValueError):
+            print_sheets.SheetLayout('A4', per_sheet=11)
+
+    def test_sheets_reuse_cached_qr_images(self):
+        print_orders = PrintOrder.objects.select_related('order', 'rto_record')
+        output = io.BytesIO()
+        self.assertEqual(print_sheets.write_print_sheets(print_orders, output), 13)
+        self.assertEqual(self.page_count(output.getvalue()), 2)
+
+        qr_utils._cached_png.cache_clear()
+        print_sheets._qr_image.cache_clear()
+        with mock.patch.object(qr_utils, 'render_qr_png') as render:
+            layout = print_sheets.SheetLayout('A4', per_sheet=4)
+            print_sheets.write_print_sheets(print_orders, io.BytesIO(), layout)
+        render.assert_not_called()
+
+    def test_sheets_are_written_as_they_are_drawn(self):
+        consumed = []
+
+        def print_orders():
+            for print_order in PrintOrder.objects.select_related('order', 'rto_record').order_by('created_at'):
+                consumed.append(print_order)
+                yield print_order
+
+        layout = print_sheets.SheetLayout('A4', per_sheet=4)
+        chunks = print_sheets.iter_print_sheets(print_orders(), layout)
+        pdf = next(chunks)
+        self.assertEqual(consumed, [])
+        pdf += next(chunks)
+        # The first sheet is out once the fifth card starts the second one
+        self.assertEqual(self.page_count(pdf), 1)
+        self.assertEqual(len(consumed), 5)
+        pdf += b''.join(chunks)
+        self.assertEqual(self.page_count(pdf), 4)
+        self.assertTrue(pdf.endswith(b'\n%%EOF\n'))
+
+        # Every cross-reference entry points at its object
+        xref = int(re.search(rb'startxref\n(\d+)', pdf)[1])
+        entries = re.findall(rb'(\d{10}) 00000 n ', pdf[xref:])
+        self.assertEqual(len(entries), int(re.search(rb'/Size (\d+)', pdf)[1]) - 1)
+        for number, offset in enumerate(entries, start=1):
+            self.assertTrue(pdf[int(offset):].startswith(b'%d 0 obj' % number))
+
+    def test_command_prints_and_marks_pending_orders(self):
+        output = os.path.join(settings.MEDIA_ROOT, 'sheets.pdf')
+        call_command(
+            'build_print_sheets', output=output, order_type=Order.OrderType.PVC_CARD,
+            mark_in_production=True, stdout=io.StringIO(),
+        )
+
+        with open(output, 'rb') as f:
+            self.assertEqual(self.page_count(f.read()), 1)
+        self.assertEqual(PrintOrder.objects.filter(status=PrintOrder.Status.IN_PRODUCTION).count(), 6)
+        self.assertFalse(
+            PrintOrder.objects.filter(
+                status=PrintOrder.Status.PENDING, order__order_type=Order.OrderType.PVC_CARD
+            ).exists()
+        )
+
+    def test_admin_action_streams_the_pdf(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('admin:core_printorder_changelist'), {
+            'action': 'download_print_sheet',
+            '_selected_action': list(PrintOrder.objects.values_list('pk', flat=True)),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(self.page_count(b''.join(response.streaming_content)), 2)
+
+
+class QRPdfDownloadTests(TestCase):
+    """The QR PDF is stored once per record version and served conditionally."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix='rto_pdf_')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = override_settings(MEDIA_ROOT=media_root, QR_PERSIST_IMAGES=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234'
+        )
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999',
+            address='12 MG Road', record_type='rto',
+        )
+        gallery_utils.generate_qr_code_for_record(self.record, get_gallery_url(self.record))
+        self.url = reverse('records-download-qr-pdf', kwargs={'pk': self.record.pk})
+        self.client.force_login(self.user)
+
+    def test_pdf_is_built_once_and_revalidated(self):
+        with mock.patch.object(qr_pdf, 'render_qr_pdf', side_effect=qr_pdf.render_qr_pdf) as render:
+            first = self.client.get(self.url)
+            body = b''.join(first.streaming_content)
+            again = self.client.get(self.url)
+            b''.join(again.streaming_content)
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(render.call_count, 1)
+        self.assertTrue(body.startswith(b'%PDF-'))
+        self.assertEqual(first['Content-Length'], str(len(body)))
+        self.assertEqual(first['Accept-Ranges'], 'bytes')
+        self.assertIn('attachment', first['Content-Disposition'])
+        self.assertEqual(again['ETag'], first['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.record.refresh_from_db()
+        self.assertTrue(default_storage.exists(self.record.pdf_card_filepath))
+
+    def test_byte_ranges(self):
+        body = b''.join(self.client.get(self.url).streaming_content)
+
+        head = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(head.status_code, 206)
+        self.assertEqual(b''.join(head.streaming_content), body[:10])
+        self.assertEqual(head['Content-Range'], f'bytes 0-9/{len(body)}')
+
+        tail = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(tail.streaming_content), body[-5:])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(body)}-').status_code, 416)
+        # A range against an older version gets the whole new file
+        stale = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual(stale.status_code, 200)
+
+    def test_editing_the_record_replaces_the_stored_pdf(self):
+        etag = self.client.get(self.url)['ETag']
+        self.record.refresh_from_db()
+        old_name = self.record.pdf_card_filepath
+
+        self.record.name = 'Asha K'
+        self.record.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertFalse(default_storage.exists(old_name))
+
+
+class RecordGalleryViewTests(TestCase):
+    """The Django-served gallery is cacheable and revalidates cheaply."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234'
+        )
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999',
+            address='12 MG Road', record_type='rto',
+            rc_photo='https://res.cloudinary.com/demo/rc.jpg',
+        )
+        Order.objects.create(
+            user=self.user, rto_record=self.record, order_id='order_gallery_1',
+            order_type=Order.OrderType.QR_DOWNLOAD, amount=100,
+            payment_provider='razorpay', payment_status=Order.Status.COMPLETED,
+        )
+        self.url = reverse('core:record_gallery', kwargs={'record_id': self.record.id})
+        self.addCleanup(cache.clear)
+
+    def test_page_carries_validators_and_cache_headers(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'rc.jpg')
+        self.assertRegex(response['ETag'], r'^"[0-9a-f]{32}"$')
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=3600', response['Cache-Control'])
+
+    def test_repeat_scan_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with mock.patch.object(gallery_utils, 'render_to_string') as render:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        render.assert_not_called()
+
+    def test_template_change_is_not_hidden_by_if_modified_since(self):
+        self.client.get(self.url)
+        since = http_date(self.record.updated_at.timestamp() + 60)
+        with mock.patch.object(gallery_utils, 'gallery_template_hash', return_value='new-template'):
+            response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=since)
+        self.assertEqual(response.status_code, 200)
+
+    def test_rendered_page_is_cached_per_version(self):
+        first = self.client.get(self.url)
+        with mock.patch.object(gallery_utils, 'render_to_string') as render:
+            self.assertEqual(self.client.get(self.url).content, first.content)
+        render.assert_not_called()
+
+        self.record.insurance_doc = 'https://res.cloudinary.com/demo/insurance.pdf'
+        self.record.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertContains(response, 'insurance.pdf')
+
+    def test_unpaid_record_is_not_published(self):
+        self.record.orders.update(payment_status=Order.Status.PENDING)
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+
+class InlinePipeline:
+    """Run the pipeline stages in the calling thread, like one worker would.
+
+    Eager Celery chains track "inside a task" in a process-wide flag, so they
+    cannot be applied from several threads at once.
+    """
+
+    def __init__(self, *args):
+        self.signatures = build_post_payment_pipeline(*args).tasks
+
+    def apply_async(self):
+        for signature in self.signatures:
+            signature()
+
+
+class ConcurrentPaymentStressTests(LocalGitRemoteMixin, TransactionTestCase):
+    """Many simultaneous payments share one checkout without corrupting it."""
+
+    PAYMENTS = 36
+    WORKERS = 12
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234'
+        )
+        self.orders = []
+        for i in range(self.PAYMENTS):
+            record = RTORecord.objects.create(
+                owner=self.user, name=f'Owner {i}', contact_no='9999999999',
+                address='12 MG Road', record_type='rto',
+                rc_photo=f'https://res.cloudinary.com/demo/rc_{i}.jpg',
+            )
+            self.orders.append(Order.objects.create(
+                user=self.user, rto_record=record, order_id=f'order_stress_{i}',
+                order_type=Order.OrderType.PVC_CARD, amount=100,
+                payment_provider='razorpay',
+            ))
+
+    def pay(self, order):
+        client = Client()
+        client.force_login(self.user)
+        payment_id = f'pay_{order.order_id}'
+        try:
+            return client.post(
+                reverse('core:verify_payment'),
+                json.dumps({
+                    'razorpay_order_id': order.order_id,
+                    'razorpay_payment_id': payment_id,
+                    'razorpay_signature': razorpay_signature(order.order_id, payment_id),
+                }),
+                content_type='application/json', HTTP_REFERER='/records/x/payment/pvc_card/',
+            ).status_code
+        finally:
+            connection.close()
+
+    def test_concurrent_payments_publish_every_gallery_once(self):
+        with mock.patch('core.tasks.build_post_payment_pipeline', InlinePipeline), \
+                ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            statuses = list(pool.map(self.pay, self.orders))
+        self.assertEqual(set(statuses), {200})
+        # Whatever was queued behind the last running deploy
+        flush_gallery_deploys()
+
+        files = set(self.remote_files())
+        for order in self.orders:
+            record = RTORecord.objects.get(pk=order.rto_record_id)
+            path = f'deploy_site/record_{record.id}/index.html'
+            self.assertIn(path, files)
+            self.assertIn(record.name, git(self.remote_dir, 'show', f'main:{path}'))
+            self.assertEqual(record.gallery_html_url, get_gallery_url(record))
+        self.assertLess(len(self.remote_commits()), self.PAYMENTS)
+        self.assertFalse(DeployBatch.objects.filter(status=DeployBatch.Status.FAILED).exists())
+        self.assertEqual(git(self.repo_dir, 'status', '--porcelain'), '')
+        git(self.remote_dir, 'fsck', '--strict')
+
+
+@override_settings(DEPLOY_SITE_LAYOUT='sharded')
+class ShardedDeployLayoutTests(LocalGitRemoteMixin, TestCase):
+    """Galleries are served from prefix directories; moved ones keep their old URLs."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='owner', email='owner@example.com', password='pass1234'
+        )
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999',
+            address='12 MG Road', record_type='rto',
+            rc_photo='https://res.cloudinary.com/demo/rc.jpg',
+        )
+        hex_id = self.record.id.hex
+        self.shard_path = f'deploy_site/r/{hex_id[:2]}/{hex_id[2:4]}/{self.record.id}'
+
+    def redirects(self):
+        return git(self.remote_dir, 'show', 'main:deploy_site/_redirects').splitlines()
+
+    def test_galleries_are_published_under_prefix_directories(self):
+        generate_static_html(self.record)
+        schedule_gallery_deploy(self.record)
+
+        self.assertIn(f'{self.shard_path}/index.html', self.remote_files())
+        self.assertNotIn('deploy_site/_redirects', self.remote_files())
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.gallery_html_url, get_gallery_url(self.record))
+        self.assertTrue(self.record.gallery_html_url.endswith(f'{self.shard_path[len("deploy_site"):]}/'))
+
+    def test_migration_moves_flat_folders_and_keeps_their_old_urls(self):
+        with override_settings(DEPLOY_SITE_LAYOUT='flat'):
+            generate_static_html(self.record)
+            schedule_gallery_deploy(self.record)
+        self.record.refresh_from_db()
+        old_url = self.record.gallery_html_url
+        orphan = os.path.join(self.repo_dir, 'deploy_site', 'record_00000000-0000-0000-0000-000000000000')
+        os.makedirs(orphan)
+        open(os.path.join(orphan, 'index.html'), 'w').close()
+
+        call_command('migrate_deploy_layout', stdout=io.StringIO())
+
+        files = self.remote_files()
+        self.assertIn(f'{self.shard_path}/index.html', files)
+        self.assertNotIn(f'deploy_site/record_{self.record.id}/index.html', files)
+        self.assertTrue(os.path.isdir(orphan))
+        self.assertEqual(len(self.remote_commits()), 2)
+        target = self.shard_path[len('deploy_site/'):]
+        self.assertEqual(self.redirects(), [
+            gallery_utils.REDIRECTS_HEADER,
+            f'/record_{self.record.id}    /{target}/index.html    200',
+            f'/record_{self.record.id}/*    /{target}/:splat    200',
+            gallery_utils.REDIRECTS_FALLBACK,
+        ])
+
+        # The QR code now encodes the sharded URL
+        self.record.refresh_from_db()
+        self.assertNotEqual(self.record.gallery_html_url, old_url)
+        self.assertEqual(self.record.gallery_html_url, get_gallery_url(self.record))
+        self.assertEqual(self.record.qr_payload, self.record.gallery_html_url)
+
+        # A moved page is already live, so it is not queued again
+        schedule_gallery_deploy(self.record)
+        self.assertFalse(GalleryDeploy.objects.filter(batch__isnull=True).exists())
+
+    def test_redirects_follow_galleries_that_move_again(self):
+        flat, sharded = f'record_{self.record.id}', self.shard_path[len('deploy_site/'):]
+        self.assertTrue(gallery_utils.write_redirects([(flat, sharded)]))
+        self.assertFalse(gallery_utils.write_redirects([(flat, sharded)]))
+        path = os.path.join(settings.DEPLOY_SITE_DIR, '_redirects')
+        self.assertEqual(gallery_utils.read_redirects(path), {flat: sharded})
+
+        gallery_utils.write_redirects([(sharded, 'archive/x')])
+        self.assertEqual(gallery_utils.read_redirects(path), {flat: 'archive/x', sharded: 'archive/x'})
+        gallery_utils.write_redirects([('archive/x', flat)])
+        self.assertEqual(gallery_utils.read_redirects(path), {sharded: flat, 'archive/x': flat})
+
+    def test_migration_regenerates_qr_codes_when_the_url_changes(self):
+        generate_static_html(self.record)
+        schedule_gallery_deploy(self.record)
+
+        with override_settings(GALLERY_BASE_URL='https://records.example.com'):
+            call_command('migrate_deploy_layout', stdout=io.StringIO())
+            self.record.refresh_from_db()
+            self.assertEqual(self.record.gallery_html_url, get_gallery_url(self.record))
+        self.assertTrue(self.record.qr_code_image)
+
+
+@override_settings(DEPLOY_PUBLISHER='git')
+class GitCliDeployBatcherTests(DeployBatcherTests):
+    """The same batching behaviour through the git command line publisher."""
+
+
+class GitObjectPublisherTests(LocalGitRemoteMixin, TestCase):
+    """Only the trees above a changed gallery are rewritten."""
+
+    def write(self, rel_path, content):
+        path = os.path.join(self.repo_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_untouched_galleries_keep_their_tree_objects(self):
+        self.write('deploy_site/record_a/index.html', 'a')
+        self.write('deploy_site/record_b/index.html', 'b')
+        with GitObjectPublisher(self.repo_dir) as publisher:
+            publisher.publish(['deploy_site/record_a', 'deploy_site/record_b'], 'init', 'origin', 'main')
+            before = git(self.repo_dir, 'rev-parse', 'HEAD:deploy_site/record_b')
+
+            self.write('deploy_site/record_a/index.html', 'a2')
+            shutil.rmtree(os.path.join(self.repo_dir, 'deploy_site/record_b'))
+            self.write('deploy_site/record_c/index.html', 'c')
+            publisher.publish(['deploy_site/record_a', 'deploy_site/record_c'], 'update', 'origin', 'main')
+
+            self.assertEqual(git(self.repo_dir, 'rev-parse', 'HEAD:deploy_site/record_b'), before)
+            self.assertEqual(git(self.remote_dir, 'show', 'main:deploy_site/record_a/index.html'), 'a2')
+            self.assertIn('deploy_site/record_c/index.html', self.remote_files())
+
+            # Removing the folder from the commit needs it listed explicitly
+            publisher.publish(['deploy_site/record_b'], 'remove', 'origin', 'main')
+            self.assertNotIn('deploy_site/record_b/index.html', self.remote_files())
+            self.assertIsNone(publisher.commit(['deploy_site/record_a'], 'noop'))
+
+        self.assertEqual(len(self.remote_commits()), 3)
+        self.assertEqual(git(self.repo_dir, 'status', '--porcelain'), '')
+
+
+class OrderRollupTests(TestCase):
+    """The analytics rollups match the orders and refresh only what changed."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass1234')
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999', address='12 MG Road', record_type='rto',
+        )
+        now = timezone.now()
+        self.orders = []
+        for days_ago, order_type, status, amount in [
+            (0, Order.OrderType.QR_DOWNLOAD, Order.Status.COMPLETED, 2),
+            (0, Order.OrderType.QR_DOWNLOAD, Order.Status.PENDING, 2),
+            (3, Order.OrderType.PVC_CARD, Order.Status.COMPLETED, 150),
+            (3, Order.OrderType.QR_DOWNLOAD, Order.Status.FAILED, 2),
+            (40, Order.OrderType.QR_DOWNLOAD, Order.Status.COMPLETED, 2),
+        ]:
+            order = Order.objects.create(
+                user=self.user, rto_record=self.record, order_id=f'order_{len(self.orders)}',
+                order_type=order_type, amount=amount, total_amount=amount, payment_status=status,
+            )
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(days=days_ago))
+            order.refresh_from_db()
+            self.orders.append(order)
+
+    def rollup_counts(self):
+        return {
+            (row.day, row.order_type, row.payment_status): (row.orders, row.amount)
+            for row in DailyOrderRollup.objects.all()
+        }
+
+    def order_counts(self):
+        counts = {}
+        for order in Order.objects.all():
+            key = (timezone.localdate(order.created_at), order.order_type, order.payment_status)
+            orders, amount = counts.get(key, (0, 0))
+            counts[key] = (orders + 1, amount + order.total_amount)
+        return counts
+
+    def test_refresh_matches_the_orders(self):
+        self.assertEqual(refresh_rollups(), {'orders': 3, 'transactions': 0})
+        self.assertEqual(self.rollup_counts(), self.order_counts())
+
+    def test_incremental_refresh_recomputes_only_changed_days(self):
+        refresh_rollups()
+        old_day = timezone.localdate() - timedelta(days=40)
+        DailyOrderRollup.objects.filter(day=old_day).update(orders=99)
+        RollupState.objects.update(watermark=timezone.now())
+
+        Order.objects.filter(pk=self.orders[1].pk).update(
+            payment_status=Order.Status.COMPLETED, updated_at=timezone.now(),
+        )
+        self.assertEqual(refresh_rollups(), {'orders': 1, 'transactions': 0})
+        rollups = self.rollup_counts()
+        self.assertEqual(rollups[(timezone.localdate(), Order.OrderType.QR_DOWNLOAD, Order.Status.COMPLETED)], (2, 4))
+        # Untouched days are left alone until a full rebuild
+        self.assertEqual(rollups[(old_day, Order.OrderType.QR_DOWNLOAD, Order.Status.COMPLETED)][0], 99)
+
+        call_command('refresh_rollups', '--full', stdout=io.StringIO())
+        self.assertEqual(self.rollup_counts(), self.order_counts())
+
+    @override_settings(ROLLUP_WATERMARK_LAG=0)
+    def test_deleted_orders_leave_their_day_dirty(self):
+        refresh_rollups()
+        self.orders[4].delete()
+        self.assertEqual(refresh_rollups(), {'orders': 1, 'transactions': 0})
+        self.assertEqual(self.rollup_counts(), self.order_counts())
+        self.assertFalse(RollupDirtyDay.objects.exists())
+
+    def test_refresh_skips_while_another_is_running(self):
+        cache.add(rollups.REFRESH_LOCK_KEY, True)
+        self.addCleanup(cache.delete, rollups.REFRESH_LOCK_KEY)
+        self.assertIsNone(refresh_rollups())
+
+    def test_admin_page_reads_only_the_rollups(self):
+        refresh_rollups()
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='pass1234')
+        self.client.force_login(admin_user)
+        url = reverse('admin:core_dailyorderrollup_changelist')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'days': 7})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['totals']['orders'], 4)
+        self.assertEqual(response.context['totals']['completed'], 2)
+        self.assertEqual(response.context['totals']['revenue'], 152)
+        self.assertEqual(response.context['totals']['completion_rate'], 50.0)
+        self.assertFalse([q for q in queries.captured_queries if 'FROM "order"' in q['sql']])
+
+
+class DashboardStatsTests(TestCase):
+    """Dashboard counters come from one query and are dropped when they change."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass1234')
+        self.records = [
+            RTORecord.objects.create(
+                owner=self.user, name=f'Record {status}', contact_no='9999999999',
+                address='12 MG Road', record_type='rto', status=status,
+            )
+            for status in [RTORecord.Status.APPROVED, RTORecord.Status.PENDING, RTORecord.Status.PENDING]
+        ]
+        self.order = Order.objects.create(
+            user=self.user, rto_record=self.records[0], order_id='order_stats',
+            order_type=Order.OrderType.QR_DOWNLOAD, amount=2, total_amount=2,
+        )
+        self.client.force_login(self.user)
+
+    def stats(self):
+        return self.client.get(reverse('core:dashboard')).context['stats']
+
+    def test_counts_are_computed_once_and_cached(self):
+        expected = {'total_records': 3, 'approved_records': 1, 'pending_records': 2, 'total_orders': 1}
+        self.assertEqual(compute_dashboard_stats(self.user.pk), expected)
+        with self.assertNumQueries(1):
+            compute_dashboard_stats(self.user.pk)
+
+        self.assertEqual(self.stats(), expected)
+        with mock.patch.object(dashboard_stats, 'compute_dashboard_stats') as compute:
+            self.assertEqual(self.stats(), expected)
+        compute.assert_not_called()
+
+    def test_record_and_order_changes_invalidate(self):
+        self.stats()
+        record = self.records[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            record.status = RTORecord.Status.APPROVED
+            record.save()
+        self.assertEqual(self.stats()['approved_records'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(
+                user=self.user, rto_record=record, order_id='order_stats_2',
+                order_type=Order.OrderType.QR_DOWNLOAD, amount=2, total_amount=2,
+            )
+        self.assertEqual(self.stats()['total_orders'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.records[2].delete()
+        self.assertEqual(self.stats(), {
+            'total_records': 2, 'approved_records': 2, 'pending_records': 0, 'total_orders': 2,
+        })
+
+    def test_changing_owner_invalidates_both_owners(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='pass1234')
+        self.assertEqual(get_dashboard_stats(self.user)['total_records'], 3)
+        self.assertEqual(get_dashboard_stats(other)['total_records'], 0)
+
+        record = RTORecord.objects.get(pk=self.records[1].pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            record.owner = other
+            record.save()
+        self.assertEqual(get_dashboard_stats(self.user)['total_records'], 2)
+        self.assertEqual(get_dashboard_stats(other)['total_records'], 1)
+
+    def test_payment_updates_keep_the_cache(self):
+        self.stats()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.order.payment_status = Order.Status.COMPLETED
+            self.order.save()
+            RTORecord.objects.get(pk=self.records[0].pk).save(update_fields=['updated_at'])
+        self.assertEqual(callbacks, [])
+
+
+class KeysetPaginationTests(TestCase):
+    """API list endpoints page on (created_at, id) cursors without counting."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass1234')
+        record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999', address='12 MG Road', record_type='rto',
+        )
+        # Pairs of orders share a timestamp so the id tie-breaker matters
+        now = timezone.now()
+        for i in range(8):
+            order = Order.objects.create(
+                user=self.user, rto_record=record, order_id=f'order_page_{i}',
+                order_type=Order.OrderType.QR_DOWNLOAD, amount=2, total_amount=2,
+            )
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(minutes=i // 2))
+        self.expected = list(Order.objects.order_by('-created_at', '-pk').values_list('order_id', flat=True))
+        self.record = record
+        self.client.force_login(self.user)
+        self.url = reverse('orders-list') + '?page_size=3'
+
+    def walk(self, url, link):
+        ids = []
+        while url:
+            body = self.client.get(url).json()
+            ids.append([order['order_id'] for order in body['results']])
+            url = body[link]
+        return ids
+
+    def test_pages_follow_the_model_ordering_without_a_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            body = self.client.get(self.url).json()
+        self.assertNotIn('count', body)
+        self.assertIsNone(body['previous'])
+        self.assertFalse([q for q in queries.captured_queries if 'COUNT(' in q['sql']])
+
+        pages = self.walk(self.url, 'next')
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertEqual(sum(pages, []), self.expected)
+
+        last = self.client.get(reverse('orders-list'), {'page_size': 2}).json()
+        for _ in range(3):
+            last = self.client.get(last['next']).json()
+        backwards = self.walk(last['previous'], 'previous')
+        self.assertEqual(sum(reversed(backwards), []), self.expected[:6])
+
+    def test_inserts_while_paging_do_not_shift_pages(self):
+        first = self.client.get(self.url).json()
+        Order.objects.create(
+            user=self.user, rto_record=self.record, order_id='order_page_new',
+            order_type=Order.OrderType.QR_DOWNLOAD, amount=2, total_amount=2,
+        )
+        second = self.client.get(first['next']).json()
+        self.assertEqual([order['order_id'] for order in second['results']], self.expected[3:6])
+
+    def test_page_numbers_and_bad_cursors(self):
+        body = self.client.get(self.url + '&page=2').json()
+        self.assertEqual(body['count'], 8)
+        self.assertEqual([order['order_id'] for order in body['results']], self.expected[3:6])
+        self.assertEqual(self.client.get(self.url + '&cursor=not-a-cursor').status_code, 404)
+
+    def test_records_page_on_uuid_keys(self):
+        now = timezone.now()
+        for i in range(4):
+            record = RTORecord.objects.create(
+                owner=self.user, name=f'Record {i}', contact_no='9999999999', address='-', record_type='rto',
+            )
+            RTORecord.objects.filter(pk=record.pk).update(created_at=now - timedelta(minutes=i // 2))
+        expected = [str(pk) for pk in RTORecord.objects.order_by('-created_at', '-pk').values_list('pk', flat=True)]
+
+        url = reverse('records-list') + '?page_size=2'
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            pages.append([record['id'] for record in body['results']])
+            url = body['next']
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+        back = self.client.get(body['previous']).json()
+        self.assertEqual([record['id'] for record in back['results']], expected[2:4])
+
+
+class QueryBudgetTests(TestCase):
+    """List endpoints run the same queries for 2 rows as for 12, within their budgets."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='owner', email='owner@example.com', password='pass1234')
+        self.client.force_login(self.user)
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.rows += 1
+            owner = User.objects.create_user(
+                username=f'user{self.rows}', email=f'user{self.rows}@example.com', password='pass1234',
+            )
+            for user in (self.user, owner):
+                record = RTORecord.objects.create(
+                    owner=user, name=f'Record {self.rows}', contact_no='9999999999',
+                    address='12 MG Road', record_type='rto', qr_payload='https://example.com/r',
+                )
+                order = Order.objects.create(
+                    user=user, rto_record=record, order_id=f'order_budget_{user.pk}_{self.rows}',
+                    order_type=Order.OrderType.PVC_CARD, amount=150, total_amount=150,
+                )
+            PrintOrder.objects.create(order=order, rto_record=record)
+            GalleryRender.objects.create(record=record, input_hash='a', template_hash='b', output_hash='c')
+            DeployBatch.objects.create()
+
+    def assertQueriesDoNotScale(self, url):
+        self.add_rows(2)
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.add_rows(10)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(many), len(few))
+        return response
+
+    def test_api_record_list(self):
+        response = self.assertQueriesDoNotScale(reverse('records-list'))
+        self.assertEqual(len(response.json()['results']), 12)
+
+    def test_api_order_list(self):
+        response = self.assertQueriesDoNotScale(reverse('orders-list'))
+        self.assertEqual(len(response.json()['results']), 12)
+
+    def test_api_order_detail_includes_its_record(self):
+        self.add_rows(1)
+        order = Order.objects.filter(user=self.user).get()
+        body = self.client.get(reverse('orders-detail', kwargs={'pk': order.pk})).json()
+        self.assertEqual(body['rto_record_details']['name'], order.rto_record.name)
+        self.assertTrue(body['rto_record_details']['qr_code_url'])
+
+    def test_admin_changelists(self):
+        for model in [RTORecord, Order, PrintOrder, DeployBatch, GalleryRender]:
+            with self.subTest(model=model.__name__):
+                self.assertQueriesDoNotScale(reverse(f'admin:core_{model._meta.model_name}_changelist'))
+
+    def test_going_over_budget_raises(self):
+        self.add_rows(2)
+        with mock.patch.object(OrderSerializer, 'setup_eager_loading', side_effect=lambda queryset: queryset):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('orders-list'))
+
+
+class SQLiteWritePathTests(TransactionTestCase):
+    """Connections get the tuned pragmas and locked writes are retried."""
+
+    @skipUnless(connection.vendor == 'sqlite', "SQLite pragmas")
+    def test_connections_use_wal_and_immediate_transactions(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(connection.settings_dict['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+
+    @mock.patch('core.utils.db_retry.time.sleep')
+    def test_locked_writes_are_retried_outside_transactions(self, sleep):
+        calls = []
+
+        @atomic_with_retry
+        def write():
+            calls.append(connection.in_atomic_block)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'saved'
+
+        self.assertEqual(write(), 'saved')
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(all(calls))
+        self.assertEqual(sleep.call_count, 2)
+
+        # Inside a transaction the caller owns the retry
+        calls.clear()
+        with self.assertRaises(OperationalError), transaction.atomic():
+            write()
+        self.assertEqual(len(calls), 1)
+
+    @mock.patch('core.utils.db_retry.time.sleep')
+    def test_other_errors_and_exhausted_retries_propagate(self, sleep):
+        @atomic_with_retry
+        def broken():
+            raise OperationalError('no such table: nope')
+
+        @atomic_with_retry
+        def locked():
+            raise OperationalError('database is locked')
+
+        with self.assertRaisesMessage(OperationalError, 'no such table'):
+            broken()
+        self.assertEqual(sleep.call_count, 0)
+        with self.assertRaisesMessage(OperationalError, 'locked'):
+            locked()
+        self.assertEqual(sleep.call_count, settings.DB_WRITE_RETRIES)
+
+
+class ChangeTrackingTests(TestCase):
+    """Saves compare against the loaded values instead of re-reading the row."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass1234')
+        record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999', address='12 MG Road', record_type='rto',
+        )
+        self.record = RTORecord.objects.get(pk=record.pk)
+
+    def test_save_writes_only_changed_columns_without_a_select(self):
+        self.record.status = RTORecord.Status.APPROVED
+        with CaptureQueriesContext(connection) as queries:
+            self.record.save()
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertTrue(sql.startswith('UPDATE'))
+        for column in ('"status"', '"reviewed_at"', '"updated_at"'):
+            self.assertIn(column, sql)
+        self.assertNotIn('"name"', sql)
+        self.assertIsNotNone(RTORecord.objects.get(pk=self.record.pk).reviewed_at)
+
+        # Saved values become the new baseline
+        self.assertEqual(self.record.get_changed_fields(), [])
+        reviewed_at = self.record.reviewed_at
+        self.record.notes = 'checked'
+        with self.assertNumQueries(1):
+            self.record.save()
+        self.assertEqual(self.record.reviewed_at, reviewed_at)
+
+    def test_in_place_json_and_file_changes_are_detected(self):
+        self.record.pipeline_status['gallery'] = {'status': 'done'}
+        self.record.qr_code_image.name = 'qr_codes/new.png'
+        self.assertEqual(self.record.get_changed_fields(), ['pipeline_status', 'qr_code_image'])
+        self.assertEqual(self.record.get_initial_value('pipeline_status'), {})
+        self.record.save()
+
+        fresh = RTORecord.objects.get(pk=self.record.pk)
+        self.assertEqual(fresh.pipeline_status, {'gallery': {'status': 'done'}})
+        self.assertEqual(fresh.qr_code_image.name, 'qr_codes/new.png')
+
+    def test_created_and_deferred_instances_track_too(self):
+        order = Order.objects.create(
+            user=self.user, rto_record=self.record, order_id='order_track_1',
+            order_type=Order.OrderType.QR_DOWNLOAD, amount=2,
+        )
+        order.payment_status = Order.Status.COMPLETED
+        self.assertEqual(order.get_changed_fields(), ['payment_status'])
+        with self.assertNumQueries(1):
+            order.save()
+        self.assertIsNotNone(Order.objects.get(pk=order.pk).completed_at)
+
+        record = RTORecord.objects.only('pk', 'status').get(pk=self.record.pk)
+        record.name = 'Asha Rao'
+        self.assertEqual(record.get_changed_fields(), ['name'])
+        record.save()
+        self.assertEqual(RTORecord.objects.get(pk=record.pk).name, 'Asha Rao')
+
+    def test_print_orders_stamp_status_transitions(self):
+        order = Order.objects.create(
+            user=self.user, rto_record=self.record, order_id='order_track_2',
+            order_type=Order.OrderType.PVC_CARD, amount=100,
+        )
+        PrintOrder.objects.create(order=order, rto_record=self.record)
+        print_order = PrintOrder.objects.get(order=order)
+        print_order.production_notes = 'queued'
+        print_order.save()
+        self.assertIsNone(print_order.printed_at)
+
+        print_order.status = PrintOrder.Status.PRINTED
+        with self.assertNumQueries(1):
+            print_order.save()
+        self.assertIsNotNone(PrintOrder.objects.get(pk=print_order.pk).printed_at)
+
+    def test_generating_a_qr_code_issues_one_update(self):
+        with self.settings(QR_PERSIST_IMAGES=False), self.assertNumQueries(1):
+            gallery_utils.generate_qr_code_for_record(self.record, 'https://example.com/g/1/')
+        self.assertEqual(RTORecord.objects.get(pk=self.record.pk).qr_payload, 'https://example.com/g/1/')
+
+
+@skipUnless(connection.vendor == 'postgresql', "Needs DATABASE_URL pointing at a PostgreSQL server")
+class PostgreSQLTests(TransactionTestCase):
+    """Per-request statement timeouts and the SQLite to PostgreSQL copy."""
+
+    SOURCE = 'sqlite_source'
+    # Resolved in setUpClass, after the source alias is added
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # A migrated SQLite database to copy from, reachable as its own alias
+        directory = tempfile.mkdtemp(prefix='rto_sqlite_source_')
+        cls.source_path = os.path.join(directory, 'source.sqlite3')
+        connections.settings.update(connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            cls.SOURCE: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': cls.source_path},
+        }))
+        call_command('migrate', database=cls.SOURCE, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.SOURCE].close()
+        del connections[cls.SOURCE]
+        del connections.settings[cls.SOURCE]
+        shutil.rmtree(os.path.dirname(cls.source_path), ignore_errors=True)
+
+    def test_statement_timeout_follows_the_request_type(self):
+        from core.middleware import StatementTimeoutMiddleware
+
+        seen = {}
+
+        def view(request):
+            with connection.cursor() as cursor:
+                cursor.execute('SHOW statement_timeout')
+                seen[request.method, request.path] = cursor.fetchone()[0]
+
+        middleware = StatementTimeoutMiddleware(view)
+        factory = RequestFactory()
+        with self.settings(DB_STATEMENT_TIMEOUTS={'read': 1000, 'write': 2000, 'admin': 3000}):
+            middleware(factory.get('/dashboard/'))
+            middleware(factory.post('/api/orders/'))
+            middleware(factory.get('/admin/core/order/'))
+        self.assertEqual(seen, {
+            ('GET', '/dashboard/'): '1s', ('POST', '/api/orders/'): '2s', ('GET', '/admin/core/order/'): '3s',
+        })
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW statement_timeout')
+            self.assertEqual(cursor.fetchone()[0], '0')
+
+    def test_copy_rows_round_trip_every_column_type(self):
+        from core.management.commands.migrate_sqlite_to_postgres import csv_value
+
+        # Values as sqlite3 returns them: booleans as ints, datetimes, UUIDs and JSON as text
+        rows = [
+            (1, '', 'say "hi",\nbye', b'\x00\xff', 1, '2024-05-01 10:30:00.123456', '{"a": [1, "b"]}',
+             '2.50', 'a5d3f1e2c4b6478899aabbccddeeff00'),
+            (2, None, None, None, 0, None, None, 2.5, None),
+        ]
+        buffer = io.StringIO(''.join(','.join(map(csv_value, row)) + '\n' for row in rows))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE copy_types (id integer, empty text, quoted text, data bytea, flag boolean,'
+                ' stamp timestamptz, payload jsonb, amount numeric(10, 2), uid uuid)'
+            )
+            cursor.copy_expert('COPY copy_types FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.execute('SELECT * FROM copy_types ORDER BY id')
+            first, second = cursor.fetchall()
+
+        self.assertEqual((first[1], first[2], bytes(first[3]), first[4]), ('', 'say "hi",\nbye', b'\x00\xff', True))
+        self.assertEqual(first[5].isoformat(), '2024-05-01T10:30:00.123456+00:00')
+        self.assertEqual((json.loads(first[6]), first[7], str(first[8])),
+                         ({'a': [1, 'b']}, Decimal('2.50'), 'a5d3f1e2-c4b6-4788-99aa-bbccddeeff00'))
+        self.assertEqual(second[1:], (None, None, None, False, None, None, Decimal('2.50'), None))
+
+    def test_migrate_sqlite_to_postgres_copies_rows_and_resets_sequences(self):
+        # bulk_create: the profile signal would write to the default database
+        User.objects.using(self.SOURCE).bulk_create([
+            User(username='owner', email='owner@example.com', is_staff=True),
+        ])
+        user = User.objects.using(self.SOURCE).get(username='owner')
+        Profile.objects.using(self.SOURCE).bulk_create([Profile(user=user, phone='9999999999')])
+        record = RTORecord.objects.using(self.SOURCE).create(
+            owner=user, name='Asha "A" Rao', contact_no='9999999999', address='12 MG Road,\nPune',
+            record_type='rto', pipeline_status={'gallery': {'status': 'done'}},
+        )
+        for i in range(5):
+            Order.objects.using(self.SOURCE).create(
+                user=user, rto_record=record, order_id=f'order_copy_{i}',
+                order_type=Order.OrderType.QR_DOWNLOAD, amount=Decimal('2.50'), shipping_cost=1,
+            )
+        connections[self.SOURCE].close()
+
+        out = io.StringIO()
+        call_command('migrate_sqlite_to_postgres', source=self.source_path, batch_size=2, stdout=out)
+        self.assertRegex(out.getvalue(), r'(?m)^order: 5 rows')
+        copied = RTORecord.objects.get(pk=record.pk)
+        self.assertEqual((copied.name, copied.address, copied.owner.username), (record.name, record.address, 'owner'))
+        self.assertEqual((copied.created_at, copied.pipeline_status), (record.created_at, record.pipeline_status))
+        self.assertEqual((copied.notes, copied.reviewed_at), ('', None))
+        self.assertTrue(copied.owner.is_staff)
+        self.assertEqual(copied.owner.core_profile.phone, '9999999999')
+        self.assertEqual(
+            list(Order.objects.filter(rto_record=copied).values_list('total_amount', flat=True)), [Decimal('3.50')] * 5,
+        )
+        # New rows continue after the copied ids
+        self.assertGreater(User.objects.create_user(username='next', email='next@example.com').pk, user.pk)
+        self.assertGreater(
+            Order.objects.create(user=copied.owner, rto_record=copied, order_type='qr_download', amount=2).pk,
+            max(Order.objects.using(self.SOURCE).values_list('pk', flat=True)),
+        )
+
+        with self.assertRaisesMessage(CommandError, 'already has rows'):
+            call_command('migrate_sqlite_to_postgres', source=self.source_path, stdout=io.StringIO())
+        call_command('migrate_sqlite_to_postgres', source=self.source_path, truncate=True, stdout=io.StringIO())
+        self.assertFalse(User.objects.filter(username='next').exists())
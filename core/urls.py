@@ -30,6 +30,10 @@ urlpatterns = [
     path('orders/<str:order_id>/success/', views.order_success_view, name='order_success'),
     path('orders/<str:order_id>/cancel/', views.order_cancel_view, name='order_cancel'),
 
+    # Public document gallery (QR target when GALLERY_BACKEND is 'django')
+    path('gallery/<uuid:record_id>/', views.record_gallery_view, name='record_gallery'),
+    path('records/<uuid:record_id>/qr/', views.record_qr_view, name='record_qr'),
+
     # Document verification (for QR scanning)
     path('verify-record/<uuid:record_id>/', views.verify_record_view, name='verify_record'),
 
@@ -0,0 +1,95 @@
+"""Field change tracking for models, without re-reading the row.
+
+``ChangeTrackingMixin`` snapshots the field values an instance was loaded
+with (``from_db``) or last saved with. ``save()`` then compares against the
+snapshot instead of fetching the stored row: ``has_changed('status')`` and
+``get_initial_value('status')`` tell a model's ``save()`` about transitions,
+and a plain ``save()`` of a loaded instance writes only the changed columns
+(plus ``auto_now`` ones, so ``updated_at`` still moves and signals still
+fire). Callers passing ``update_fields`` themselves are left alone.
+
+The snapshot only knows about changes made through the instance: a row
+updated elsewhere since it was loaded is overwritten column by column, not
+wholesale, which is what ``update_fields`` callers already get.
+"""
+import copy
+
+from django.db.models import DEFERRED
+from django.db.models.fields.files import FieldFile
+
+
+def snapshot_value(value):
+    # Files are saved and JSONField values mutated in place (e.g. RTORecord.pipeline_status)
+    if isinstance(value, FieldFile):
+        return value.name
+    return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+
+class ChangeTrackingMixin:
+    """Model mixin: remember loaded values and save only what changed."""
+
+    _loaded_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            attname: snapshot_value(value)
+            for attname, value in zip(field_names, values) if value is not DEFERRED
+        }
+        return instance
+
+    def has_changed(self, field_name):
+        """Whether ``field_name`` differs from the loaded or last saved value.
+
+        Always True for an instance that was never loaded or saved.
+        """
+        if self._loaded_values is None:
+            return True
+        attname = self._meta.get_field(field_name).attname
+        if attname not in self._loaded_values:
+            # Deferred when loaded: changed only if it has been set since
+            return attname in self.__dict__
+        value = getattr(self, attname)
+        if getattr(value, '_committed', True) is False:
+            return True  # a newly assigned, not yet stored file
+        return value != self._loaded_values[attname]
+
+    def get_initial_value(self, field_name):
+        """The loaded or last saved value of ``field_name``, or None if unknown."""
+        attname = self._meta.get_field(field_name).attname
+        return (self._loaded_values or {}).get(attname)
+
+    def get_changed_fields(self):
+        """Names of the concrete fields that changed since the snapshot."""
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and self.has_changed(field.name)
+        ]
+
+    def save(self, *args, **kwargs):
+        if (
+            self._loaded_values is not None and not self._state.adding and not args
+            and kwargs.get('update_fields') is None and not kwargs.get('force_insert')
+            and kwargs.get('using') in (None, self._state.db)
+        ):
+            auto_now = [field.name for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)]
+            kwargs['update_fields'] = list(dict.fromkeys(self.get_changed_fields() + auto_now))
+        super().save(*args, **kwargs)
+        self._take_snapshot(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._take_snapshot(fields)
+
+    def _take_snapshot(self, field_names=None):
+        if field_names is None:
+            deferred = self.get_deferred_fields()
+            fields = [field for field in self._meta.concrete_fields if field.attname not in deferred]
+            self._loaded_values = {}
+        else:
+            fields = [self._meta.get_field(name) for name in field_names]
+            if self._loaded_values is None:
+                self._loaded_values = {}
+        for field in fields:
+            self._loaded_values[field.attname] = snapshot_value(field.value_from_object(self))
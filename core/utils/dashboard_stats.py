@@ -0,0 +1,82 @@
+"""Per-user dashboard counters, cached in the shared cache.
+
+The dashboard shows each user's record and order counts on every load. They
+are computed with one conditional-aggregate query on a cache miss and kept in
+the default cache (Redis when ``CACHE_REDIS_URL`` is set) so every worker
+serves the same numbers. Saving or deleting an ``RTORecord`` or ``Order``
+drops its owner's entry once the transaction commits, and the next load
+recomputes it.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Order, RTORecord
+
+STATS_KEY = 'dashboard_stats:{user_id}'
+
+
+def dashboard_stats_query(user_id):
+    orders = (
+        Order.objects.filter(user=OuterRef('pk')).order_by().values('user')
+        .annotate(count=Count('pk')).values('count')
+    )
+    return (
+        get_user_model().objects.filter(pk=user_id)
+        .values('pk')
+        .annotate(
+            total_records=Count('rto_records'),
+            approved_records=Count('rto_records', filter=Q(rto_records__status=RTORecord.Status.APPROVED)),
+            pending_records=Count('rto_records', filter=Q(rto_records__status=RTORecord.Status.PENDING)),
+            total_orders=Coalesce(Subquery(orders, output_field=IntegerField()), 0),
+        )
+        .values('total_records', 'approved_records', 'pending_records', 'total_orders')
+    )
+
+
+def compute_dashboard_stats(user_id):
+    """Record and order counts for one user, in a single query."""
+    return dashboard_stats_query(user_id).get()
+
+
+def get_dashboard_stats(user):
+    key = STATS_KEY.format(user_id=user.pk)
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_dashboard_stats(user.pk)
+        cache.set(key, stats, settings.DASHBOARD_STATS_TIMEOUT)
+    return stats
+
+
+def invalidate_dashboard_stats(user_id):
+    """Drop ``user_id``'s counters after the current transaction commits.
+
+    Deleting before the commit would let a concurrent dashboard load cache
+    the old counts again until the next change.
+    """
+    transaction.on_commit(lambda: cache.delete(STATS_KEY.format(user_id=user_id)))
+
+
+@receiver(post_save, sender=RTORecord)
+@receiver(post_delete, sender=RTORecord)
+def record_changed(sender, instance, update_fields=None, **kwargs):
+    # Saves of generated files and deploy state name their fields and leave the counts alone
+    if update_fields is None or 'status' in update_fields or 'owner' in update_fields:
+        invalidate_dashboard_stats(instance.owner_id)
+        # Receivers run before save() takes the new snapshot: this is the owner it had
+        previous_owner = instance.get_initial_value('owner')
+        if previous_owner is not None and previous_owner != instance.owner_id:
+            invalidate_dashboard_stats(previous_owner)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_changed(sender, instance, created=False, **kwargs):
+    # Order counts don't depend on status, so payment updates leave them be
+    if created or kwargs['signal'] is post_delete:
+        invalidate_dashboard_stats(instance.user_id)
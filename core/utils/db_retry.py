@@ -0,0 +1,56 @@
+"""Retrying writes that lose the SQLite write lock.
+
+SQLite has one writer at a time. ``busy_timeout`` makes a writer wait for
+the lock, but under a burst the wait can run out and the write fails with
+"database is locked". ``atomic_with_retry`` runs a function in its own
+transaction and, on a lock error, rolls back and runs it again after an
+exponential backoff with jitter, up to ``DB_WRITE_RETRIES`` times.
+
+Only the outermost transaction can be retried: inside an enclosing
+``atomic()`` the function just runs, and a lock error propagates to the
+owner of that transaction. Functions wrapped with it must be safe to run
+twice, i.e. only touch the database.
+"""
+import functools
+import logging
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, transaction
+
+logger = logging.getLogger(__name__)
+
+LOCK_ERRORS = ('database is locked', 'database table is locked', 'database is busy')
+
+# Retries by function name in this process, for benchmarks and debugging
+lock_retries = Counter()
+
+
+def is_lock_error(exc):
+    return isinstance(exc, OperationalError) and any(message in str(exc) for message in LOCK_ERRORS)
+
+
+def atomic_with_retry(func=None, *, using=DEFAULT_DB_ALIAS):
+    """Decorator: run ``func`` in a transaction, retrying it when the database is locked."""
+    if func is None:
+        return functools.partial(atomic_with_retry, using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if transaction.get_connection(using).in_atomic_block:
+            return func(*args, **kwargs)
+        for attempt in range(settings.DB_WRITE_RETRIES + 1):
+            try:
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+            except OperationalError as exc:
+                if not is_lock_error(exc) or attempt == settings.DB_WRITE_RETRIES:
+                    raise
+                lock_retries[func.__qualname__] += 1
+                delay = settings.DB_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.info("%s hit a locked database, retrying in %.3fs", func.__qualname__, delay)
+                time.sleep(delay)
+
+    return wrapper
@@ -0,0 +1,234 @@
+"""Batched publishing of deploy_site galleries to the git remote.
+
+Galleries are not pushed one by one. ``queue_gallery_deploy`` marks a record's
+folder as dirty and ``flush_gallery_deploys`` later turns every dirty folder
+into a single commit and a single push, recording the covered records on a
+``DeployBatch``. A record's ``gallery_html_url`` only goes live once the batch
+containing it has been pushed.
+
+Several gunicorn and Celery workers share one checkout, so every commit and
+push runs under a cross-process file lock (``deploy_lock``). A flush that
+finds the lock taken returns straight away: the running flush re-checks the
+queue after releasing the lock, so requests made during a deploy fold into
+its next batch instead of queueing pushes of their own.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+from contextlib import contextmanager
+
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import DeployBatch, GalleryDeploy, GalleryRender, RTORecord
+from core.utils.gallery_utils import get_gallery_dir, get_gallery_url
+from core.utils.git_publisher import GitObjectPublisher
+
+logger = logging.getLogger(__name__)
+
+# Bulk regenerations deploy thousands of records in one batch
+COMMIT_MESSAGE_MAX_RECORDS = 200
+# Record conditions per deployed_hash UPDATE, under SQLite's expression depth limit
+DEPLOYED_HASH_CHUNK = 500
+
+
+def _git(*args, check=True, input=None):
+    return subprocess.run(
+        ['git', *args], cwd=settings.DEPLOY_REPO_DIR, check=check,
+        capture_output=True, text=True, input=input,
+    )
+
+
+def _lock_path():
+    if settings.DEPLOY_LOCK_FILE:
+        return settings.DEPLOY_LOCK_FILE
+    repo_key = hashlib.sha1(os.path.abspath(settings.DEPLOY_REPO_DIR).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f'rto-deploy-{repo_key}.lock')
+
+
+@contextmanager
+def deploy_lock(blocking=True):
+    """Hold the deploy lock for the checkout; yields False if busy and not blocking."""
+    fd = os.open(_lock_path(), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def queue_gallery_deploy(record):
+    """Mark a record's gallery folder dirty; returns the number of pending records."""
+    pending = GalleryDeploy.objects.filter(batch__isnull=True)
+    if not pending.filter(record=record).exists():
+        GalleryDeploy.objects.create(record=record)
+    return pending.count()
+
+
+def _claim_pending(batch, max_size):
+    """Assign up to ``max_size`` unclaimed deploys to ``batch``."""
+    # One UPDATE rather than a read-then-write transaction, which SQLite
+    # cannot upgrade to a write lock while other workers are reading
+    pending = GalleryDeploy.objects.filter(batch__isnull=True)
+    pending.filter(pk__in=pending.order_by('requested_at').values('pk')[:max_size]).update(batch=batch)
+    # A record queued twice before being claimed only needs to be published once
+    return sorted({str(record_id) for record_id in batch.deploys.values_list('record_id', flat=True)})
+
+
+def _has_staged_changes(paths):
+    """Whether anything under ``paths`` is staged, without passing them as arguments."""
+    wanted = set(paths)
+    for name in _git('diff', '--staged', '--name-only', '-z').stdout.split('\0'):
+        parts = name.split('/')
+        if name and any('/'.join(parts[:i]) in wanted for i in range(1, len(parts) + 1)):
+            return True
+    return False
+
+
+def _publish_with_git_cli(paths, message):
+    if paths:
+        # Pathspecs go over stdin; a large batch would overflow the argument list
+        pathspecs = '\0'.join(paths)
+        _git('add', '-A', '--pathspec-from-file=-', '--pathspec-file-nul', input=pathspecs)
+        if _has_staged_changes(paths):
+            _git('commit', '-m', message, '--pathspec-from-file=-', '--pathspec-file-nul', input=pathspecs)
+
+    _git('push', settings.DEPLOY_GIT_REMOTE, f'HEAD:refs/heads/{settings.DEPLOY_GIT_BRANCH}')
+    return _git('rev-parse', 'HEAD').stdout.strip()
+
+
+def _publish_with_git_objects(paths, message):
+    with GitObjectPublisher(settings.DEPLOY_REPO_DIR, update_index=settings.DEPLOY_UPDATE_INDEX) as publisher:
+        return publisher.publish(paths, message, settings.DEPLOY_GIT_REMOTE, settings.DEPLOY_GIT_BRANCH)
+
+
+def publish_paths(paths, message):
+    """Commit ``paths`` (absolute, inside the deploy repo) in one commit and push it.
+
+    Returns the pushed commit sha. A commit left behind by a previously
+    failed push is pushed as well, even if nothing new is staged.
+    ``DEPLOY_PUBLISHER`` picks the in-process object writer ('objects') or
+    the ``git`` command line ('git').
+    """
+    paths = [os.path.relpath(path, settings.DEPLOY_REPO_DIR) for path in paths]
+    if settings.DEPLOY_PUBLISHER == 'git':
+        # git add fails on paths that no longer exist
+        paths = [p for p in paths if os.path.exists(os.path.join(settings.DEPLOY_REPO_DIR, p))]
+        return _publish_with_git_cli(paths, message)
+    return _publish_with_git_objects(paths, message)
+
+
+def _page_hashes(record_ids):
+    """Hash of each record's index.html as it is about to be committed (None if missing)."""
+    hashes = {}
+    for record_id in record_ids:
+        try:
+            with open(os.path.join(get_gallery_dir(record_id), 'index.html'), 'rb') as f:
+                hashes[record_id] = hashlib.sha256(f.read()).hexdigest()
+        except FileNotFoundError:
+            hashes[record_id] = None
+    return hashes
+
+
+def _mark_deployed(page_hashes):
+    """Set ``deployed_hash`` to the pushed page hash where the manifest still has that output.
+
+    A page re-rendered after it was hashed has a newer ``output_hash``; its
+    row is left alone, so it still needs (and is queued for) a deploy.
+    """
+    conditions = [
+        Q(record_id=record_id, output_hash=page_hash)
+        for record_id, page_hash in page_hashes.items() if page_hash
+    ]
+    for start in range(0, len(conditions), DEPLOYED_HASH_CHUNK):
+        # output_hash equals the pushed hash on every matched row
+        GalleryRender.objects.filter(reduce(or_, conditions[start:start + DEPLOYED_HASH_CHUNK])).update(
+            deployed_hash=F('output_hash')
+        )
+
+
+def publish_batch(record_ids):
+    """Commit the given record folders in one commit and push it."""
+    paths = [get_gallery_dir(record_id) for record_id in record_ids]
+
+    message = f"Deploy document galleries for {len(record_ids)} records\n\n" + '\n'.join(
+        f"record_{record_id}" for record_id in record_ids[:COMMIT_MESSAGE_MAX_RECORDS]
+    )
+    if len(record_ids) > COMMIT_MESSAGE_MAX_RECORDS:
+        message += f"\n... and {len(record_ids) - COMMIT_MESSAGE_MAX_RECORDS} more"
+    return publish_paths(paths, message)
+
+
+def flush_gallery_deploys(max_size=None):
+    """Publish pending galleries, one commit and push per batch.
+
+    Returns the list of ``DeployBatch`` rows pushed by this call, which is
+    empty when another process is already deploying. On a git failure the
+    batch is marked failed, its records go back to the queue and the error is
+    re-raised so the caller can retry.
+    """
+    max_size = max_size or settings.DEPLOY_BATCH_MAX_SIZE
+    batches = []
+    while True:
+        with deploy_lock(blocking=False) as acquired:
+            if not acquired:
+                logger.info("Deploy already running; pending galleries fold into its next batch")
+                return batches
+            batches.extend(_flush_locked(max_size))
+        # Anything queued while the lock was held and turned away is picked up here
+        if not GalleryDeploy.objects.filter(batch__isnull=True).exists():
+            return batches
+
+
+def _flush_locked(max_size):
+    batches = []
+    while GalleryDeploy.objects.filter(batch__isnull=True).exists():
+        batch = DeployBatch.objects.create()
+        record_ids = _claim_pending(batch, max_size)
+        if not record_ids:
+            batch.delete()
+            break
+
+        # Hashed before the publisher reads the files: a page rewritten in
+        # between is committed newer than its hash, never older
+        page_hashes = _page_hashes(record_ids)
+        try:
+            batch.commit_sha = publish_batch(record_ids)
+        except Exception as e:
+            error = e.stderr if isinstance(e, subprocess.CalledProcessError) else str(e)
+            batch.status = DeployBatch.Status.FAILED
+            batch.error = error or str(e)
+            batch.save(update_fields=['status', 'error'])
+            batch.deploys.update(batch=None)
+            logger.error("Deploy batch %s failed: %s", batch.pk, batch.error)
+            raise
+
+        batch.status = DeployBatch.Status.PUSHED
+        batch.pushed_at = timezone.now()
+        batch.save(update_fields=['status', 'commit_sha', 'pushed_at'])
+
+        # The galleries in this batch are now live
+        _mark_deployed(page_hashes)
+        for record in RTORecord.objects.filter(pk__in=record_ids):
+            url = get_gallery_url(record)
+            if record.gallery_html_url != url:
+                record.gallery_html_url = url
+                record.save(update_fields=['gallery_html_url', 'updated_at'])
+
+        logger.info("Deployed batch %s (%s) covering %d records", batch.pk, batch.commit_sha, len(record_ids))
+        batches.append(batch)
+    return batches
@@ -0,0 +1,437 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.template.loader import get_template, render_to_string
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import GalleryRender
+from core.utils.qr_utils import save_qr_to_record
+
+logger = logging.getLogger(__name__)
+
+# Templates rendered into every gallery page; bump the version when the
+# Python-side rendering (e.g. generate_inline_html) changes
+GALLERY_TEMPLATES = ['document_gallery.html', 'base.html']
+GALLERY_RENDER_VERSION = 1
+
+SHARD_ROOT = 'r'
+REDIRECTS_HEADER = '# Old URLs of galleries moved by migrate_deploy_layout; edits are overwritten'
+REDIRECTS_FALLBACK = '/* /index.html 200'
+
+
+def static_galleries_enabled():
+    """True when galleries are rendered into deploy_site and hosted on Netlify."""
+    return settings.GALLERY_BACKEND == 'static'
+
+def get_gallery_url(record):
+    """Public URL of the hosted document gallery for a record."""
+    if not static_galleries_enabled():
+        path = reverse('core:record_gallery', kwargs={'record_id': record.id})
+        return f"{settings.GALLERY_SITE_URL.rstrip('/')}{path}"
+    return f"{settings.GALLERY_BASE_URL.rstrip('/')}/{get_gallery_path(record.id)}/"
+
+def get_gallery_path(record_id, layout=None):
+    """Path of a record's gallery folder relative to deploy_site.
+
+    The 'flat' layout keeps one ``record_<id>`` folder per record at the top
+    level. The 'sharded' layout spreads them over two levels of prefix
+    directories taken from the UUID (``r/ab/cd/<id>``) so no directory grows
+    past a few hundred entries. The gallery URL is the folder's own path;
+    galleries moved between layouts keep their old URLs through the
+    ``_redirects`` rules written by ``migrate_deploy_layout``.
+    """
+    layout = layout or settings.DEPLOY_SITE_LAYOUT
+    record_id = str(record_id)
+    if layout == 'sharded':
+        hex_id = record_id.replace('-', '')
+        return f'{SHARD_ROOT}/{hex_id[:2]}/{hex_id[2:4]}/{record_id}'
+    return f'record_{record_id}'
+
+def get_gallery_dir(record_id, layout=None):
+    """Folder under deploy_site holding a record's gallery page."""
+    return os.path.join(settings.DEPLOY_SITE_DIR, *get_gallery_path(record_id, layout).split('/'))
+
+def read_redirects(path):
+    """Moved-gallery rules in a ``_redirects`` file, as ``{old path: new path}``."""
+    moved = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[1].endswith('/index.html') and line.strip() != REDIRECTS_FALLBACK:
+                    moved[parts[0].strip('/')] = parts[1][1:-len('/index.html')]
+    except FileNotFoundError:
+        pass
+    return moved
+
+def build_redirects(moved):
+    """_redirects serving each gallery in ``{old path: new path}`` at its old URL."""
+    lines = [REDIRECTS_HEADER]
+    for old_path, new_path in sorted(moved.items()):
+        lines.append(f'/{old_path}    /{new_path}/index.html    200')
+        lines.append(f'/{old_path}/*    /{new_path}/:splat    200')
+    lines.append(REDIRECTS_FALLBACK)
+    return '\n'.join(lines) + '\n'
+
+def write_redirects(moves):
+    """Add rules for galleries moved from ``old path`` to ``new path`` to deploy_site/_redirects.
+
+    ``moves`` are ``(old path, new path)`` pairs relative to deploy_site.
+    Rules from earlier migrations are kept and follow a gallery that moves
+    again, so every URL a QR code was ever printed with keeps resolving.
+    Only ``migrate_deploy_layout`` calls this: galleries rendered since use
+    their folder path as URL and need no rule. Returns True when the file
+    changed.
+    """
+    path = os.path.join(settings.DEPLOY_SITE_DIR, '_redirects')
+    moves = dict(moves)
+    moved = {old_path: moves.get(new_path, new_path) for old_path, new_path in read_redirects(path).items()}
+    moved.update(moves)
+    for new_path in moves.values():
+        # A folder moved back to an old path is served there directly again
+        moved.pop(new_path, None)
+
+    data = build_redirects(moved).encode('utf-8')
+    if _file_hash(path) == hashlib.sha256(data).hexdigest():
+        return False
+    atomic_write(path, data)
+    return True
+
+def atomic_write(path, data):
+    """Write ``data`` to ``path`` so readers only ever see the old or the new file.
+
+    The bytes go to a temp file outside deploy_site (so a concurrent commit
+    never picks it up), are fsynced, and are renamed over ``path``.
+    """
+    tmp_dir = os.path.join(settings.DEPLOY_REPO_DIR, '.deploy_tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def get_cloudinary_urls(record):
+    """Extract all Cloudinary URLs from a record"""
+    urls = []
+    
+    if record.record_type == "rto":
+        if record.rc_photo: 
+            urls.append(record.rc_photo)
+        if record.insurance_doc: 
+            urls.append(record.insurance_doc)
+        if record.pu_check_doc: 
+            urls.append(record.pu_check_doc)
+        if record.driving_license_doc: 
+            urls.append(record.driving_license_doc)
+            
+    elif record.record_type == "school":
+        if record.marks_card: 
+            urls.append(record.marks_card)
+        if record.photo: 
+            urls.append(record.photo)
+        if record.convocation: 
+            urls.append(record.convocation)
+        if record.migration: 
+            urls.append(record.migration)
+    
+    logger.debug("Record %s (%s) has %d documents", record.id, record.record_type, len(urls))
+    return urls
+
+@lru_cache(maxsize=1)
+def gallery_template_hash():
+    """Fingerprint of everything besides the record that shapes a gallery page."""
+    digest = hashlib.sha256(f'render-v{GALLERY_RENDER_VERSION}'.encode())
+    for name in GALLERY_TEMPLATES:
+        digest.update(get_template(name).template.source.encode('utf-8'))
+    return digest.hexdigest()
+
+def gallery_input_hash(record, cloudinary_urls):
+    """Hash of the record fields and document URLs a gallery page is built from."""
+    payload = {
+        'id': str(record.id),
+        'name': record.name,
+        'contact_no': record.contact_no,
+        'record_type': record.record_type,
+        'created_at': record.created_at.isoformat() if record.created_at else None,
+        'documents': [str(url) for url in cloudinary_urls],
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _file_hash(path):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+def get_stale_galleries():
+    """Manifest entries rendered with an older gallery template, without rendering anything."""
+    return GalleryRender.objects.stale(gallery_template_hash())
+
+def save_render_manifest(record, **hashes):
+    """Upsert a record's manifest row with single-statement writes.
+
+    ``update_or_create`` reads inside a transaction before writing, which
+    SQLite turns into "database is locked" when several workers render at once.
+    """
+    if GalleryRender.objects.filter(record=record).update(rendered_at=timezone.now(), **hashes):
+        return
+    try:
+        GalleryRender.objects.create(record=record, **hashes)
+    except IntegrityError:
+        # Another worker created it first; ours is the newer render
+        GalleryRender.objects.filter(record=record).update(rendered_at=timezone.now(), **hashes)
+
+def gallery_version(record, cloudinary_urls):
+    """Identifier of the exact gallery page a record renders to right now."""
+    return hashlib.sha256(
+        f'{gallery_input_hash(record, cloudinary_urls)}:{gallery_template_hash()}'.encode()
+    ).hexdigest()[:32]
+
+def render_gallery_html(record, cloudinary_urls):
+    """Gallery page HTML, shared by the static deploy and the Django-served view."""
+    context = {
+        'record': record,
+        'cloudinary_urls': cloudinary_urls,
+    }
+    
+    # Generate HTML content using your existing template
+    try:
+        return render_to_string('document_gallery.html', context)
+    except Exception as e:
+        logger.warning("Gallery template failed for record %s, using the inline page: %s", record.id, e)
+        return generate_inline_html(record, cloudinary_urls)
+
+def write_gallery_page(record, cloudinary_urls, file_path):
+    """Render a gallery page to ``file_path`` unless the bytes are unchanged.
+
+    Does not touch the database, so it can run in worker processes. Returns
+    ``(output_hash, written)``.
+    """
+    data = render_gallery_html(record, cloudinary_urls).encode('utf-8')
+    output_hash = hashlib.sha256(data).hexdigest()
+    written = _file_hash(file_path) != output_hash
+    if written:
+        # Another worker may be rendering or committing this folder at the same time
+        atomic_write(file_path, data)
+    return output_hash, written
+
+def generate_static_html(record, force=False):
+    """Generate static HTML file for the record in deploy_site folder.
+
+    Returns True when index.html was (re)written. Pages whose inputs,
+    templates and on-disk output match the render manifest are skipped.
+    """
+    cloudinary_urls = get_cloudinary_urls(record)
+    input_hash = gallery_input_hash(record, cloudinary_urls)
+    template_hash = gallery_template_hash()
+    folder_path = get_gallery_dir(record.id)
+    file_path = os.path.join(folder_path, 'index.html')
+
+    manifest = GalleryRender.objects.filter(record=record).first()
+    if (
+        not force and manifest
+        and manifest.input_hash == input_hash
+        and manifest.template_hash == template_hash
+        and _file_hash(file_path) == manifest.output_hash
+    ):
+        logger.debug("Gallery for record %s is up to date", record.id)
+        return False
+
+    output_hash, written = write_gallery_page(record, cloudinary_urls, file_path)
+    if written:
+        logger.info("Wrote gallery page %s (%d documents)", file_path, len(cloudinary_urls))
+
+    save_render_manifest(record, input_hash=input_hash, template_hash=template_hash, output_hash=output_hash)
+    return written
+
+def generate_inline_html(record, cloudinary_urls):
+    docs_html = ""
+    for i, url in enumerate(cloudinary_urls):
+        filename = url.split("/")[-1].split("?")[0] or f"Document_{i+1}"
+        download_url = f"{url}?fl_attachment"  # For Cloudinary; but see below for the <a download> trick
+        docs_html += f"""
+        <div class="doc-card">
+            <img src="{url}" alt="Document {i+1}" class="doc-image" loading="lazy">
+            <div class="doc-info">
+                <h3>Document {i+1}</h3>
+                <div class="btn-group">
+                    <a href="{url}" class="btn btn-view" target="_blank">
+                        <span class="icon-eye"></span> View
+                    </a>
+                    <a href="{download_url}" download="{filename}" class="btn btn-download">
+                        <span class="icon-download"></span> Download
+                    </a>
+                </div>
+            </div>
+        </div>
+        """
+    
+    html_content = f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Documents for {record.name}</title>
+    <style>
+        :root {{
+            --accent: #667eea;
+            --accent-hover: #5a67d8;
+            --success: #48bb78;
+            --success-hover: #38a169;
+            --bg-card: rgba(255,255,255,0.14);
+            --bg: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            --txt-main: #252f44;
+            --txt-light: #fff;
+            --shadow-card: 0 8px 32px rgba(102,126,234,.13);
+        }}
+        * {{ box-sizing: border-box; }}
+        body {{
+            margin: 0; padding: 0;
+            font-family: 'Inter', 'Segoe UI', Arial, sans-serif;
+            background: var(--bg); min-height: 100vh;
+        }}
+        .container {{
+            max-width: 1200px; margin: 0 auto; padding: 14px;
+        }}
+        .header {{
+            background: var(--bg-card);
+            border-radius: 22px;
+            box-shadow: var(--shadow-card);
+            color: var(--txt-main);
+            margin-bottom: 24px;
+            text-align: center;
+            padding: 32px 20px 24px;
+        }}
+        .header h1 {{
+            font-size: 2.5em; font-weight: 900; margin: 0 0 12px;
+            color: var(--accent);
+            letter-spacing: -1px;
+            display: flex; gap: .45em; align-items: center; justify-content: center;
+        }}
+        .header .icon-doc {{
+            font-size: 1.2em; color: var(--accent);
+            margin-bottom: 3px;
+        }}
+        .header-info {{
+            display: flex; gap: 2em; justify-content: center; flex-wrap: wrap; font-size:1.11em; margin-top: 12px; color: #222;
+        }}
+        .header-info .icon {{
+            margin-right: .25em; color: var(--accent);
+        }}
+        .gallery {{
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(320px, 1fr));
+            gap: 32px;
+            margin-bottom: 40px;
+        }}
+        .doc-card {{
+            background: var(--bg-card);
+            border-radius: 19px;
+            box-shadow: var(--shadow-card);
+            overflow: hidden;
+            display: flex; flex-direction: column; align-items: center;
+            transition: box-shadow .23s cubic-bezier(.4,.6,.18,1);
+        }}
+        .doc-card:hover {{
+            box-shadow: 0 12px 36px rgba(102,126,234,.22);
+        }}
+        .doc-image {{
+            max-width: 100%; width: 100%; height: 220px;
+            object-fit: cover; background: #eee;
+        }}
+        .doc-info {{
+            padding: 18px 16px 18px; text-align: center; width:100%;
+        }}
+        .doc-info h3 {{
+            font-size: 1.16em; margin: 6px 0 20px;
+            color: var(--accent-hover); font-weight: 600;
+        }}
+        .btn-group {{
+            display: flex; gap: 12px; justify-content: center; margin-top: 4px;
+        }}
+        .btn {{
+            display: inline-block; min-width: 94px; padding: 10px 19px;
+            border-radius: 11px; font-weight: 700;
+            text-decoration: none; font-size: 1em;
+            transition: background .22s, box-shadow .22s;
+            border: none; cursor: pointer;
+            box-shadow: 0 2px 14px rgba(102,126,234,0.04);
+            display: flex; align-items: center; gap: .6em; justify-content: center;
+        }}
+        .btn-view {{
+            background: var(--accent); color: var(--txt-light);
+        }}
+        .btn-view:hover {{ background: var(--accent-hover); }}
+        .btn-download {{
+            background: var(--success); color: var(--txt-light);
+        }}
+        .btn-download:hover {{ background: var(--success-hover); }}
+        /* Small icon helpers */
+        .icon-eye::before {{ content: "👁️"; position: relative; top: 1px; }}
+        .icon-download::before {{ content: "⬇️"; position: relative; top: 2px; }}
+        .icon-doc::before {{ content:"📄"; }}
+        .icon-phone::before {{ content:"📞"; }}
+        .icon-type::before {{ content:"🏷️"; }}
+        .icon-date::before {{ content:"📅"; color: #c0392b; }}
+        .footer {{
+            text-align: center; color: #eee; font-size: 1.05em; margin-bottom: 8px;
+        }}
+        /* Responsive for small screens */
+        @media (max-width: 600px){{
+            .header h1 {{ font-size: 1.45em; }}
+            .gallery {{ grid-template-columns: 1fr; gap: 18px }}
+        }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1><span class="icon-doc"></span> Documents for {record.name}</h1>
+            <div class="header-info">
+                <span><span class="icon-phone icon"></span> <b>Contact:</b> {record.contact_no}</span>
+                <span><span class="icon-date icon"></span> <b>Created:</b> {record.created_at.strftime('%B %d, %Y')}</span>
+            </div>
+        </div>
+        <div class="gallery">
+            {docs_html}
+        </div>
+        <div class="footer">
+            <p>Generated by <strong>Secure RTO Document Management</strong> | All documents encrypted &amp; secure</p>
+        </div>
+    </div>
+</body>
+</html>
+"""
+    return html_content
+
+
+def generate_qr_code_for_record(record, url):
+    """Generate QR code pointing to the gallery URL"""
+    # Reuses the cached PNG when the URL has not changed
+    save_qr_to_record(record, url)
+    record.save()
+
+
+def get_qr_payload(record):
+    """Data encoded in the record's QR code, or '' if none was generated."""
+    if record.qr_payload:
+        return record.qr_payload
+    # Images from before qr_payload was stored encode the gallery URL
+    return get_gallery_url(record) if record.qr_code_image else ''
@@ -0,0 +1,333 @@
+"""In-process git publishing for deploy_site.
+
+``GitObjectPublisher`` builds the blob, tree and commit objects for changed
+gallery folders directly with dulwich instead of forking ``git add``,
+``git commit`` and ``git push``. Only the trees on the path from the root to a
+changed folder are rewritten, so the cost of a publish depends on the size of
+the batch rather than on how many galleries deploy_site already holds.
+
+Pushes to a local remote (a path or ``file://`` URL) also stay in-process.
+Network remotes are pushed with the ``git`` binary so the existing ssh and
+credential helper setup keeps working.
+
+The index is rewritten after each commit so ``git status`` and later
+``git commit`` runs in the same checkout agree with HEAD. Reading and writing
+the index is the one step that still grows with the size of deploy_site, so a
+publish-only clone can turn it off with ``update_index=False``.
+"""
+import io
+import os
+import shutil
+import stat
+import subprocess
+import time
+import zlib
+
+from dulwich import porcelain
+from dulwich.index import index_entry_from_stat
+from dulwich.objects import S_ISGITLINK, Blob, Commit, Tree
+from dulwich.repo import Repo, get_user_identity
+
+TREE_MODE = stat.S_IFDIR
+FILE_MODE = 0o100644
+EXECUTABLE_MODE = 0o100755
+LOOSE_COMPRESSION_LEVEL = 1  # git's core.loosecompression default
+
+
+class GitObjectPublisher:
+    """Commit and push selected paths of a working tree without forking git."""
+
+    def __init__(self, repo_dir, update_index=True):
+        self.repo_dir = os.fspath(repo_dir)
+        self.repo = Repo(self.repo_dir)
+        self.update_index = update_index
+        self._commit_objects = {}
+        self._new_objects = []
+        self._index_updates = {}
+
+    def close(self):
+        self.repo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Object building
+
+    def _add(self, obj):
+        self._new_objects.append((obj, None))
+        return obj.id
+
+    def _blob_for_file(self, full_path, rel_path):
+        st = os.lstat(full_path)
+        if stat.S_ISLNK(st.st_mode):
+            blob = Blob.from_string(os.fsencode(os.readlink(full_path)))
+            mode = stat.S_IFLNK
+        else:
+            with open(full_path, 'rb') as f:
+                blob = Blob.from_string(f.read())
+            mode = EXECUTABLE_MODE if st.st_mode & stat.S_IXUSR else FILE_MODE
+        self._index_updates[rel_path] = (st, blob.id, mode)
+        return mode, self._add(blob)
+
+    def _tree_for_dir(self, full_path, rel_path):
+        tree = Tree()
+        for entry in sorted(os.scandir(full_path), key=lambda e: e.name):
+            name = os.fsencode(entry.name)
+            child_rel = rel_path + b'/' + name
+            if entry.is_dir(follow_symlinks=False):
+                subtree = self._tree_for_dir(entry.path, child_rel)
+                if subtree is not None:
+                    tree[name] = (TREE_MODE, subtree)
+            else:
+                tree[name] = self._blob_for_file(entry.path, child_rel)
+        if not len(tree):
+            return None
+        return self._add(tree)
+
+    def _entry_for_path(self, rel_path):
+        """(mode, sha) for a path in the working tree, or None if it is gone."""
+        full_path = os.path.join(self.repo_dir, os.fsdecode(rel_path))
+        if os.path.isdir(full_path) and not os.path.islink(full_path):
+            sha = self._tree_for_dir(full_path, rel_path)
+            return None if sha is None else (TREE_MODE, sha)
+        if os.path.lexists(full_path):
+            return self._blob_for_file(full_path, rel_path)
+        return None
+
+    def _apply(self, tree_id, changes):
+        """Return the id of ``tree_id`` with ``changes`` applied, or None if empty.
+
+        ``changes`` maps tuples of path components to ``(mode, sha)`` or None
+        for a deletion. Untouched subtrees are reused as they are.
+        """
+        # The object store parses a fresh object on every lookup, so it is ours to edit
+        tree = self.repo.object_store[tree_id] if tree_id else Tree()
+        nested = {}
+        for parts, entry in changes.items():
+            if len(parts) == 1:
+                if entry is None:
+                    if parts[0] in tree:
+                        del tree[parts[0]]
+                else:
+                    tree[parts[0]] = entry
+            else:
+                nested.setdefault(parts[0], {})[parts[1:]] = entry
+
+        for name, sub_changes in nested.items():
+            current = tree[name][1] if name in tree and tree[name][0] == TREE_MODE else None
+            subtree = self._apply(current, sub_changes)
+            if subtree is None:
+                if name in tree:
+                    del tree[name]
+            else:
+                tree[name] = (TREE_MODE, subtree)
+
+        if not len(tree):
+            return None
+        if tree_id and tree.id == tree_id:
+            return tree_id
+        return self._add(tree)
+
+    @staticmethod
+    def _loose_path(repo, sha):
+        hex_sha = sha.decode('ascii')
+        return os.path.join(repo.object_store.path, hex_sha[:2], hex_sha[2:])
+
+    def _write_objects(self, repo, objects):
+        """Write loose objects at git's default loose compression level."""
+        for obj in objects:
+            path = self._loose_path(repo, obj.id)
+            if os.path.exists(path):
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            raw = obj.as_raw_string()
+            header = obj.type_name + b' ' + str(len(raw)).encode('ascii') + b'\0'
+            data = zlib.compress(header + raw, LOOSE_COMPRESSION_LEVEL)
+            tmp_path = f'{path}.tmp{os.getpid()}'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+    def _copy_objects(self, target, objects):
+        """Copy objects into ``target``, reusing the compressed loose files."""
+        to_encode = []
+        for obj in objects:
+            source = self._loose_path(self.repo, obj.id)
+            if not os.path.exists(source):
+                to_encode.append(obj)
+                continue
+            path = self._loose_path(target, obj.id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(source, path)
+            except FileExistsError:
+                pass
+            except OSError:
+                shutil.copyfile(source, path)
+        self._write_objects(target, to_encode)
+
+    # Index maintenance
+
+    def _update_index(self, paths):
+        """Keep the index in line with the new commit so ``git status`` stays clean."""
+        index = self.repo.open_index()
+        paths = set(paths)
+        prefixes = tuple(path + b'/' for path in paths)
+        for name in [name for name in index if name in paths or name.startswith(prefixes)]:
+            del index[name]
+        for rel_path, (st, sha, mode) in self._index_updates.items():
+            index[rel_path] = index_entry_from_stat(st, sha, mode)
+        index.write()
+
+    # Public API
+
+    def head(self):
+        try:
+            return self.repo.refs[b'HEAD']
+        except KeyError:
+            return None
+
+    def commit(self, paths, message):
+        """Commit the current contents of ``paths`` (relative to the repo root).
+
+        Returns the new commit id, or None when the paths are unchanged.
+        """
+        self._new_objects = []
+        self._index_updates = {}
+        paths = [os.fsencode(p).strip(b'/') for p in paths]
+
+        parent = self.head()
+        base_tree = self.repo[parent].tree if parent else None
+        changes = {tuple(p.split(b'/')): self._entry_for_path(p) for p in paths}
+        new_tree = self._apply(base_tree, changes)
+        if new_tree is None:
+            new_tree = self._add(Tree())
+        if new_tree == base_tree:
+            return None
+
+        identity = get_user_identity(self.repo.get_config_stack())
+        commit = Commit()
+        commit.tree = new_tree
+        commit.parents = [parent] if parent else []
+        commit.author = commit.committer = identity
+        commit.author_time = commit.commit_time = int(time.time())
+        commit.author_timezone = commit.commit_timezone = 0
+        commit.encoding = b'UTF-8'
+        commit.message = message.encode('utf-8')
+        self._add(commit)
+
+        new_objects = [obj for obj, _path in self._new_objects]
+        self._write_objects(self.repo, new_objects)
+        self._commit_objects[commit.id] = new_objects
+        if not self.repo.refs.set_if_equals(b'HEAD', parent, commit.id):
+            raise RuntimeError("HEAD moved while publishing; retry the batch")
+        if self.update_index:
+            self._update_index(paths)
+        return commit.id.decode('ascii')
+
+    def remote_url(self, remote):
+        config = self.repo.get_config()
+        return config.get((b'remote', remote.encode()), b'url').decode()
+
+    @staticmethod
+    def is_local(url):
+        return url.startswith('file://') or os.path.isabs(url)
+
+    def _missing_objects(self, target, head):
+        """Objects reachable from ``head`` that ``target`` does not have yet.
+
+        Walks new commits back to one the target already has and, for each
+        one, descends only into the subtrees whose ids changed against the
+        parent, so the work is proportional to the change, not the tree.
+        Commits made by this publisher already know their new objects and
+        skip the walk entirely.
+        """
+        store = self.repo.object_store
+        missing = {}
+
+        def walk_tree(tree_id, old_tree_id):
+            if tree_id == old_tree_id or tree_id in missing or tree_id in target.object_store:
+                return
+            tree = store[tree_id]
+            missing[tree_id] = tree
+            old_entries = {}
+            if old_tree_id is not None:
+                old_entries = {name: sha for name, _mode, sha in store[old_tree_id].iteritems()}
+            for name, mode, sha in tree.iteritems():
+                if old_entries.get(name) == sha or sha in missing:
+                    continue
+                if stat.S_ISDIR(mode):
+                    walk_tree(sha, old_entries.get(name))
+                elif not S_ISGITLINK(mode) and sha not in target.object_store:
+                    missing[sha] = store[sha]
+
+        pending = [head]
+        while pending:
+            commit_id = pending.pop()
+            if commit_id in missing or commit_id in target.object_store:
+                continue
+            commit = store[commit_id]
+            missing[commit_id] = commit
+            if commit_id in self._commit_objects:
+                for obj in self._commit_objects[commit_id]:
+                    if obj.id not in missing and obj.id not in target.object_store:
+                        missing[obj.id] = obj
+            else:
+                parent_tree = store[commit.parents[0]].tree if commit.parents else None
+                walk_tree(commit.tree, parent_tree)
+            pending.extend(commit.parents)
+        return list(missing.values())
+
+    def _push_local(self, path, branch):
+        target = Repo(path)
+        try:
+            head = self.head()
+            ref = f'refs/heads/{branch}'.encode()
+            old = target.refs.get_peeled(ref) if ref in target.refs else None
+            if old == head:
+                return
+            if old is not None and not self._is_ancestor(old, head):
+                raise RuntimeError(f"Rejected non-fast-forward push to {path} {branch}")
+            self._copy_objects(target, self._missing_objects(target, head))
+            if not target.refs.set_if_equals(ref, old, head):
+                raise RuntimeError(f"{path} {branch} moved during push; retry the batch")
+        finally:
+            target.close()
+
+    def _is_ancestor(self, ancestor, head):
+        pending, seen = [head], set()
+        while pending:
+            commit_id = pending.pop()
+            if commit_id == ancestor:
+                return True
+            if commit_id in seen or commit_id not in self.repo.object_store:
+                continue
+            seen.add(commit_id)
+            pending.extend(self.repo.object_store[commit_id].parents)
+        return False
+
+    def push(self, remote, branch):
+        """Push HEAD to ``remote``/``branch``, in-process for local remotes."""
+        url = self.remote_url(remote)
+        if not self.is_local(url):
+            subprocess.run(['git', 'push', remote, f'HEAD:refs/heads/{branch}'], cwd=self.repo_dir,
+                           check=True, capture_output=True, text=True)
+            return
+        if self.head() is None:
+            return
+        self._push_local(url[len('file://'):] if url.startswith('file://') else url, branch)
+
+    def fetch(self, remote):
+        """Fetch ``remote`` over the local file transport; returns its refs."""
+        url = self.remote_url(remote)
+        path = url[len('file://'):] if url.startswith('file://') else url
+        return porcelain.fetch(self.repo, path, outstream=io.BytesIO(), errstream=io.BytesIO()).refs
+
+    def publish(self, paths, message, remote, branch):
+        """Commit ``paths`` and push; returns the sha of the pushed HEAD."""
+        self.commit(paths, message)
+        self.push(remote, branch)
+        return self.head().decode('ascii')
@@ -0,0 +1,85 @@
+"""Serving stored files with validators and byte ranges.
+
+Django's ``FileResponse`` streams a file but ignores ``Range``; resumable
+downloads of stored files go through ``stored_file_response`` instead.
+Only single ranges are honoured; anything else gets the whole file.
+"""
+import re
+
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, parse_etags
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """``(start, end)`` (inclusive) for a single-range header, ``None`` for no
+    usable range, or ``False`` when the range cannot be satisfied."""
+    match = RANGE_RE.match(header.replace(' ', '')) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+def _iter_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def stored_file_response(request, name, etag, filename, content_type, max_age=0, storage=default_storage):
+    """Serve ``name`` from ``storage`` with ETag revalidation and byte ranges.
+
+    ``etag`` is quoted and must change whenever the file does. ``name`` may be
+    a callable returning the storage name; it is only called when the file is
+    actually served, so a 304 never builds or opens anything.
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if callable(name):
+            name = name()
+        size = storage.size(name)
+        byte_range = None
+        if_range = request.headers.get('If-Range')
+        if request.method == 'GET' and (not if_range or etag in parse_etags(if_range)):
+            byte_range = parse_range(request.headers.get('Range'), size)
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(
+                _iter_range(storage.open(name, 'rb'), start, end - start + 1),
+                status=206, content_type=content_type,
+            )
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = FileResponse(storage.open(name, 'rb'), content_type=content_type)
+            response['Content-Length'] = str(size)
+        if response.status_code != 416:
+            response['Content-Disposition'] = content_disposition_header(True, filename)
+
+    response['ETag'] = etag
+    response['Accept-Ranges'] = 'bytes'
+    patch_cache_control(response, private=True, max_age=max_age)
+    return response
@@ -0,0 +1,99 @@
+"""Reuse of pending gateway orders.
+
+Every payment entry point (the payment page, the AJAX record flow and the
+API) goes through ``get_or_create_gateway_order``. An unpaid order for the
+same user, record, order type and amount that is younger than
+``PAYMENT_ORDER_REUSE_WINDOW`` is handed back as is, so reloads, back
+navigation and double clicks cost one indexed query instead of a Razorpay
+round trip and an abandoned PENDING row.
+
+Concurrent first requests (a double click) are serialised with a short
+``cache.add`` lock: the loser waits for the winner's order instead of
+creating a second one.
+"""
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from core.models import Order
+from payments.gateway import get_razorpay_client
+
+CREATE_LOCK_TIMEOUT = 10  # seconds; longer than a gateway call with retries
+CREATE_WAIT_INTERVAL = 0.1
+
+
+def find_reusable_order(user, record, order_type, amount):
+    cutoff = timezone.now() - timedelta(seconds=settings.PAYMENT_ORDER_REUSE_WINDOW)
+    return (
+        Order.objects.filter(
+            rto_record=record, order_type=order_type, payment_status=Order.Status.PENDING,
+            created_at__gte=cutoff, user=user, amount=amount, payment_provider='razorpay',
+        )
+        .order_by('-created_at')
+        .first()
+    )
+
+
+def _wait_for_order(user, record, order_type, amount, lock_key):
+    """Poll for the order a concurrent request is creating, while it holds the lock."""
+    deadline = time.monotonic() + CREATE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(CREATE_WAIT_INTERVAL)
+        order = find_reusable_order(user, record, order_type, amount)
+        if order is not None or cache.get(lock_key) is None:
+            return order
+    return None
+
+
+def get_or_create_gateway_order(user, record, order_type, amount, gateway_data=None, **fields):
+    """Pending order for ``amount`` rupees, reused when possible; returns ``(order, created)``.
+
+    ``gateway_data`` is merged into the Razorpay order request and ``fields``
+    into the new ``Order``; a reused order gets ``fields`` applied if they changed.
+    """
+    amount = Decimal(amount).quantize(Decimal('0.01'))
+    order = find_reusable_order(user, record, order_type, amount)
+
+    if order is None:
+        lock_key = f'gateway_order_lock:{record.pk}:{order_type}:{amount}'
+        locked = cache.add(lock_key, 1, CREATE_LOCK_TIMEOUT)
+        if not locked:
+            order = _wait_for_order(user, record, order_type, amount, lock_key)
+        if order is None:
+            try:
+                razorpay_order = get_razorpay_client().order.create({
+                    'amount': int(amount * 100),  # paise
+                    'currency': 'INR',
+                    'payment_capture': 1,
+                    **(gateway_data or {}),
+                })
+                order = Order.objects.create(
+                    user=user,
+                    rto_record=record,
+                    order_id=razorpay_order['id'],
+                    order_type=order_type,
+                    amount=amount,
+                    payment_status=Order.Status.PENDING,
+                    payment_provider='razorpay',
+                    **fields,
+                )
+            finally:
+                if locked:
+                    cache.delete(lock_key)
+            return order, True
+
+    changed = [name for name, value in fields.items() if getattr(order, name) != value]
+    if changed:
+        for name in changed:
+            setattr(order, name, fields[name])
+        order.save(update_fields=[*changed, 'updated_at'])
+    return order, False
+
+
+def checkout_order(order):
+    """The gateway order fields Razorpay Checkout needs, rebuilt from our row."""
+    return {'id': order.order_id, 'amount': int(order.amount * 100), 'currency': 'INR'}
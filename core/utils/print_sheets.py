@@ -0,0 +1,304 @@
+"""N-up imposition of PVC/NFC cards onto print-ready PDF sheets.
+
+Paid card orders are laid out as a grid of ID-1 (CR80) cards per page, each
+with its QR code, name, order and record id, and crop marks in the page
+margin along every cut line. QR images come from ``qr_utils.get_qr_png``, so
+cards whose QR code was generated at payment time are read back from the QR
+cache instead of being re-rendered.
+
+reportlab's canvas keeps every page until ``save()``, so the sheets are
+serialised by ``PDFStreamWriter`` instead: each sheet is written out as soon
+as its last card is drawn, and only the object offsets are kept until the
+cross-reference table at the end. The drawing code is unchanged; ``PDFPage``
+takes the same calls as a canvas (reportlab still supplies the page sizes
+and font metrics).
+"""
+import zlib
+from collections import namedtuple
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+from PIL import Image
+from reportlab.lib import pagesizes
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+
+from core.utils.gallery_utils import get_gallery_url, get_qr_payload
+from core.utils.qr_utils import get_qr_png
+
+CARD_WIDTH = 85.6 * mm
+CARD_HEIGHT = 53.98 * mm
+CARD_PADDING = 3 * mm
+CROP_MARK_OFFSET = 1 * mm
+CROP_MARK_LENGTH = 4 * mm
+QR_IMAGE_CACHE_SIZE = 256
+# Resource names of the standard Type 1 fonts the cards use
+FONTS = {'Helvetica': b'F1', 'Helvetica-Bold': b'F2', 'Courier': b'F3'}
+
+QRImage = namedtuple('QRImage', 'width height data')
+
+
+class SheetLayout:
+    """Grid of card slots on one page, centred within the margins."""
+
+    def __init__(self, page_size='A4', margin=None, gutter=None, per_sheet=None):
+        self.page_width, self.page_height = getattr(pagesizes, page_size.upper())
+        margin = (settings.PRINT_SHEET_MARGIN_MM if margin is None else margin) * mm
+        self.gutter = (settings.PRINT_SHEET_GUTTER_MM if gutter is None else gutter) * mm
+        self.columns = int((self.page_width - 2 * margin + self.gutter) // (CARD_WIDTH + self.gutter))
+        self.rows = int((self.page_height - 2 * margin + self.gutter) // (CARD_HEIGHT + self.gutter))
+        if self.columns < 1 or self.rows < 1:
+            raise ValueError(f"A card does not fit on {page_size} with a {margin / mm:g}mm margin")
+        if per_sheet is not None and not 0 < per_sheet <= self.columns * self.rows:
+            raise ValueError(f"{page_size} holds 1 to {self.columns * self.rows} cards per sheet")
+        self.per_sheet = per_sheet or self.columns * self.rows
+
+        grid_width = self.columns * CARD_WIDTH + (self.columns - 1) * self.gutter
+        grid_height = self.rows * CARD_HEIGHT + (self.rows - 1) * self.gutter
+        self.left = (self.page_width - grid_width) / 2
+        self.bottom = (self.page_height - grid_height) / 2
+        self.top = self.bottom + grid_height
+        self.right = self.left + grid_width
+
+    def slot(self, index):
+        """Bottom-left corner of slot ``index``, filling rows from the top."""
+        row, column = divmod(index, self.columns)
+        x = self.left + column * (CARD_WIDTH + self.gutter)
+        y = self.top - (row + 1) * CARD_HEIGHT - row * self.gutter
+        return x, y
+
+    def cut_lines(self):
+        """x and y positions of every card edge."""
+        xs = sorted({x for i in range(self.columns) for x in (self.slot(i)[0], self.slot(i)[0] + CARD_WIDTH)})
+        ys = sorted({
+            y for i in range(0, self.rows * self.columns, self.columns)
+            for y in (self.slot(i)[1], self.slot(i)[1] + CARD_HEIGHT)
+        })
+        return xs, ys
+
+
+@lru_cache(maxsize=QR_IMAGE_CACHE_SIZE)
+def _qr_image(payload):
+    """The cached QR PNG reduced to one pixel per module.
+
+    PDF images are scaled without smoothing, so this prints as sharp as the
+    full-size PNG while embedding a hundredth of the pixels.
+    """
+    png, _key = get_qr_png(payload)
+    box_size = settings.QR_CODE_BOX_SIZE
+    image = Image.open(BytesIO(png)).convert('L')
+    image = image.resize((image.width // box_size, image.height // box_size), Image.NEAREST)
+    return QRImage(image.width, image.height, zlib.compress(image.tobytes()))
+
+
+def _pdf_string(text):
+    """``text`` as a PDF literal string in the standard fonts' WinAnsi encoding."""
+    encoded = text.encode('cp1252', 'replace')
+    escaped = encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)').replace(b'\r', b'\\r')
+    return b'(' + escaped + b')'
+
+
+class PDFPage:
+    """One sheet's drawing, taking the subset of canvas calls the cards use."""
+
+    def __init__(self):
+        self.operators = []
+        self.images = {}
+        self.font = None
+
+    def setLineWidth(self, width):
+        self.operators.append(b'%.2f w' % width)
+
+    def line(self, x1, y1, x2, y2):
+        self.operators.append(b'%.2f %.2f m %.2f %.2f l S' % (x1, y1, x2, y2))
+
+    def setFont(self, name, size):
+        self.font = (name, size)
+
+    def stringWidth(self, text, font, size):
+        return pdfmetrics.stringWidth(text, font, size)
+
+    def drawString(self, x, y, text):
+        name, size = self.font
+        self.operators.append(b'BT /%s %g Tf %.2f %.2f Td %s Tj ET' % (
+            FONTS[name], size, x, y, _pdf_string(text),
+        ))
+
+    def drawImage(self, image, x, y, width, height):
+        resource = self.images.setdefault(image, b'Im%d' % (len(self.images) + 1))
+        self.operators.append(b'q %.2f 0 0 %.2f %.2f %.2f cm /%s Do Q' % (width, height, x, y, resource))
+
+
+class PDFStreamWriter:
+    """Serialise a PDF page by page.
+
+    ``start()``, ``add_page()`` and ``finish()`` each return the bytes to
+    append to the file. Objects 1 and 2 (catalog and page tree) are written
+    last, when the page list is known; pages refer to them ahead of time.
+    """
+
+    def __init__(self, page_size, title):
+        self.page_width, self.page_height = page_size
+        self.title = title
+        self.offsets = [None, None]  # byte offset of each object, by number - 1
+        self.pages = []
+        self.position = 0
+        self.fonts = b''
+
+    def _object(self, chunks, body, number=None):
+        if number is None:
+            self.offsets.append(None)
+            number = len(self.offsets)
+        self.offsets[number - 1] = self.position + sum(map(len, chunks))
+        chunks.append(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+        return number
+
+    def _stream(self, chunks, dictionary, data):
+        return self._object(
+            chunks, b'<< %s /Filter /FlateDecode /Length %d >>\nstream\n%s\nendstream' % (
+                dictionary, len(data), data,
+            ),
+        )
+
+    def _emit(self, chunks):
+        data = b''.join(chunks)
+        self.position += len(data)
+        return data
+
+    def start(self):
+        chunks = [b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n']
+        self.fonts = b' '.join(
+            b'/%s %d 0 R' % (resource, self._object(
+                chunks, b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % name.encode(),
+            ))
+            for name, resource in FONTS.items()
+        )
+        return self._emit(chunks)
+
+    def add_page(self, page):
+        chunks = []
+        images = b' '.join(
+            b'/%s %d 0 R' % (resource, self._stream(
+                chunks,
+                b'/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray '
+                b'/BitsPerComponent 8' % (image.width, image.height),
+                image.data,
+            ))
+            for image, resource in page.images.items()
+        )
+        contents = self._stream(chunks, b'', zlib.compress(b'\n'.join(page.operators)))
+        self.pages.append(self._object(chunks, (
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] /Contents %d 0 R '
+            b'/Resources << /Font << %s >> /XObject << %s >> >> >>'
+        ) % (self.page_width, self.page_height, contents, self.fonts, images)))
+        return self._emit(chunks)
+
+    def finish(self):
+        chunks = []
+        self._object(chunks, b'<< /Type /Catalog /Pages 2 0 R >>', number=1)
+        kids = b' '.join(b'%d 0 R' % number for number in self.pages)
+        self._object(chunks, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.pages)), number=2)
+        info = self._object(chunks, b'<< /Title %s /CreationDate (D:%s) >>' % (
+            _pdf_string(self.title), timezone.now().strftime('%Y%m%d%H%M%SZ').encode(),
+        ))
+        xref = self.position + sum(map(len, chunks))
+        chunks.append(b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.offsets) + 1))
+        chunks.extend(b'%010d 00000 n \n' % offset for offset in self.offsets)
+        chunks.append(b'trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n' % (
+            len(self.offsets) + 1, info, xref,
+        ))
+        chunks.append(b'%%EOF\n')
+        return self._emit(chunks)
+
+
+def _fit(pdf, text, font, size, width):
+    """``text`` shortened with an ellipsis to fit ``width`` points."""
+    if pdf.stringWidth(text, font, size) <= width:
+        return text
+    while text and pdf.stringWidth(text + '…', font, size) > width:
+        text = text[:-1]
+    return text + '…'
+
+
+def draw_crop_marks(pdf, layout):
+    pdf.setLineWidth(0.25)
+    xs, ys = layout.cut_lines()
+    for x in xs:
+        pdf.line(x, layout.top + CROP_MARK_OFFSET, x, layout.top + CROP_MARK_OFFSET + CROP_MARK_LENGTH)
+        pdf.line(x, layout.bottom - CROP_MARK_OFFSET, x, layout.bottom - CROP_MARK_OFFSET - CROP_MARK_LENGTH)
+    for y in ys:
+        pdf.line(layout.left - CROP_MARK_OFFSET, y, layout.left - CROP_MARK_OFFSET - CROP_MARK_LENGTH, y)
+        pdf.line(layout.right + CROP_MARK_OFFSET, y, layout.right + CROP_MARK_OFFSET + CROP_MARK_LENGTH, y)
+
+
+def draw_card(pdf, print_order, x, y):
+    record = print_order.rto_record
+    payload = get_qr_payload(record) or get_gallery_url(record)
+    qr_size = CARD_HEIGHT - 2 * CARD_PADDING
+    pdf.drawImage(_qr_image(payload), x + CARD_PADDING, y + CARD_PADDING, width=qr_size, height=qr_size)
+
+    text_x = x + qr_size + 2 * CARD_PADDING
+    text_width = CARD_WIDTH - qr_size - 3 * CARD_PADDING
+    top = y + CARD_HEIGHT - CARD_PADDING
+    pdf.setFont('Helvetica-Bold', 9)
+    pdf.drawString(text_x, top - 9, _fit(pdf, record.name, 'Helvetica-Bold', 9, text_width))
+    pdf.setFont('Helvetica', 7)
+    pdf.drawString(text_x, top - 20, record.get_record_type_display())
+    pdf.drawString(text_x, top - 29, _fit(pdf, print_order.order.get_order_type_display(), 'Helvetica', 7, text_width))
+    pdf.drawString(text_x, top - 38, _fit(pdf, print_order.order.order_id, 'Helvetica', 7, text_width))
+
+    # The full record id, split between UUID groups so it fits the column
+    record_id = str(record.id)
+    pdf.setFont('Courier', 6)
+    pdf.drawString(text_x, y + CARD_PADDING + 7, record_id[:19])
+    pdf.drawString(text_x, y + CARD_PADDING, record_id[19:])
+
+
+def iter_print_sheets(print_orders, layout=None, title="Card production sheets"):
+    """Yield the PDF of sheets for ``print_orders``, one sheet at a time.
+
+    ``print_orders`` may be any iterable (e.g. ``queryset.iterator()``) of
+    PrintOrders with ``order`` and ``rto_record`` loaded; it is consumed one
+    sheet ahead of the output.
+    """
+    layout = layout or SheetLayout(settings.PRINT_SHEET_PAGE_SIZE)
+    writer = PDFStreamWriter((layout.page_width, layout.page_height), title)
+    yield writer.start()
+    page = None
+    for count, print_order in enumerate(print_orders, start=1):
+        slot = (count - 1) % layout.per_sheet
+        if slot == 0:
+            if page is not None:
+                yield writer.add_page(page)
+            page = PDFPage()
+            draw_crop_marks(page, layout)
+        draw_card(page, print_order, *layout.slot(slot))
+    if page is not None:
+        yield writer.add_page(page)
+    yield writer.finish()
+
+
+def write_print_sheets(print_orders, output, layout=None, title="Card production sheets"):
+    """Write the sheets for ``print_orders`` to the file ``output``; returns the card count."""
+    count = 0
+
+    def counted():
+        nonlocal count
+        for count, print_order in enumerate(print_orders, start=1):
+            yield print_order
+
+    for data in iter_print_sheets(counted(), layout, title):
+        output.write(data)
+    return count
+
+
+def print_sheet_response(print_orders, filename, layout=None):
+    """StreamingHttpResponse sending each sheet as soon as it is drawn."""
+    return StreamingHttpResponse(
+        iter_print_sheets(print_orders, layout), content_type='application/pdf',
+        headers={'Content-Disposition': content_disposition_header(True, filename)},
+    )
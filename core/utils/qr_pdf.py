@@ -0,0 +1,94 @@
+"""Stored per-record QR code PDFs.
+
+The printable QR PDF is built once per record version and kept in the
+default storage under ``QR_PDF_PREFIX``; ``RTORecord.pdf_card_filepath``
+names the current copy. The version is a hash of everything printed on the
+page, so editing the record or changing its QR code produces a new PDF and
+the old one is deleted.
+"""
+import hashlib
+import io
+import json
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from core.models import RTORecord
+from core.utils.gallery_utils import get_qr_payload
+from core.utils.qr_utils import get_qr_png, qr_cache_key, qr_params
+
+# Bump when the layout below changes so stored PDFs are rebuilt
+QR_PDF_VERSION = 1
+
+
+def qr_pdf_version(record):
+    """Hash of the page's contents; doubles as the ETag."""
+    payload = json.dumps([
+        QR_PDF_VERSION,
+        str(record.id),
+        record.name,
+        record.contact_no,
+        record.record_type,
+        record.created_at.isoformat(),
+        qr_cache_key(get_qr_payload(record), qr_params()),
+    ], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def render_qr_pdf(record, output):
+    """Write the one-page QR PDF for ``record`` to the ``output`` file object."""
+    p = canvas.Canvas(output, pagesize=letter)
+    width, height = letter
+
+    # Add title
+    p.setFont("Helvetica-Bold", 20)
+    p.drawString(50, height - 80, "RTO Record QR Code")
+
+    # Add user info
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(50, height - 120, f"Name: {record.name}")
+    p.drawString(50, height - 145, f"Contact: {record.contact_no}")
+    p.drawString(50, height - 170, f"Record Type: {record.get_record_type_display()}")
+
+    # QR code from the QR cache in the default storage, never a local path
+    qr_png, _key = get_qr_png(get_qr_payload(record))
+    p.drawImage(ImageReader(io.BytesIO(qr_png)), 50, height - 450, width=300, height=300)
+
+    # Add instructions
+    p.setFont("Helvetica", 12)
+    p.drawString(50, height - 480, "Scan this QR code to view all uploaded documents")
+    p.drawString(50, height - 500, f"Record ID: {record.id}")
+    p.drawString(50, height - 520, f"Generated on: {record.created_at.strftime('%Y-%m-%d %H:%M')}")
+
+    # Add footer
+    p.setFont("Helvetica-Oblique", 10)
+    p.drawString(50, 50, "© RTO Record Management System - Digitally Generated Document")
+
+    p.showPage()
+    p.save()
+
+
+def get_qr_pdf(record, version=None):
+    """Storage name of the current QR PDF for ``record``, building it if needed."""
+    version = version or qr_pdf_version(record)
+    name = f"{settings.QR_PDF_PREFIX}/{record.id}/{version}.pdf"
+    if record.pdf_card_filepath == name and default_storage.exists(name):
+        return name
+
+    if not default_storage.exists(name):
+        buffer = io.BytesIO()
+        render_qr_pdf(record, buffer)
+        buffer.seek(0)
+        name = default_storage.save(name, File(buffer))
+
+    old = record.pdf_card_filepath
+    if old and old != name and old.startswith(f"{settings.QR_PDF_PREFIX}/"):
+        default_storage.delete(old)
+    # Not record.save(): that would bump updated_at for a derived file
+    RTORecord.objects.filter(pk=record.pk).update(pdf_card_filepath=name)
+    record.pdf_card_filepath = name
+    return name
@@ -0,0 +1,105 @@
+"""NumPy rasterizer for QR codes.
+
+``qrcode``'s PIL image factory paints every dark module as a rectangle
+through ``ImageDraw``, which dominates the cost of a QR code at the box sizes
+we use. Here the module matrix is scaled up with ``np.repeat`` and written
+straight to a PNG (greyscale, 1-bit by default) with ``zlib``. The pixels are
+identical to ``qr.make_image(fill_color="black", back_color="white")``.
+
+NumPy is optional: ``numpy_available()`` is False when it is not installed
+and callers fall back to the PIL path.
+"""
+import struct
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy
+    np = None
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_COMPRESSION_LEVEL = 6  # same as Pillow's PNG encoder default
+
+
+def numpy_available():
+    return np is not None
+
+
+def rasterize(dark, box_size):
+    """Boolean pixel array (True = white) for a module matrix (True = dark)."""
+    dark = np.asarray(dark, dtype=bool)
+    return ~np.repeat(np.repeat(dark, box_size, axis=0), box_size, axis=1)
+
+
+def add_border(modules, border):
+    """Module matrix with a quiet zone of ``border`` light modules around it."""
+    return np.pad(np.asarray(modules, dtype=bool), border, constant_values=False)
+
+
+def _chunk(kind, data):
+    return (
+        struct.pack('>I', len(data)) + kind + data
+        + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    )
+
+
+def encode_png(pixels, bit_depth=1):
+    """Encode a boolean (True = white) array as a greyscale PNG."""
+    height, width = pixels.shape
+    if bit_depth == 1:
+        rows = np.packbits(pixels, axis=1)
+    elif bit_depth == 8:
+        rows = pixels.astype(np.uint8) * 255
+    else:
+        raise ValueError(f"Unsupported bit depth {bit_depth}; use 1 or 8")
+
+    # Every scanline starts with filter type 0 (None)
+    scanlines = np.zeros((height, rows.shape[1] + 1), dtype=np.uint8)
+    scanlines[:, 1:] = rows
+    header = struct.pack('>IIBBBBB', width, height, bit_depth, 0, 0, 0, 0)
+    return b''.join([
+        PNG_SIGNATURE,
+        _chunk(b'IHDR', header),
+        _chunk(b'IDAT', zlib.compress(scanlines.tobytes(), PNG_COMPRESSION_LEVEL)),
+        _chunk(b'IEND', b''),
+    ])
+
+
+def render_png(qr, box_size, bit_depth=1):
+    """PNG bytes for a made ``qrcode.QRCode``.
+
+    ``get_matrix()`` already includes the quiet-zone border.
+    """
+    return encode_png(rasterize(qr.get_matrix(), box_size), bit_depth)
+
+
+def matrix_to_png(modules, box_size, border, bit_depth=1):
+    """PNG bytes for a bare module matrix (``qr.modules``)."""
+    return encode_png(rasterize(add_border(modules, border), box_size), bit_depth)
+
+
+def matrix_to_svg(modules, border, size=None):
+    """SVG document for a bare module matrix, one path of horizontal runs.
+
+    Pure Python, so it works without NumPy. The viewBox is in modules; pass
+    ``size`` for explicit pixel width and height attributes.
+    """
+    dimension = len(modules) + 2 * border
+    parts = []
+    for y, row in enumerate(modules):
+        x = 0
+        while x < len(row):
+            if row[x]:
+                start = x
+                while x < len(row) and row[x]:
+                    x += 1
+                parts.append(f'M{start + border} {y + border}h{x - start}v1h-{x - start}z')
+            else:
+                x += 1
+    size_attrs = f' width="{size}" height="{size}"' if size else ''
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {dimension} {dimension}"{size_attrs}'
+        f' shape-rendering="crispEdges">'
+        f'<rect width="100%" height="100%" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(parts)}"/></svg>\n'
+    ).encode('utf-8')
@@ -0,0 +1,180 @@
+"""Shared QR code rendering with a two-tier cache.
+
+Every QR image in the app (record QR codes, gallery links, admin email
+attachments) comes from ``get_qr_png``. Images are keyed by a hash of the
+payload and the render parameters and looked up in:
+
+1. an in-process LRU of PNG bytes, then
+2. a content-addressed copy under ``QR_CACHE_PREFIX`` in the default storage,
+
+so an unchanged URL is rendered once and then only read back.
+
+``render_qr`` serves the on-demand QR endpoint: it draws PNG or SVG at any
+size from a cached module matrix, so records only need their payload and
+``RTORecord.qr_code_image`` is an optional persisted copy.
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from core.utils import qr_raster
+
+# Bump when the rendering below changes so cached images are not reused
+QR_RENDER_VERSION = 1
+QR_MEMORY_CACHE_SIZE = 512
+
+QR_FORMATS = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+ERROR_CORRECTION = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+
+
+def qr_params(**overrides):
+    """Render parameters, defaulting to the QR_CODE_* settings."""
+    params = {
+        'version': settings.QR_CODE_VERSION,
+        'error_correction': settings.QR_CODE_ERROR_CORRECTION,
+        'box_size': settings.QR_CODE_BOX_SIZE,
+        'border': settings.QR_CODE_BORDER,
+    }
+    params.update(overrides)
+    return params
+
+
+def qr_cache_key(data, params):
+    """Content address of the PNG for ``data`` rendered with ``params``."""
+    payload = json.dumps([QR_RENDER_VERSION, data, sorted(params.items())], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def render_qr_png(data, params):
+    """Render ``data`` to PNG bytes without any caching.
+
+    ``QR_RASTERIZER = 'numpy'`` uses the vectorized rasterizer (same pixels,
+    a fraction of the time); without NumPy it falls back to PIL.
+    """
+    qr = qrcode.QRCode(
+        version=params['version'],
+        error_correction=ERROR_CORRECTION[params['error_correction']],
+        box_size=params['box_size'],
+        border=params['border'],
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    if settings.QR_RASTERIZER == 'numpy' and qr_raster.numpy_available():
+        return qr_raster.render_png(qr, params['box_size'])
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    blob = BytesIO()
+    img.save(blob, 'PNG')
+    return blob.getvalue()
+
+
+@lru_cache(maxsize=QR_MEMORY_CACHE_SIZE)
+def get_qr_modules(data, version, error_correction):
+    """Module matrix (True = dark, no border) for ``data``, as nested tuples."""
+    qr = qrcode.QRCode(
+        version=version, error_correction=ERROR_CORRECTION[error_correction], border=0,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.modules)
+
+
+def render_qr_key(data, fmt='png', box_size=None):
+    """Key of the bytes ``render_qr`` returns for these arguments, without rendering."""
+    params = qr_params(**({'box_size': box_size} if box_size else {}))
+    return qr_cache_key(data, {**params, 'format': fmt})
+
+
+def render_qr(data, fmt='png', box_size=None):
+    """Render ``data`` as ``fmt`` from the cached matrix; returns ``(content, key)``.
+
+    ``key`` addresses the exact bytes, so it doubles as the ETag. SVG is
+    resolution independent: ``box_size`` only sets its width and height.
+    """
+    params = qr_params(**({'box_size': box_size} if box_size else {}))
+    key = render_qr_key(data, fmt, box_size)
+    modules = get_qr_modules(data, params['version'], params['error_correction'])
+    border = params['border']
+    if fmt == 'svg':
+        size = (len(modules) + 2 * border) * box_size if box_size else None
+        return qr_raster.matrix_to_svg(modules, border, size), key
+    if fmt != 'png':
+        raise ValueError(f"Unsupported QR format {fmt!r}; use one of {', '.join(QR_FORMATS)}")
+
+    if settings.QR_RASTERIZER == 'numpy' and qr_raster.numpy_available():
+        return qr_raster.matrix_to_png(modules, params['box_size'], border), key
+    return render_qr_png(data, params), key
+
+
+def qr_box_size_for(data, pixels):
+    """Largest box size whose image fits in ``pixels`` (at least 1)."""
+    params = qr_params()
+    modules = get_qr_modules(data, params['version'], params['error_correction'])
+    return max(1, pixels // (len(modules) + 2 * params['border']))
+
+
+def _storage_path(key):
+    return f"{settings.QR_CACHE_PREFIX}/{key[:2]}/{key}.png"
+
+
+@lru_cache(maxsize=QR_MEMORY_CACHE_SIZE)
+def _cached_png(key, data, params_items):
+    path = _storage_path(key)
+    if default_storage.exists(path):
+        with default_storage.open(path, 'rb') as f:
+            return f.read()
+
+    png = render_qr_png(data, dict(params_items))
+    # Content addressed: a concurrent writer would store the same bytes
+    if not default_storage.exists(path):
+        default_storage.save(path, ContentFile(png))
+    return png
+
+
+def get_qr_png(data, **overrides):
+    """PNG bytes of a QR code for ``data``; returns ``(png, key)``."""
+    params = qr_params(**overrides)
+    key = qr_cache_key(data, params)
+    return _cached_png(key, data, tuple(sorted(params.items()))), key
+
+
+def save_qr_to_record(record, data, **overrides):
+    """Set ``record.qr_payload`` to ``data`` (does not save the record).
+
+    With ``QR_PERSIST_IMAGES`` the PNG is also stored in
+    ``record.qr_code_image``. The file name carries the content key, so a
+    record whose QR code is already current is left untouched. Returns True
+    when the QR code changed.
+    """
+    changed = record.qr_payload != data
+    record.qr_payload = data
+    if not settings.QR_PERSIST_IMAGES:
+        return changed
+
+    png, key = get_qr_png(data, **overrides)
+    name = f'qr_{record.id}_{key[:16]}.png'
+    old = record.qr_code_image.name if record.qr_code_image else ''
+    if os.path.basename(old) == name:
+        return changed
+
+    record.qr_code_image.save(name, ContentFile(png), save=False)
+    if old and old != record.qr_code_image.name:
+        record.qr_code_image.storage.delete(old)
+    return True
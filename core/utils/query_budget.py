@@ -0,0 +1,75 @@
+"""Per-endpoint query budgets.
+
+An endpoint declares how many database queries one request may run, and
+``query_budget`` counts them through ``connection.execute_wrapper``, which
+costs a function call per query and needs no ``DEBUG`` cursor. Going over
+the budget logs a warning in production and raises
+``QueryBudgetExceeded`` when ``QUERY_BUDGET_STRICT`` is on (tests and
+development), so an N+1 introduced by a new serializer field fails the suite
+instead of slowing down large pages.
+
+Budgets count everything the view runs, including the session and user
+lookups, but not the middleware's session save afterwards.
+"""
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@contextmanager
+def query_budget(limit, label):
+    """Count the queries run inside the block and check them against ``limit``."""
+    count = 0
+
+    def counter(execute, sql, params, many, context):
+        nonlocal count
+        count += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(counter):
+        yield
+    if count > limit:
+        message = f"{label} ran {count} queries, over its budget of {limit}"
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class QueryBudgetMixin:
+    """Viewset mixin enforcing ``query_budgets``, a map of action name to query limit."""
+
+    query_budgets = {}
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower())
+        if action not in self.query_budgets:
+            return super().dispatch(request, *args, **kwargs)
+        with query_budget(self.query_budgets[action], f"{type(self).__name__}.{action}"):
+            response = super().dispatch(request, *args, **kwargs)
+            # Lazy serializer data is evaluated by rendering, so count that too
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+
+class AdminQueryBudgetMixin:
+    """ModelAdmin mixin enforcing ``changelist_query_budget`` on the change list."""
+
+    changelist_query_budget = None
+
+    def changelist_view(self, request, extra_context=None):
+        if self.changelist_query_budget is None:
+            return super().changelist_view(request, extra_context)
+        with query_budget(self.changelist_query_budget, f"{type(self).__name__}.changelist"):
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+        return response
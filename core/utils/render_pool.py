@@ -0,0 +1,33 @@
+"""Process pool entry points for bulk gallery rendering.
+
+Spawned workers import this module before ``django.setup()`` has run, so it
+must not import models or Django-dependent helpers at module level.
+"""
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def render_gallery_job(job):
+    """Render one gallery page; returns ``(record_id, (input_hash, output_hash) or None)``.
+
+    ``None`` means the page on disk already matches the manifest entry.
+    Only the filesystem is touched; the caller saves the manifest.
+    """
+    from core.utils.gallery_utils import (
+        _file_hash, gallery_input_hash, get_cloudinary_urls, write_gallery_page,
+    )
+
+    record, page_path, manifest, template_hash, force = job
+    cloudinary_urls = get_cloudinary_urls(record)
+    input_hash = gallery_input_hash(record, cloudinary_urls)
+    if (
+        not force and manifest
+        and manifest[:2] == (input_hash, template_hash)
+        and _file_hash(page_path) == manifest[2]
+    ):
+        return record.pk, None
+    output_hash, _written = write_gallery_page(record, cloudinary_urls, page_path)
+    return record.pk, (input_hash, output_hash)
@@ -0,0 +1,164 @@
+"""Daily rollup tables behind the admin analytics page.
+
+``DailyOrderRollup`` and ``DailyTransactionRollup`` hold one row per day ×
+order type × payment status × provider, with counts and amounts, so the
+analytics page reads O(days) rows however many orders there are.
+
+Payment state changes mostly through ``bulk_update`` and ``update()``
+(webhooks, reconciliation), which bypass save hooks, so the tables are
+brought up to date by ``refresh_rollups`` on a schedule instead:
+
+1. one indexed query finds the days of source rows whose ``updated_at`` is
+   past the rollup's watermark; days left dirty by deletes are added;
+2. each such day is recomputed with one ``GROUP BY`` over its
+   ``created_at`` range, and its rollup rows are replaced;
+3. the watermark moves to the start of the run, less
+   ``ROLLUP_WATERMARK_LAG``, so rows committed by transactions still open at
+   that point are picked up by the next run.
+
+Days are those of ``created_at`` in ``TIME_ZONE``.
+"""
+import logging
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core.models import DailyOrderRollup, Order, RollupDirtyDay, RollupState
+from payments.models import DailyTransactionRollup, PaymentTransaction
+
+logger = logging.getLogger(__name__)
+
+DAYS_PER_QUERY = 31
+REFRESH_LOCK_KEY = 'rollup_refresh_lock'
+REFRESH_LOCK_TIMEOUT = 30 * 60
+
+
+class Rollup:
+    """A rollup table and how to compute it from its source model."""
+
+    def __init__(self, name, model, source, dimensions, measures):
+        self.name = name
+        self.model = model
+        self.source = source
+        self.dimensions = dimensions  # rollup field -> source lookup
+        self.measures = measures  # rollup field -> aggregate over the source
+
+    def compute(self, days):
+        """Rollup rows for ``days``, from one grouped query over their ``created_at`` ranges."""
+        ranges = Q()
+        for day in days:
+            ranges |= Q(created_at__gte=_start_of(day), created_at__lt=_start_of(day + timedelta(days=1)))
+        groups = (
+            self.source.objects.filter(ranges)
+            .annotate(day=TruncDate('created_at'))
+            .values('day', *self.dimensions.values())
+            .annotate(**{f'rollup_{name}': aggregate for name, aggregate in self.measures.items()})
+            .order_by()
+        )
+        return [
+            self.model(
+                day=group['day'],
+                **{name: group[lookup] for name, lookup in self.dimensions.items()},
+                **{name: group[f'rollup_{name}'] for name in self.measures},
+            )
+            for group in groups
+        ]
+
+
+ROLLUPS = [
+    Rollup(
+        'orders', DailyOrderRollup, Order,
+        dimensions={'order_type': 'order_type', 'payment_status': 'payment_status', 'provider': 'payment_provider'},
+        measures={'orders': Count('pk'), 'amount': Sum('total_amount')},
+    ),
+    Rollup(
+        'transactions', DailyTransactionRollup, PaymentTransaction,
+        dimensions={'order_type': 'order__order_type', 'status': 'status', 'provider': 'gateway__provider'},
+        measures={'transactions': Count('pk'), 'amount': Sum('amount'), 'refunded': Sum('refund_amount')},
+    ),
+]
+
+
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def refresh_rollup(rollup, full=False):
+    """Recompute the days of ``rollup`` that changed since its watermark; returns how many."""
+    started = timezone.now()
+    state, _ = RollupState.objects.get_or_create(name=rollup.name)
+    dirty = list(RollupDirtyDay.objects.filter(rollup=rollup.name).values_list('pk', 'day'))
+
+    if full or state.watermark is None:
+        # Days that lost all their rows are recomputed to nothing
+        days = set(rollup.source.objects.dates('created_at', 'day')) | set(rollup.model.objects.dates('day', 'day'))
+    else:
+        days = set(rollup.source.objects.filter(updated_at__gte=state.watermark).dates('created_at', 'day'))
+    days |= {day for _, day in dirty}
+
+    days = sorted(days)
+    for i in range(0, len(days), DAYS_PER_QUERY):
+        chunk = days[i:i + DAYS_PER_QUERY]
+        rows = rollup.compute(chunk)
+        with transaction.atomic():
+            rollup.model.objects.filter(day__in=chunk).delete()
+            rollup.model.objects.bulk_create(rows)
+
+    RollupDirtyDay.objects.filter(pk__in=[pk for pk, _ in dirty]).delete()
+    state.watermark = started - timedelta(seconds=settings.ROLLUP_WATERMARK_LAG)
+    state.refreshed_at = started
+    state.save(update_fields=['watermark', 'refreshed_at'])
+    return len(days)
+
+
+def refresh_rollups(full=False):
+    """Refresh every rollup; returns ``{name: days recomputed}``, or None if a refresh is already running."""
+    if not cache.add(REFRESH_LOCK_KEY, True, timeout=REFRESH_LOCK_TIMEOUT):
+        logger.info("Rollup refresh already running")
+        return None
+    try:
+        refreshed = {rollup.name: refresh_rollup(rollup, full=full) for rollup in ROLLUPS}
+    finally:
+        cache.delete(REFRESH_LOCK_KEY)
+    logger.info("Refreshed rollups: %s", refreshed)
+    return refreshed
+
+
+def _rate(part, whole):
+    return round(100 * part / whole, 1) if whole else None
+
+
+def order_analytics(start, end):
+    """Admin analytics for ``start``..``end`` (inclusive dates), read from the rollups only."""
+    rows = DailyOrderRollup.objects.filter(day__gte=start, day__lte=end)
+    completed = Q(payment_status=Order.Status.COMPLETED)
+    # Annotations can't reuse the ``orders`` field name, so they're renamed here
+    totals = {
+        'order_count': Sum('orders'),
+        'completed': Sum('orders', filter=completed),
+        'revenue': Sum('amount', filter=completed),
+    }
+
+    def summarise(group):
+        group['orders'] = group.pop('order_count') or 0
+        group['completed'] = group['completed'] or 0
+        group['completion_rate'] = _rate(group['completed'], group['orders'])
+        return group
+
+    refunds = DailyTransactionRollup.objects.filter(day__gte=start, day__lte=end).aggregate(
+        transactions=Sum('transactions'), refunded=Sum('refunded'),
+    )
+    return {
+        'totals': summarise(rows.aggregate(**totals)),
+        'by_type': [summarise(group) for group in rows.values('order_type').annotate(**totals).order_by('order_type')],
+        'by_status': list(rows.values('payment_status').annotate(order_count=Sum('orders')).order_by('-order_count')),
+        'by_day': [summarise(group) for group in rows.values('day').annotate(**totals).order_by('-day')],
+        'transactions': refunds['transactions'] or 0,
+        'refunded': refunds['refunded'] or 0,
+        'refreshed_at': RollupState.objects.filter(name='orders').values_list('refreshed_at', flat=True).first(),
+    }
@@ -1,30 +1,31 @@
-import razorpay
 import hmac
 import hashlib
 import json
-import qrcode
-import os
-import subprocess
-from io import BytesIO
+from decimal import Decimal
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.urls import reverse
-from django.views.decorators.http import require_POST
-from django.core.files import File
-from django.template.loader import render_to_string
-from core.utils.email_utils import send_order_notification_to_admin
+from django.views.decorators.http import require_POST, require_safe
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from core.utils.gallery_utils import (
+    get_cloudinary_urls, generate_static_html, generate_qr_code_for_record, get_gallery_url,
+    gallery_version, render_gallery_html, static_galleries_enabled, get_qr_payload,
+)
+from core.utils.qr_utils import QR_FORMATS, qr_box_size_for, render_qr, render_qr_key
+from core.utils.dashboard_stats import get_dashboard_stats
+from core.utils.order_utils import checkout_order, get_or_create_gateway_order
 
 
 from .models import RTORecord, Order
+from .tasks import enqueue_post_payment, schedule_gallery_deploy
 from .forms import RTORecordForm, SchoolRecordForm, OrderForm
 
-# Initialize Razorpay client
-client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
 @csrf_exempt
 @require_POST
 def ajax_create_record(request):
@@ -81,15 +82,6 @@ def ajax_create_record(request):
         
         record.save()
 
-        # Create Razorpay order with DYNAMIC amount
-        amount_paise = amount * 100  # Convert rupees to paise dynamically
-        
-        razorpay_order = client.order.create({
-            'amount': amount_paise,
-            'currency': 'INR',
-            'payment_capture': 1,
-        })
-
         # Map service type to order type
         order_type_mapping = {
             'qr': 'qr_download',
@@ -99,15 +91,8 @@ def ajax_create_record(request):
         
         order_type = order_type_mapping.get(service_type, 'qr_download')
 
-        order = Order.objects.create(
-            user=request.user,
-            rto_record=record,
-            order_id=razorpay_order['id'],
-            order_type=order_type,
-            amount=amount,  # Store amount in rupees
-            payment_status=Order.Status.PENDING,
-            payment_provider='razorpay',
-        )
+        # payment_view picks this order up again instead of creating another
+        get_or_create_gateway_order(request.user, record, order_type, amount)
 
         payment_url = reverse('core:payment', kwargs={'record_id': record.id, 'order_type': order_type})
         return JsonResponse({'payment_url': payment_url})
@@ -145,12 +130,7 @@ def dashboard_view(request):
     user_records = user_records[:10]
     user_orders = user_orders_qs[:10]
 
-    stats = {
-        "total_records": user_records_qs.count(),
-        "approved_records": user_records_qs.filter(status='approved').count(),
-        "pending_records": user_records_qs.filter(status='pending').count(),
-        "total_orders": user_orders_qs.count(),
-    }
+    stats = get_dashboard_stats(request.user)
 
     return render(request, 'core/dashboard.html', {
         'user_records': user_records,
@@ -224,27 +204,13 @@ def payment_view(request, record_id, order_type):
     payment_info = pricing[order_type]
     amount = payment_info['amount']
 
-    client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-    razorpay_order = client.order.create(dict(
-        amount=amount,
-        currency=payment_info['currency'],
-        payment_capture=1,
-    ))
-
-    order = Order.objects.create(
-        user=request.user,
-        rto_record=record,
-        order_id=razorpay_order['id'],
-        order_type=order_type,
-        amount=amount / 100.0,
-        payment_status=Order.Status.PENDING,
-        payment_provider='razorpay',
-    )
+    # Reloads and double clicks reuse the pending order instead of calling Razorpay again
+    order, _created = get_or_create_gateway_order(request.user, record, order_type, Decimal(amount) / 100)
 
     context = {
         'record': record,
         'order': order,
-        'razorpay_order': json.dumps(razorpay_order),
+        'razorpay_order': json.dumps(checkout_order(order)),
         'razorpay_key': settings.RAZORPAY_KEY_ID,
         'payment_info': payment_info,
         'order_type': order_type,
@@ -253,308 +219,6 @@ def payment_view(request, record_id, order_type):
 
     return render(request, 'core/payment.html', context)
 
-def get_cloudinary_urls(record):
-    """Extract all Cloudinary URLs from a record"""
-    urls = []
-    
-    print(f"🔍 DEBUG: Checking record {record.id} of type '{record.record_type}'")
-    
-    if record.record_type == "rto":
-        print("📋 Checking RTO documents:")
-        if record.rc_photo: 
-            urls.append(record.rc_photo)
-            print(f"✅ RC Photo: {record.rc_photo}")
-        else:
-            print("❌ RC Photo: EMPTY")
-            
-        if record.insurance_doc: 
-            urls.append(record.insurance_doc)
-            print(f"✅ Insurance Doc: {record.insurance_doc}")
-        else:
-            print("❌ Insurance Doc: EMPTY")
-            
-        if record.pu_check_doc: 
-            urls.append(record.pu_check_doc)
-            print(f"✅ PU Check Doc: {record.pu_check_doc}")
-        else:
-            print("❌ PU Check Doc: EMPTY")
-            
-        if record.driving_license_doc: 
-            urls.append(record.driving_license_doc)
-            print(f"✅ Driving License Doc: {record.driving_license_doc}")
-        else:
-            print("❌ Driving License Doc: EMPTY")
-            
-    elif record.record_type == "school":
-        print("🎓 Checking School documents:")
-        if record.marks_card: 
-            urls.append(record.marks_card)
-            print(f"✅ Marks Card: {record.marks_card}")
-        else:
-            print("❌ Marks Card: EMPTY")
-            
-        if record.photo: 
-            urls.append(record.photo)
-            print(f"✅ Photo: {record.photo}")
-        else:
-            print("❌ Photo: EMPTY")
-            
-        if record.convocation: 
-            urls.append(record.convocation)
-            print(f"✅ Convocation: {record.convocation}")
-        else:
-            print("❌ Convocation: EMPTY")
-            
-        if record.migration: 
-            urls.append(record.migration)
-            print(f"✅ Migration: {record.migration}")
-        else:
-            print("❌ Migration: EMPTY")
-    
-    print(f"📊 TOTAL DOCUMENTS FOUND: {len(urls)}")
-    return urls
-
-def generate_static_html(record):
-    """Generate static HTML file for the record in deploy_site folder"""
-    cloudinary_urls = get_cloudinary_urls(record)
-    
-    print(f"🔍 DEBUG: Creating HTML for record {record.id}")
-    print(f"📋 Found {len(cloudinary_urls)} documents")
-    
-    context = {
-        'record': record,
-        'cloudinary_urls': cloudinary_urls,
-    }
-    
-    # Generate HTML content using your existing template
-    try:
-        html_content = render_to_string('document_gallery.html', context)
-    except Exception as e:
-        print(f"❌ Template error: {e}")
-        html_content = generate_inline_html(record, cloudinary_urls)
-    
-    # Create folder structure for Netlify (using deploy_site now)
-    folder_path = f'deploy_site/record_{record.id}'
-    os.makedirs(folder_path, exist_ok=True)
-    
-    # Write HTML file
-    with open(os.path.join(folder_path, 'index.html'), 'w', encoding='utf-8') as f:
-        f.write(html_content)
-    
-    print(f"✅ Generated HTML file: {folder_path}/index.html")
-
-def generate_inline_html(record, cloudinary_urls):
-    docs_html = ""
-    for i, url in enumerate(cloudinary_urls):
-        filename = url.split("/")[-1].split("?")[0] or f"Document_{i+1}"
-        download_url = f"{url}?fl_attachment"  # For Cloudinary; but see below for the <a download> trick
-        docs_html += f"""
-        <div class="doc-card">
-            <img src="{url}" alt="Document {i+1}" class="doc-image" loading="lazy">
-            <div class="doc-info">
-                <h3>Document {i+1}</h3>
-                <div class="btn-group">
-                    <a href="{url}" class="btn btn-view" target="_blank">
-                        <span class="icon-eye"></span> View
-                    </a>
-                    <a href="{download_url}" download="{filename}" class="btn btn-download">
-                        <span class="icon-download"></span> Download
-                    </a>
-                </div>
-            </div>
-        </div>
-        """
-    
-    html_content = f"""<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Documents for {record.name}</title>
-    <style>
-        :root {{
-            --accent: #667eea;
-            --accent-hover: #5a67d8;
-            --success: #48bb78;
-            --success-hover: #38a169;
-            --bg-card: rgba(255,255,255,0.14);
-            --bg: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            --txt-main: #252f44;
-            --txt-light: #fff;
-            --shadow-card: 0 8px 32px rgba(102,126,234,.13);
-        }}
-        * {{ box-sizing: border-box; }}
-        body {{
-            margin: 0; padding: 0;
-            font-family: 'Inter', 'Segoe UI', Arial, sans-serif;
-            background: var(--bg); min-height: 100vh;
-        }}
-        .container {{
-            max-width: 1200px; margin: 0 auto; padding: 14px;
-        }}
-        .header {{
-            background: var(--bg-card);
-            border-radius: 22px;
-            box-shadow: var(--shadow-card);
-            color: var(--txt-main);
-            margin-bottom: 24px;
-            text-align: center;
-            padding: 32px 20px 24px;
-        }}
-        .header h1 {{
-            font-size: 2.5em; font-weight: 900; margin: 0 0 12px;
-            color: var(--accent);
-            letter-spacing: -1px;
-            display: flex; gap: .45em; align-items: center; justify-content: center;
-        }}
-        .header .icon-doc {{
-            font-size: 1.2em; color: var(--accent);
-            margin-bottom: 3px;
-        }}
-        .header-info {{
-            display: flex; gap: 2em; justify-content: center; flex-wrap: wrap; font-size:1.11em; margin-top: 12px; color: #222;
-        }}
-        .header-info .icon {{
-            margin-right: .25em; color: var(--accent);
-        }}
-        .gallery {{
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(320px, 1fr));
-            gap: 32px;
-            margin-bottom: 40px;
-        }}
-        .doc-card {{
-            background: var(--bg-card);
-            border-radius: 19px;
-            box-shadow: var(--shadow-card);
-            overflow: hidden;
-            display: flex; flex-direction: column; align-items: center;
-            transition: box-shadow .23s cubic-bezier(.4,.6,.18,1);
-        }}
-        .doc-card:hover {{
-            box-shadow: 0 12px 36px rgba(102,126,234,.22);
-        }}
-        .doc-image {{
-            max-width: 100%; width: 100%; height: 220px;
-            object-fit: cover; background: #eee;
-        }}
-        .doc-info {{
-            padding: 18px 16px 18px; text-align: center; width:100%;
-        }}
-        .doc-info h3 {{
-            font-size: 1.16em; margin: 6px 0 20px;
-            color: var(--accent-hover); font-weight: 600;
-        }}
-        .btn-group {{
-            display: flex; gap: 12px; justify-content: center; margin-top: 4px;
-        }}
-        .btn {{
-            display: inline-block; min-width: 94px; padding: 10px 19px;
-            border-radius: 11px; font-weight: 700;
-            text-decoration: none; font-size: 1em;
-            transition: background .22s, box-shadow .22s;
-            border: none; cursor: pointer;
-            box-shadow: 0 2px 14px rgba(102,126,234,0.04);
-            display: flex; align-items: center; gap: .6em; justify-content: center;
-        }}
-        .btn-view {{
-            background: var(--accent); color: var(--txt-light);
-        }}
-        .btn-view:hover {{ background: var(--accent-hover); }}
-        .btn-download {{
-            background: var(--success); color: var(--txt-light);
-        }}
-        .btn-download:hover {{ background: var(--success-hover); }}
-        /* Small icon helpers */
-        .icon-eye::before {{ content: "👁️"; position: relative; top: 1px; }}
-        .icon-download::before {{ content: "⬇️"; position: relative; top: 2px; }}
-        .icon-doc::before {{ content:"📄"; }}
-        .icon-phone::before {{ content:"📞"; }}
-        .icon-type::before {{ content:"🏷️"; }}
-        .icon-date::before {{ content:"📅"; color: #c0392b; }}
-        .footer {{
-            text-align: center; color: #eee; font-size: 1.05em; margin-bottom: 8px;
-        }}
-        /* Responsive for small screens */
-        @media (max-width: 600px){{
-            .header h1 {{ font-size: 1.45em; }}
-            .gallery {{ grid-template-columns: 1fr; gap: 18px }}
-        }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1><span class="icon-doc"></span> Documents for {record.name}</h1>
-            <div class="header-info">
-                <span><span class="icon-phone icon"></span> <b>Contact:</b> {record.contact_no}</span>
-                <span><span class="icon-date icon"></span> <b>Created:</b> {record.created_at.strftime('%B %d, %Y')}</span>
-            </div>
-        </div>
-        <div class="gallery">
-            {docs_html}
-        </div>
-        <div class="footer">
-            <p>Generated by <strong>Secure RTO Document Management</strong> | All documents encrypted &amp; secure</p>
-        </div>
-    </div>
-</body>
-</html>
-"""
-    return html_content
-
-
-def auto_deploy_to_github(record):
-    """Automatically commit and push to GitHub"""
-    try:
-        # Change to project directory
-        os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-        
-        # Add new files (FIXED: Changed from static_site/ to deploy_site/)
-        subprocess.run(['git', 'add', 'deploy_site/'], check=True)
-        
-        # Check if there are changes to commit
-        result = subprocess.run(['git', 'diff', '--staged', '--quiet'], capture_output=True)
-        if result.returncode == 0:
-            print(f"No changes to commit for record {record.id}")
-            return
-        
-        # Commit changes
-        commit_message = f"Add document gallery for record {record.id}"
-        subprocess.run(['git', 'commit', '-m', commit_message], check=True)
-        
-        # Push to GitHub
-        subprocess.run(['git', 'push', 'origin', 'main'], check=True)
-        
-        print(f"✅ Successfully deployed record {record.id} to GitHub")
-        
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error deploying to GitHub: {e}")
-    except Exception as e:
-        print(f"❌ Unexpected error during GitHub deployment: {e}")
-
-def generate_qr_code_for_record(record, url):
-    """Generate QR code pointing to the gallery URL"""
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    
-    # Create QR image
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Save to model
-    blob = BytesIO()
-    img.save(blob, 'PNG')
-    blob.seek(0)
-    
-    record.qr_code_image.save(f'qr_{record.id}.png', File(blob), save=False)
-    record.save()
-
 @csrf_exempt
 @login_required
 def verify_payment(request):
@@ -590,19 +254,6 @@ def verify_payment(request):
     
     record = order.rto_record
     
-    # Generate static HTML file
-    generate_static_html(record)
-    
-    # Auto-commit and push to GitHub
-    auto_deploy_to_github(record)
-    
-    # Generate QR code with Netlify URL
-    netlify_url = f"https://teal-rugelach-4d0f54.netlify.app/record_{record.id}/"
-    generate_qr_code_for_record(record, netlify_url)
-    
-    record.gallery_html_url = netlify_url
-    record.save()
-    
     # Detect the exact order_type from Order object or fallback detection
     if hasattr(order, 'service_type') and order.service_type:
         order_type = order.service_type
@@ -622,13 +273,8 @@ def verify_payment(request):
         else:
             order_type = 'qr'
 
-    # Send admin notification for pvc/nfc with valid address
-    try:
-        if order_type in ['pvc', 'nfc'] and record.address and record.address.strip():
-            send_order_notification_to_admin(record, order_type, netlify_url)
-            print(f"✅ Admin notification sent for {order_type} order")
-    except Exception as e:
-        print(f"❌ Failed to send admin notification: {e}")
+    # Gallery, QR code, deploy and admin notification run on the job queue
+    enqueue_post_payment(order, order_type)
 
     # Store order_type for success page display
     request.session['order_type'] = order_type
@@ -667,17 +313,17 @@ def generate_qr_view(request, record_id):
         return redirect('core:record_detail', record_id=record.id)
     
     try:
-        # Generate static HTML
-        generate_static_html(record)
-        
-        # Generate QR code (FIXED: Using consistent domain)
-        netlify_url = f"https://teal-rugelach-4d0f54.netlify.app/record_{record.id}/"
-        generate_qr_code_for_record(record, netlify_url)
-        record.gallery_html_url = netlify_url
-        record.save()
-        
-        # Deploy to GitHub
-        auto_deploy_to_github(record)
+        gallery_url = get_gallery_url(record)
+        if static_galleries_enabled():
+            # Generate static HTML
+            generate_static_html(record)
+            generate_qr_code_for_record(record, gallery_url)
+            # Queue for the next batched deploy; gallery_html_url is set once it lands
+            schedule_gallery_deploy(record)
+        else:
+            # Served by record_gallery_view, so the page is live straight away
+            record.gallery_html_url = gallery_url
+            generate_qr_code_for_record(record, gallery_url)
         
         messages.success(request, 'QR code generated successfully!')
         return redirect('core:record_detail', record_id=record.id)
@@ -698,9 +344,9 @@ def create_payment_order(request):
 @login_required
 def download_qr_view(request, record_id):
     record = get_object_or_404(RTORecord, id=record_id, owner=request.user)
-    if not record.qr_code_image:
+    if not record.has_qr_code:
         # Generate QR code if it doesn't exist (FIXED: Using consistent domain)
-        netlify_url = f"https://teal-rugelach-4d0f54.netlify.app/record_{record.id}/"
+        netlify_url = get_gallery_url(record)
         generate_qr_code_for_record(record, netlify_url)
     return render(request, 'core/download_qr.html', {'record': record})
 
@@ -770,6 +416,92 @@ def order_cancel_view(request, order_id):
     messages.info(request, "Order cancellation requested.")
     return redirect('core:orders')
 
+@require_safe
+def record_gallery_view(request, record_id):
+    """Public document gallery for a paid record, built for CDN and browser caching.
+
+    The page is identified by a hash of its inputs and templates: that is the
+    strong ETag and the fragment cache key, so repeat scans revalidate with a
+    304 and a changed record is picked up on the next request.
+    """
+    published = (
+        Q(orders__payment_status=Order.Status.COMPLETED) | ~Q(qr_code_image='') | ~Q(qr_payload='')
+    )
+    record = get_object_or_404(RTORecord.objects.filter(published).distinct(), id=record_id)
+    cloudinary_urls = get_cloudinary_urls(record)
+    version = gallery_version(record, cloudinary_urls)
+    # No Last-Modified: updated_at misses template changes, so If-Modified-Since
+    # alone would keep revalidating stale pages; the strong ETag covers both
+    etag = f'"{version}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        html = cache.get_or_set(
+            f'gallery_html:{record.id}:{version}',
+            lambda: render_gallery_html(record, cloudinary_urls),
+            settings.GALLERY_FRAGMENT_CACHE_TIMEOUT,
+        )
+        response = HttpResponse(html)
+
+    response['ETag'] = etag
+    patch_cache_control(
+        response, public=True, max_age=settings.GALLERY_CACHE_MAX_AGE,
+        stale_while_revalidate=settings.GALLERY_CACHE_STALE_WHILE_REVALIDATE,
+    )
+    return response
+
+@login_required
+@require_safe
+def record_qr_view(request, record_id):
+    """A record's QR code, rendered on demand as PNG or SVG.
+
+    ``?format=png|svg`` wins over the Accept header; SVG is only picked from
+    Accept when the client does not take PNG. ``?size=`` is the wanted width
+    in pixels and ``?download=1`` serves it as an attachment. The ETag is the
+    content key of the payload and render options.
+    """
+    records = RTORecord.objects.all()
+    if not request.user.is_staff:
+        records = records.filter(owner=request.user)
+    record = get_object_or_404(records, id=record_id)
+    payload = get_qr_payload(record)
+    if not payload:
+        raise Http404("No QR code has been generated for this record")
+
+    fmt = request.GET.get('format')
+    if fmt is None:
+        if request.accepts(QR_FORMATS['png']):
+            fmt = 'png'
+        elif request.accepts(QR_FORMATS['svg']):
+            fmt = 'svg'
+        else:
+            return HttpResponse(status=406)
+    elif fmt not in QR_FORMATS:
+        return HttpResponseBadRequest(f"format must be one of {', '.join(QR_FORMATS)}")
+
+    box_size = None
+    if 'size' in request.GET:
+        try:
+            size = int(request.GET['size'])
+        except ValueError:
+            size = 0
+        if not 0 < size <= settings.QR_ENDPOINT_MAX_SIZE:
+            return HttpResponseBadRequest(f"size must be between 1 and {settings.QR_ENDPOINT_MAX_SIZE}")
+        box_size = qr_box_size_for(payload, size)
+
+    # Revalidations are answered from the key alone, without rendering
+    etag = f'"{render_qr_key(payload, fmt, box_size)}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        content, _ = render_qr(payload, fmt, box_size)
+        response = HttpResponse(content, content_type=QR_FORMATS[fmt])
+        if request.GET.get('download'):
+            response['Content-Disposition'] = f'attachment; filename="qr_code_{record.id}.{fmt}"'
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=settings.QR_ENDPOINT_MAX_AGE)
+    patch_vary_headers(response, ['Accept'])
+    return response
+
 @login_required
 def verify_record_view(request, record_id):
     record = get_object_or_404(RTORecord, id=record_id)
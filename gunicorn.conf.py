@@ -1,12 +1,14 @@
 # Gunicorn configuration file for production
 import multiprocessing
+import os
 
 # Server socket
 bind = "0.0.0.0:8000"
 backlog = 2048
 
-# Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
+# Worker processes. Each keeps one persistent database connection
+# (CONN_MAX_AGE), so this is also the size of the web tier's connection pool.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
 worker_class = "sync"
 worker_connections = 1000
 timeout = 30
@@ -37,3 +39,9 @@ tmp_upload_dir = None
 # SSL (if using HTTPS directly with gunicorn)
 # keyfile = "/path/to/keyfile"
 # certfile = "/path/to/certfile"
+
+
+def post_fork(server, worker):
+    # A connection opened while preloading must not be shared by the workers
+    from django.db import connections
+    connections.close_all()
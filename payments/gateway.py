@@ -0,0 +1,178 @@
+"""Shared Razorpay client for every payment call.
+
+``get_razorpay_client()`` returns one client per worker process. Its
+``requests`` session keeps HTTPS connections alive in a bounded pool, so
+only the first order a worker creates pays for the TLS handshake. Every
+request has connect and read timeouts and is retried with jittered
+exponential backoff:
+
+* connection failures and timeouts, and 5xx responses, for GET;
+* only failures where the request never reached Razorpay (connect errors,
+  503) for POST/PATCH/PUT/DELETE, so an order is never created twice.
+
+Each call is timed into ``gateway_metrics()`` and logged.
+``RAZORPAY_BASE_URL`` points the client elsewhere, e.g. at
+``payments.stub_gateway`` for offline tests and load tests.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import razorpay
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+# Statuses that mean the request was not processed, safe to resend even for POST
+NOT_PROCESSED_STATUSES = {503}
+
+_metrics_lock = threading.Lock()
+_metrics = defaultdict(lambda: {'calls': 0, 'errors': 0, 'retries': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+
+
+def _endpoint(method, url):
+    """``'POST /v1/orders'``, with ids collapsed so metrics group by route."""
+    parts = [
+        ':id' if any(ch.isdigit() for ch in part) and '_' in part else part
+        for part in urlsplit(url).path.split('/')
+    ]
+    return f"{method.upper()} {'/'.join(parts)}"
+
+
+def record_call(endpoint, elapsed_ms, error=False, retries=0):
+    with _metrics_lock:
+        stats = _metrics[endpoint]
+        stats['calls'] += 1
+        stats['errors'] += int(error)
+        stats['retries'] += retries
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+
+
+def gateway_metrics():
+    """Per-endpoint call counts and latencies for this process."""
+    with _metrics_lock:
+        return {
+            endpoint: {**stats, 'avg_ms': stats['total_ms'] / stats['calls'] if stats['calls'] else 0.0}
+            for endpoint, stats in _metrics.items()
+        }
+
+
+def reset_gateway_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def never_sent(exc):
+    """Whether a requests exception happened before the request went out."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for retry ``attempt`` (1-based)."""
+    cap = settings.RAZORPAY_RETRY_BACKOFF * 2 ** (attempt - 1)
+    return random.uniform(0, cap)
+
+
+class GatewaySession(requests.Session):
+    """Keep-alive session with default timeouts, retries and per-call metrics."""
+
+    def __init__(self, timeout, max_retries, pool_size):
+        super().__init__()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = _endpoint(method, url)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            try:
+                response = super().request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # A dropped connection or read timeout may come after Razorpay acted on it
+                retryable = idempotent or never_sent(e)
+                if not retryable or attempt >= self.max_retries:
+                    self._finish(endpoint, started, attempt, error=True)
+                    logger.warning("Razorpay %s failed after %d attempts: %s", endpoint, attempt + 1, e)
+                    raise
+            else:
+                retryable = response.status_code >= 500 and (
+                    idempotent or response.status_code in NOT_PROCESSED_STATUSES
+                )
+                if not retryable or attempt >= self.max_retries:
+                    self._finish(endpoint, started, attempt, error=response.status_code >= 500)
+                    return response
+                response.close()
+            attempt += 1
+            time.sleep(backoff_delay(attempt))
+
+    def _finish(self, endpoint, started, retries, error):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        record_call(endpoint, elapsed_ms, error=error, retries=retries)
+        logger.info("Razorpay %s took %.1f ms (%d retries)", endpoint, elapsed_ms, retries)
+
+
+class GatewayClient(razorpay.Client):
+    """``razorpay.Client`` on a ``GatewaySession``."""
+
+    _version = None
+
+    def _get_version(self):
+        # The SDK asks pkg_resources for its own version on every request
+        if GatewayClient._version is None:
+            GatewayClient._version = super()._get_version()
+        return GatewayClient._version
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def build_razorpay_client(base_url=None):
+    session = GatewaySession(
+        timeout=(settings.RAZORPAY_CONNECT_TIMEOUT, settings.RAZORPAY_READ_TIMEOUT),
+        max_retries=settings.RAZORPAY_MAX_RETRIES,
+        pool_size=settings.RAZORPAY_POOL_SIZE,
+    )
+    return GatewayClient(
+        session=session,
+        auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET),
+        base_url=base_url or settings.RAZORPAY_BASE_URL,
+    )
+
+
+def get_razorpay_client():
+    """The worker's shared client, rebuilt after a fork so no sockets are shared."""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client, _client_pid = build_razorpay_client(), os.getpid()
+    return _client
+
+
+def reset_razorpay_client():
+    """Drop the shared client, e.g. after changing RAZORPAY_* settings in tests."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.session.close()
+        _client = None
@@ -0,0 +1,82 @@
+"""Bring orders in line with the payments Razorpay received.
+
+Usage:
+    python manage.py reconcile_payments                       # the last day
+    python manage.py reconcile_payments --since 2024-06-01 --until 2024-07-01 --report diff.csv
+    python manage.py reconcile_payments --hours 6 --dry-run
+
+Orders paid at the gateway but still pending here are completed (and get the
+post-payment pipeline), failed attempts fail pending orders, and missing
+payment transactions are recorded. Every status change is printed, or
+written to ``--report`` as CSV.
+"""
+import csv
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from payments.reconcile import reconcile_payments
+
+REPORT_FIELDS = ['order_id', 'payment_id', 'gateway_status', 'before', 'after']
+
+
+def _moment(value):
+    parsed = parse_datetime(value)
+    if parsed is None and parse_date(value):
+        parsed = datetime.combine(parse_date(value), time.min)
+    if parsed is None:
+        raise CommandError(f"Invalid date {value!r}, expected YYYY-MM-DD or an ISO datetime")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+class Command(BaseCommand):
+    help = "Reconcile orders and payment transactions with Razorpay"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Start of the window (default: --hours ago)")
+        parser.add_argument('--until', help="End of the window (default: now)")
+        parser.add_argument('--hours', type=int, default=24)
+        parser.add_argument('--chunk-size', type=int, default=500, help="Gateway records per database batch")
+        parser.add_argument('--report', help="Write the changes to this CSV file")
+        parser.add_argument('--dry-run', action='store_true', help="Report the changes without saving them")
+
+    def handle(self, *args, **options):
+        until = _moment(options['until']) if options['until'] else timezone.now()
+        since = _moment(options['since']) if options['since'] else until - timedelta(hours=options['hours'])
+        if since >= until:
+            raise CommandError("--since must be before --until")
+
+        report_file = open(options['report'], 'w', newline='') if options['report'] else None
+        try:
+            if report_file:
+                writer = csv.DictWriter(report_file, REPORT_FIELDS)
+                writer.writeheader()
+                report = writer.writerow
+            else:
+                report = self.write_change
+            stats = reconcile_payments(
+                since, until, chunk_size=options['chunk_size'], dry_run=options['dry_run'], report=report,
+            )
+        finally:
+            if report_file:
+                report_file.close()
+
+        prefix = "Would change" if options['dry_run'] else "Changed"
+        changed = sum(count for key, count in stats.items() if key in ('completed', 'failed', 'refunded'))
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix} {changed} orders from {stats['payments']} payments and {stats['paid_orders']} paid orders"
+        ))
+        for key in sorted(stats):
+            if key not in ('payments', 'paid_orders'):
+                self.stdout.write(f"  {key}: {stats[key]}")
+
+    def write_change(self, change):
+        if change['before'] is None:
+            self.stdout.write(f"? {change['payment_id']} ({change['gateway_status']}) for unknown order {change['order_id']}")
+        else:
+            self.stdout.write(
+                f"{change['order_id']}: {change['before']} -> {change['after']} "
+                f"({change['payment_id']} {change['gateway_status']})"
+            )
@@ -0,0 +1,62 @@
+"""Reprocess stored Razorpay webhook events.
+
+Usage:
+    python manage.py replay_webhook_events                      # pending events only
+    python manage.py replay_webhook_events --all --since 2024-06-01
+    python manage.py replay_webhook_events --event-id evt_1 --event-id evt_2
+    python manage.py replay_webhook_events --event-type payment.failed --dry-run
+
+Selected events are marked unprocessed and run through the same batched
+processing as live webhooks, oldest first. Processing is idempotent, so a
+replay only changes orders whose stored state disagrees with the events.
+"""
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from payments.models import WebhookEvent
+from payments.webhooks import EVENT_TYPES, process_webhook_events
+
+
+def _date(value):
+    try:
+        return timezone.make_aware(datetime.combine(datetime.strptime(value, '%Y-%m-%d').date(), time.min))
+    except ValueError:
+        raise CommandError(f"Invalid date {value!r}, expected YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = "Reprocess stored Razorpay webhook events"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event-id', action='append', dest='event_ids', help="Replay this event (repeatable)")
+        parser.add_argument('--event-type', choices=sorted(EVENT_TYPES), help="Razorpay event name")
+        parser.add_argument('--since', help="Received on or after this date (YYYY-MM-DD)")
+        parser.add_argument('--until', help="Received before this date (YYYY-MM-DD)")
+        parser.add_argument('--all', action='store_true', help="Include events that were already processed")
+        parser.add_argument('--batch-size', type=int, default=settings.WEBHOOK_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help="Only count the selected events")
+
+    def handle(self, *args, **options):
+        events = WebhookEvent.objects.filter(provider='razorpay')
+        if options['event_ids']:
+            events = events.filter(event_id__in=options['event_ids'])
+        if options['event_type']:
+            events = events.filter(raw_data__event=options['event_type'])
+        if options['since']:
+            events = events.filter(received_at__gte=_date(options['since']))
+        if options['until']:
+            events = events.filter(received_at__lt=_date(options['until']))
+        if not (options['all'] or options['event_ids']):
+            events = events.filter(processed=False)
+
+        count = events.count()
+        if options['dry_run'] or not count:
+            self.stdout.write(f"{count} webhook events selected")
+            return
+
+        events.filter(processed=True).update(processed=False, processed_at=None)
+        processed = process_webhook_events(events, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Replayed {processed} webhook events"))
@@ -0,0 +1,30 @@
+"""Run the in-process Razorpay stub as a standalone server.
+
+Usage:
+    python manage.py run_razorpay_stub --port 8765
+    RAZORPAY_BASE_URL=http://127.0.0.1:8765 python manage.py runserver
+
+Keys default to RAZORPAY_KEY_ID / RAZORPAY_KEY_SECRET, so the app's
+signature checks pass against payments made with the stub.
+"""
+from django.core.management.base import BaseCommand
+
+from payments.stub_gateway import RazorpayStub
+
+
+class Command(BaseCommand):
+    help = "Serve a local Razorpay API stub for offline payment testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+
+    def handle(self, *args, **options):
+        stub = RazorpayStub(port=options['port'], latency=options['latency'])
+        self.stdout.write(self.style.SUCCESS(f"Razorpay stub listening on {stub.base_url}"))
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stub.stop()
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-17 00:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['processed', 'received_at'], name='webhook_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 00:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_order_reuse_idx'),
+        ('payments', '0002_webhook_pending_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymenttransaction',
+            index=models.Index(fields=['provider_payment_id'], name='txn_provider_payment_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.7 on 2026-10-17 00:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_order_rollups'),
+        ('payments', '0003_txn_provider_payment_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyTransactionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('order_type', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('success', 'Success'), ('failed', 'Failed'), ('cancelled', 'Cancelled'), ('refunded', 'Refunded'), ('partially_refunded', 'Partially Refunded')], max_length=20)),
+                ('provider', models.CharField(choices=[('razorpay', 'Razorpay'), ('stripe', 'Stripe')], max_length=20)),
+                ('transactions', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('refunded', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'db_table': 'daily_transaction_rollup',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='paymenttransaction',
+            index=models.Index(fields=['updated_at'], name='txn_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymenttransaction',
+            index=models.Index(fields=['created_at'], name='txn_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailytransactionrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'order_type', 'status', 'provider'), name='daily_transaction_rollup_key'),
+        ),
+    ]
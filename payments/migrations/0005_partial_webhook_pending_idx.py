@@ -0,0 +1,21 @@
+# Generated by Django 5.0.7 on 2026-10-17 00:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_transaction_rollups'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='webhookevent',
+            name='webhook_pending_idx',
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(condition=models.Q(('processed', False)), fields=['received_at'], name='webhook_pending_idx'),
+        ),
+    ]
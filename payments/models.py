@@ -1,8 +1,13 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 import uuid
 
+from core.models import RollupDirtyDay
+from core.utils.change_tracking import ChangeTrackingMixin
+
 User = get_user_model()
 
 class PaymentGateway(models.Model):
@@ -33,7 +38,7 @@ class PaymentGateway(models.Model):
         return f"{self.get_provider_display()} ({mode})"
 
 
-class PaymentTransaction(models.Model):
+class PaymentTransaction(ChangeTrackingMixin, models.Model):
     """Track individual payment transactions with detailed information."""
     
     class Status(models.TextChoices):
@@ -82,6 +87,13 @@ class PaymentTransaction(models.Model):
         verbose_name = 'Payment Transaction'
         verbose_name_plural = 'Payment Transactions'
         ordering = ['-created_at']
+        indexes = [
+            # Webhook and reconciliation lookups by gateway payment
+            models.Index(fields=['provider_payment_id'], name='txn_provider_payment_idx'),
+            # Analytics rollups (core.utils.rollups)
+            models.Index(fields=['updated_at'], name='txn_updated_idx'),
+            models.Index(fields=['created_at'], name='txn_created_idx'),
+        ]
     
     def __str__(self):
         return f"Transaction {self.transaction_id} - {self.gateway.provider} - ₹{self.amount}"
@@ -139,6 +151,12 @@ class WebhookEvent(models.Model):
         verbose_name = 'Webhook Event'
         verbose_name_plural = 'Webhook Events'
         ordering = ['-received_at']
+        indexes = [
+            # The processing backlog (payments.webhooks). Partial, because Django
+            # filters processed=False as NOT "processed", which a (processed, ...)
+            # index can't serve; this one matches it and holds only pending rows.
+            models.Index(fields=['received_at'], condition=models.Q(processed=False), name='webhook_pending_idx'),
+        ]
     
     def __str__(self):
         return f"{self.provider} - {self.event_type} - {self.event_id}"
@@ -150,3 +168,29 @@ class WebhookEvent(models.Model):
         if result:
             self.processing_result = result
         self.save(update_fields=['processed', 'processed_at', 'processing_result'])
+
+
+class DailyTransactionRollup(models.Model):
+    """Payment transactions created on a day, by order type, status and gateway."""
+    
+    day = models.DateField()
+    order_type = models.CharField(max_length=20)
+    status = models.CharField(max_length=20, choices=PaymentTransaction.Status.choices)
+    provider = models.CharField(max_length=20, choices=PaymentGateway.Provider.choices)
+    transactions = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    refunded = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    class Meta:
+        db_table = 'daily_transaction_rollup'
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['day', 'order_type', 'status', 'provider'], name='daily_transaction_rollup_key'
+            ),
+        ]
+
+
+@receiver(post_delete, sender=PaymentTransaction)
+def mark_transaction_rollup_dirty(sender, instance, **kwargs):
+    RollupDirtyDay.mark('transactions', instance.created_at)
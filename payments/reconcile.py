@@ -0,0 +1,134 @@
+"""Reconcile local orders with the payments Razorpay actually received.
+
+A customer who closes the tab after paying never reaches ``verify_payment``,
+and a webhook can be lost, so ``reconcile_payments`` asks the gateway
+directly. For a time window it
+
+1. pages through every payment (100 per request, with ``to`` pinned so
+   payments made meanwhile don't shift the pages) and applies captured,
+   failed and refunded ones through the same ``PaymentBatch`` as webhook
+   processing. Only captured payments complete an order: a refunded one
+   settles its transaction, and an order it never completed is left alone
+   and reported as ``refunded_unfulfilled``;
+2. pages through the orders Razorpay marks ``paid`` and fetches the payments
+   of those still not complete locally, which catches orders created in the
+   window but paid after it.
+
+Work happens in chunks: one chunk of gateway records, one query for its
+orders and one for its transactions, then ``bulk_update`` in a transaction.
+Memory stays bounded by the chunk size however long the window is. Every
+status change is passed to ``report`` as it is made, and newly completed
+orders get the post-payment pipeline.
+"""
+import logging
+from collections import Counter
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import Order
+
+from .gateway import get_razorpay_client
+from .webhooks import PaymentBatch
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_PAGE_SIZE = 100  # Razorpay's maximum ``count``
+
+
+def gateway_items(fetch, since, until):
+    """Every item of a Razorpay collection endpoint created in ``[since, until]`` (unix times)."""
+    skip = 0
+    while True:
+        items = fetch({'from': since, 'to': until, 'count': GATEWAY_PAGE_SIZE, 'skip': skip})['items']
+        yield from items
+        if len(items) < GATEWAY_PAGE_SIZE:
+            return
+        skip += len(items)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def reconcile_chunk(payments, stats, report, dry_run=False):
+    """Apply one chunk of gateway payments to the orders they belong to."""
+    now = timezone.now()
+    with transaction.atomic():
+        batch = PaymentBatch(payments=payments)
+        for payment in payments:
+            order = batch.orders.get(payment.get('order_id'))
+            if order is None:
+                stats['unknown_order'] += 1
+                report({'order_id': payment.get('order_id'), 'payment_id': payment['id'],
+                        'gateway_status': payment['status'], 'before': None, 'after': None})
+                continue
+
+            before = order.payment_status
+            if payment['status'] == 'captured':
+                batch.paid(payment, now)
+            elif payment['status'] == 'failed':
+                batch.failed(payment, now)
+            elif payment['status'] == 'refunded':
+                batch.refunded_payment(payment, now)
+                if order.payment_status != Order.Status.REFUNDED:
+                    # The money went back before the order completed: never fulfil it
+                    stats['refunded_unfulfilled'] += 1
+                    report({'order_id': order.order_id, 'payment_id': payment['id'],
+                            'gateway_status': payment['status'], 'before': before, 'after': order.payment_status})
+                    continue
+            else:
+                # created/authorized: the customer hasn't finished paying yet
+                stats[f"gateway_{payment['status']}"] += 1
+                continue
+
+            if order.payment_status == before:
+                stats['unchanged'] += 1
+            else:
+                stats[order.payment_status] += 1
+                report({'order_id': order.order_id, 'payment_id': payment['id'],
+                        'gateway_status': payment['status'], 'before': before, 'after': order.payment_status})
+
+        stats['transactions_created'] += len(batch.new_transactions)
+        if not dry_run:
+            batch.save(now)
+
+
+def reconcile_payments(since, until=None, chunk_size=500, dry_run=False, report=None, client=None):
+    """Reconcile gateway payments and orders created between ``since`` and ``until``.
+
+    Returns a ``Counter`` of outcomes: the new order statuses, ``unchanged``,
+    ``unknown_order``, ``refunded_unfulfilled``, ``gateway_<status>`` for payments still in progress
+    and ``transactions_created``.
+    """
+    client = client or get_razorpay_client()
+    until = until or timezone.now()
+    window = (int(since.timestamp()), int(until.timestamp()))
+    report = report or (lambda change: None)
+    stats = Counter()
+
+    for payments in chunked(gateway_items(client.payment.all, *window), chunk_size):
+        reconcile_chunk(payments, stats, report, dry_run)
+        stats['payments'] += len(payments)
+
+    paid_orders = (order for order in gateway_items(client.order.all, *window) if order['status'] == 'paid')
+    for orders in chunked(paid_orders, chunk_size):
+        stats['paid_orders'] += len(orders)
+        incomplete = Order.objects.filter(order_id__in=[order['id'] for order in orders]).exclude(
+            payment_status__in=[Order.Status.COMPLETED, Order.Status.REFUNDED]
+        ).values_list('order_id', flat=True)
+        # Payments inside the window were applied above (or, in a dry run, reported)
+        late_payments = [
+            payment
+            for order_id in incomplete
+            for payment in client.order.payments(order_id)['items']
+            if not window[0] <= payment['created_at'] <= window[1]
+        ]
+        if late_payments:
+            reconcile_chunk(late_payments, stats, report, dry_run)
+
+    logger.info("Reconciled payments from %s to %s: %s", since, until, dict(stats))
+    return stats
@@ -0,0 +1,301 @@
+"""In-process Razorpay API stub for offline integration and load tests.
+
+Serves the part of the Razorpay REST API the app uses (orders, payments,
+capture) from memory on a local port, with HTTP/1.1 keep-alive like the real
+API. Point ``RAZORPAY_BASE_URL`` at ``stub.base_url`` and the regular
+``payments.gateway`` client talks to it::
+
+    with RazorpayStub() as stub, override_settings(RAZORPAY_BASE_URL=stub.base_url):
+        order = get_razorpay_client().order.create({'amount': 200, 'currency': 'INR'})
+        checkout = stub.pay(order['id'])  # what Razorpay Checkout posts back
+
+``fail_next()`` injects 5xx responses and ``latency`` adds a fixed delay, to
+exercise retries and timeouts. ``webhook()`` builds the signed request
+Razorpay would send to ``payments:razorpay_webhook`` for a payment or refund. ``python manage.py run_razorpay_stub`` runs
+it standalone.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import re
+import secrets
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+
+
+def _razorpay_id(prefix):
+    return f"{prefix}_{secrets.token_hex(7)}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    ROUTES = [
+        ('POST', re.compile(r'^/v1/orders$'), 'create_order'),
+        ('GET', re.compile(r'^/v1/orders$'), 'list_orders'),
+        ('GET', re.compile(r'^/v1/orders/(?P<order_id>[\w-]+)$'), 'fetch_order'),
+        ('GET', re.compile(r'^/v1/orders/(?P<order_id>[\w-]+)/payments$'), 'order_payments'),
+        ('GET', re.compile(r'^/v1/payments$'), 'list_payments'),
+        ('GET', re.compile(r'^/v1/payments/(?P<payment_id>[\w-]+)$'), 'fetch_payment'),
+        ('POST', re.compile(r'^/v1/payments/(?P<payment_id>[\w-]+)/capture$'), 'capture_payment'),
+    ]
+
+    def setup(self):
+        super().setup()
+        # Headers and body are separate writes; don't let Nagle hold the body back
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.stub._count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        stub = self.server.stub
+        stub._count('requests')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        status = stub._take_failure()
+        if status:
+            return self._send(status, {'error': {'code': 'SERVER_ERROR', 'description': 'Injected failure'}})
+        if not self._authorized(stub):
+            return self._send(401, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'Authentication failed'}})
+
+        url = urlsplit(self.path)
+        for route_method, pattern, name in self.ROUTES:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                data = json.loads(body) if body else {}
+                query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                status, payload = getattr(stub, name)(data=data, query=query, **match.groupdict())
+                return self._send(status, payload)
+        return self._send(404, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': 'No such endpoint'}})
+
+    def _authorized(self, stub):
+        header = self.headers.get('Authorization', '')
+        expected = base64.b64encode(f'{stub.key_id}:{stub.key_secret}'.encode()).decode()
+        return hmac.compare_digest(header, f'Basic {expected}')
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (e.g. a read timeout under test)
+            self.close_connection = True
+
+
+def _not_found(kind):
+    return 400, {'error': {'code': 'BAD_REQUEST_ERROR', 'description': f'The id provided does not exist ({kind})'}}
+
+
+def _collection(entities, query):
+    """A page of ``entities``, newest first, filtered like Razorpay's list endpoints."""
+    items = sorted(entities, key=lambda e: e['created_at'], reverse=True)
+    if 'from' in query:
+        items = [e for e in items if e['created_at'] >= int(query['from'])]
+    if 'to' in query:
+        items = [e for e in items if e['created_at'] <= int(query['to'])]
+    skip = int(query.get('skip', 0))
+    items = items[skip:skip + min(int(query.get('count', 10)), 100)]
+    return {'entity': 'collection', 'count': len(items), 'items': items}
+
+
+class RazorpayStub:
+    """A Razorpay API on ``127.0.0.1``, backed by dicts."""
+
+    def __init__(self, key_id=None, key_secret=None, port=0, latency=0.0, webhook_secret=None):
+        self.key_id = key_id or settings.RAZORPAY_KEY_ID
+        self.key_secret = key_secret or settings.RAZORPAY_KEY_SECRET
+        self.webhook_secret = webhook_secret or settings.RAZORPAY_WEBHOOK_SECRET
+        self.latency = latency
+        self.orders = {}
+        self.payments = {}
+        self.refunds = {}
+        self.stats = {'connections': 0, 'requests': 0}
+        self._failures = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def fail_next(self, count=1, status=503):
+        """Answer the next ``count`` requests with ``status``."""
+        with self._lock:
+            self._failures.extend([status] * count)
+
+    def _take_failure(self):
+        with self._lock:
+            return self._failures.pop(0) if self._failures else None
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    # Checkout: what happens in the browser between order and verification
+
+    def pay(self, order_id, method='upi', captured=True):
+        """Pay an order as Razorpay Checkout would; returns the fields it posts back."""
+        with self._lock:
+            order = self.orders[order_id]
+            payment = self._new_payment(order, method, 'captured' if captured else 'authorized')
+            order['status'] = 'paid'
+            order['amount_paid'] = order['amount']
+            order['amount_due'] = 0
+        return {
+            'razorpay_order_id': order_id,
+            'razorpay_payment_id': payment['id'],
+            'razorpay_signature': self.signature(order_id, payment['id']),
+        }
+
+    def fail_payment(self, order_id, method='card', reason='Payment was declined by the bank'):
+        """A failed checkout attempt; returns the payment id."""
+        with self._lock:
+            payment = self._new_payment(self.orders[order_id], method, 'failed')
+            payment['error_description'] = reason
+        return payment['id']
+
+    def refund(self, payment_id, amount=None):
+        """Refund ``amount`` paise (all of it by default); returns the refund id."""
+        with self._lock:
+            payment = self.payments[payment_id]
+            refund = {
+                'id': _razorpay_id('rfnd'), 'entity': 'refund', 'payment_id': payment_id,
+                'amount': payment['amount'] if amount is None else amount, 'currency': payment['currency'],
+                'status': 'processed', 'created_at': int(time.time()),
+            }
+            self.refunds[refund['id']] = refund
+            payment['amount_refunded'] = payment.get('amount_refunded', 0) + refund['amount']
+            if payment['amount_refunded'] >= payment['amount']:
+                payment['status'] = 'refunded'
+        return refund['id']
+
+    def _new_payment(self, order, method, status):
+        payment = {
+            'id': _razorpay_id('pay'), 'entity': 'payment', 'amount': order['amount'],
+            'currency': order['currency'], 'status': status, 'order_id': order['id'],
+            'method': method, 'captured': status == 'captured', 'created_at': int(time.time()),
+        }
+        self.payments[payment['id']] = payment
+        order['attempts'] += 1
+        return payment
+
+    def webhook(self, event, entity_id):
+        """Body and headers of the webhook Razorpay sends for ``event``.
+
+        ``entity_id`` is a payment id, or a refund id for ``refund.*`` events.
+        """
+        with self._lock:
+            if event.startswith('refund.'):
+                refund = self.refunds[entity_id]
+                payload = {'refund': {'entity': refund}, 'payment': {'entity': self.payments[refund['payment_id']]}}
+            else:
+                payment = self.payments[entity_id]
+                payload = {'payment': {'entity': payment}}
+                if event.startswith('order.'):
+                    payload['order'] = {'entity': self.orders[payment['order_id']]}
+            body = json.dumps({
+                'entity': 'event', 'account_id': 'acc_stub', 'event': event,
+                'contains': list(payload), 'payload': payload, 'created_at': int(time.time()),
+            }).encode()
+        signature = hmac.new(self.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+        return body, {'X-Razorpay-Signature': signature, 'X-Razorpay-Event-Id': _razorpay_id('evt')}
+
+    def signature(self, order_id, payment_id):
+        return hmac.new(
+            self.key_secret.encode(), f'{order_id}|{payment_id}'.encode(), hashlib.sha256
+        ).hexdigest()
+
+    # API endpoints
+
+    def create_order(self, data, query):
+        if not isinstance(data.get('amount'), int) or data['amount'] < 100:
+            return 400, {'error': {'code': 'BAD_REQUEST_ERROR',
+                                   'description': 'The amount must be atleast INR 1.00'}}
+        order = {
+            'id': _razorpay_id('order'), 'entity': 'order', 'amount': data['amount'],
+            'amount_paid': 0, 'amount_due': data['amount'], 'currency': data.get('currency', 'INR'),
+            'receipt': data.get('receipt'), 'status': 'created', 'attempts': 0,
+            'notes': data.get('notes') or [], 'created_at': int(time.time()),
+        }
+        with self._lock:
+            self.orders[order['id']] = order
+        return 200, order
+
+    def fetch_order(self, data, query, order_id):
+        order = self.orders.get(order_id)
+        return (200, order) if order else _not_found('order')
+
+    def order_payments(self, data, query, order_id):
+        if order_id not in self.orders:
+            return _not_found('order')
+        with self._lock:
+            items = [p for p in self.payments.values() if p['order_id'] == order_id]
+        return 200, {'entity': 'collection', 'count': len(items), 'items': items}
+
+    def list_orders(self, data, query):
+        with self._lock:
+            orders = list(self.orders.values())
+        return 200, _collection(orders, query)
+
+    def list_payments(self, data, query):
+        with self._lock:
+            payments = list(self.payments.values())
+        return 200, _collection(payments, query)
+
+    def fetch_payment(self, data, query, payment_id):
+        payment = self.payments.get(payment_id)
+        return (200, payment) if payment else _not_found('payment')
+
+    def capture_payment(self, data, query, payment_id):
+        with self._lock:
+            payment = self.payments.get(payment_id)
+            if not payment:
+                return _not_found('payment')
+            if payment['status'] != 'authorized' or data.get('amount') != payment['amount']:
+                return 400, {'error': {'code': 'BAD_REQUEST_ERROR',
+                                       'description': 'This payment can not be captured'}}
+            payment.update(status='captured', captured=True)
+        return 200, payment
@@ -1,3 +1,396 @@
-from django.test import TestCase
+import csv
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import requests
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from razorpay.errors import ServerError
+
+from core.models import Order, PrintOrder, RTORecord
+from core.utils.order_utils import get_or_create_gateway_order
+
+from .models import PaymentGateway, PaymentTransaction, WebhookEvent
+from .gateway import gateway_metrics, get_razorpay_client, reset_gateway_metrics, reset_razorpay_client
+from .reconcile import reconcile_payments
+from .stub_gateway import RazorpayStub
+from .webhooks import PROCESS_SCHEDULED_KEY, process_webhook_events
+
+User = get_user_model()
+
+
+class RazorpayGatewayTests(TestCase):
+    """The shared client pools connections and retries only what is safe to resend."""
+
+    def setUp(self):
+        self.stub = RazorpayStub().start()
+        self.addCleanup(self.stub.stop)
+        overrides = override_settings(RAZORPAY_BASE_URL=self.stub.base_url, RAZORPAY_RETRY_BACKOFF=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        reset_razorpay_client()
+        self.addCleanup(reset_razorpay_client)
+        reset_gateway_metrics()
+
+    def test_one_keep_alive_connection_per_worker(self):
+        for i in range(5):
+            order = get_razorpay_client().order.create({'amount': 200, 'currency': 'INR', 'receipt': f'r{i}'})
+            self.assertEqual(self.stub.orders[order['id']]['amount'], 200)
+
+        self.assertIs(get_razorpay_client(), get_razorpay_client())
+        self.assertEqual(self.stub.stats['connections'], 1)
+        stats = gateway_metrics()['POST /v1/orders']
+        self.assertEqual((stats['calls'], stats['errors'], stats['retries']), (5, 0, 0))
+
+    def test_unavailable_is_retried_for_orders(self):
+        self.stub.fail_next(2, status=503)
+        order = get_razorpay_client().order.create({'amount': 200, 'currency': 'INR'})
+
+        self.assertEqual(len(self.stub.orders), 1)
+        self.assertIn(order['id'], self.stub.orders)
+        self.assertEqual(gateway_metrics()['POST /v1/orders']['retries'], 2)
+
+    def test_server_errors_are_retried_for_reads_only(self):
+        order = get_razorpay_client().order.create({'amount': 200, 'currency': 'INR'})
+
+        self.stub.fail_next(1, status=500)
+        self.assertEqual(get_razorpay_client().order.fetch(order['id'])['id'], order['id'])
+        self.assertEqual(gateway_metrics()['GET /v1/orders/:id']['retries'], 1)
+
+        self.stub.fail_next(1, status=500)
+        with self.assertRaises(ServerError):
+            get_razorpay_client().order.create({'amount': 200, 'currency': 'INR'})
+        self.assertEqual(len(self.stub.orders), 1)
+
+    @override_settings(RAZORPAY_READ_TIMEOUT=0.05)
+    def test_read_timeout_is_bounded_and_not_resent(self):
+        reset_razorpay_client()
+        self.stub.latency = 0.3
+
+        with self.assertRaises(requests.ReadTimeout):
+            get_razorpay_client().order.create({'amount': 200, 'currency': 'INR'})
+        self.assertEqual(self.stub.stats['requests'], 1)
+        self.assertEqual(gateway_metrics()['POST /v1/orders']['errors'], 1)
+
+    def test_api_payment_flow_against_the_stub(self):
+        user = User.objects.create_user(username='owner', email='owner@example.com', password='pass1234')
+        record = RTORecord.objects.create(
+            owner=user, name='Asha', contact_no='9999999999', address='12 MG Road', record_type='rto',
+        )
+        self.client.force_login(user)
+
+        created = self.client.post(reverse('payments-create-razorpay-order'), {
+            'amount': '100.00', 'order_type': Order.OrderType.PVC_CARD, 'record_id': str(record.id),
+        })
+        self.assertEqual(created.status_code, 200, created.content)
+        checkout = self.stub.pay(created.json()['order_id'])
+
+        verified = self.client.post(reverse('payments-verify-payment'), {
+            'order_id': checkout['razorpay_order_id'],
+            'payment_id': checkout['razorpay_payment_id'],
+            'signature': checkout['razorpay_signature'],
+        })
+        self.assertEqual(verified.status_code, 200, verified.content)
+        order = Order.objects.get(order_id=checkout['razorpay_order_id'])
+        self.assertEqual(order.payment_status, Order.Status.COMPLETED)
+        self.assertTrue(PrintOrder.objects.filter(order=order).exists())
+
+
+class OrderReuseTests(TestCase):
+    """Reloading the payment page hands back the pending order instead of creating one."""
+
+    def setUp(self):
+        self.stub = RazorpayStub().start()
+        self.addCleanup(self.stub.stop)
+        overrides = override_settings(RAZORPAY_BASE_URL=self.stub.base_url, RAZORPAY_RETRY_BACKOFF=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        reset_razorpay_client()
+        self.addCleanup(reset_razorpay_client)
+
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass1234')
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999', address='12 MG Road', record_type='rto',
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('core:payment', kwargs={'record_id': self.record.id, 'order_type': 'qr_download'})
+
+    def test_reload_reuses_pending_order(self):
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+
+        self.assertEqual(len(self.stub.orders), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(first.context['order'].pk, second.context['order'].pk)
+        self.assertIn(Order.objects.get().order_id, second.context['razorpay_order'])
+
+    def test_expired_or_paid_orders_are_not_reused(self):
+        order, created = get_or_create_gateway_order(self.user, self.record, 'qr_download', 2)
+        self.assertTrue(created)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        self.assertTrue(get_or_create_gateway_order(self.user, self.record, 'qr_download', 2)[1])
+
+        Order.objects.update(payment_status=Order.Status.COMPLETED)
+        self.assertTrue(get_or_create_gateway_order(self.user, self.record, 'qr_download', 2)[1])
+        self.assertFalse(get_or_create_gateway_order(self.user, self.record, 'qr_download', 2)[1])
+        # A different price is a different order
+        self.assertTrue(get_or_create_gateway_order(self.user, self.record, 'qr_download', 3)[1])
+        self.assertEqual(len(self.stub.orders), 4)
+
+    def test_api_reuses_order_and_updates_delivery_details(self):
+        url = reverse('payments-create-razorpay-order')
+        data = {'amount': '100.00', 'order_type': Order.OrderType.PVC_CARD, 'record_id': str(self.record.id)}
+        first = self.client.post(url, data)
+        second = self.client.post(url, {**data, 'delivery_pincode': '560001'})
+
+        self.assertEqual(first.json()['order_id'], second.json()['order_id'])
+        self.assertEqual(second.json()['amount'], 10000)
+        self.assertEqual(len(self.stub.orders), 1)
+        self.assertEqual(Order.objects.get().delivery_pincode, '560001')
+
+
+@override_settings(RAZORPAY_WEBHOOK_SECRET='whsec_test', RAZORPAY_RETRY_BACKOFF=0)
+class RazorpayWebhookTests(TestCase):
+    """Webhooks are stored once, acknowledged, and applied to orders in batches."""
+
+    def setUp(self):
+        self.stub = RazorpayStub().start()
+        self.addCleanup(self.stub.stop)
+        overrides = override_settings(RAZORPAY_BASE_URL=self.stub.base_url)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        reset_razorpay_client()
+        self.addCleanup(reset_razorpay_client)
+        self.addCleanup(cache.delete, PROCESS_SCHEDULED_KEY)
+
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass1234')
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999', address='12 MG Road', record_type='rto',
+        )
+        self.url = reverse('payments:razorpay_webhook')
+
+    def new_order(self, order_type=Order.OrderType.PVC_CARD, amount=100):
+        order, _created = get_or_create_gateway_order(self.user, self.record, order_type, amount)
+        # Distinct amounts keep later orders from reusing this one
+        Order.objects.filter(pk=order.pk).update(payment_status=Order.Status.PROCESSING)
+        return order
+
+    def send(self, event, entity_id):
+        body, headers = self.stub.webhook(event, entity_id)
+        return self.client.post(self.url, body, content_type='application/json', headers=headers)
+
+    def test_captured_payment_completes_order_once(self):
+        order = self.new_order()
+        payment_id = self.stub.pay(order.order_id)['razorpay_payment_id']
+        body, headers = self.stub.webhook('payment.captured', payment_id)
+
+        for _ in range(2):  # Razorpay redelivers until it sees a 2xx
+            response = self.client.post(self.url, body, content_type='application/json', headers=headers)
+            self.assertEqual(response.status_code, 200)
+
+        event = WebhookEvent.objects.get()
+        self.assertTrue(event.processed)
+        self.assertEqual(event.event_type, WebhookEvent.EventType.PAYMENT_SUCCESS)
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, Order.Status.COMPLETED)
+        self.assertEqual(order.payment_provider_payment_id, payment_id)
+        txn = PaymentTransaction.objects.get()
+        self.assertEqual((txn.order_id, txn.status, event.transaction_id), (order.pk, 'success', txn.pk))
+        self.assertTrue(PrintOrder.objects.filter(order=order).exists())
+
+    def test_rejects_bad_signatures_and_bodies(self):
+        body, headers = self.stub.webhook('payment.captured', self.stub.fail_payment(self.new_order().order_id))
+        forged = {**headers, 'X-Razorpay-Signature': '0' * 64}
+        self.assertEqual(self.client.post(self.url, body, content_type='application/json', headers=forged).status_code, 403)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+        with override_settings(RAZORPAY_WEBHOOK_SECRET=''):
+            self.assertEqual(
+                self.client.post(self.url, body, content_type='application/json', headers=headers).status_code, 403
+            )
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_batch_uses_a_fixed_number_of_queries(self):
+        PaymentGateway.objects.create(provider='razorpay')
+        cache.add(PROCESS_SCHEDULED_KEY, True)  # hold processing back, as within a batch window
+        orders = [self.new_order(amount=100 + i) for i in range(20)]
+
+        def process(batch):
+            for order in batch:
+                self.assertEqual(self.send('payment.failed', self.stub.fail_payment(order.order_id)).status_code, 200)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(process_webhook_events(), len(batch))
+            return len(queries)
+
+        self.assertEqual(process(orders[:2]), process(orders[2:]))
+        self.assertEqual(Order.objects.filter(payment_status=Order.Status.FAILED).count(), 20)
+        self.assertEqual(PaymentTransaction.objects.filter(status='failed').count(), 20)
+
+    def test_late_failure_does_not_undo_a_capture(self):
+        order = self.new_order()
+        payment_id = self.stub.pay(order.order_id)['razorpay_payment_id']
+        self.send('payment.captured', payment_id)
+        self.send('payment.failed', payment_id)
+
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, Order.Status.COMPLETED)
+        self.assertEqual(PaymentTransaction.objects.get().status, 'success')
+
+    def test_refunds_and_replays_are_idempotent(self):
+        order = self.new_order()
+        payment_id = self.stub.pay(order.order_id)['razorpay_payment_id']
+        self.send('payment.captured', payment_id)
+        self.send('refund.processed', self.stub.refund(payment_id, amount=4000))
+
+        call_command('replay_webhook_events', '--all', stdout=open(os.devnull, 'w'))
+        txn = PaymentTransaction.objects.get()
+        self.assertEqual((txn.status, txn.refund_amount), ('partially_refunded', Decimal('40.00')))
+
+        self.send('refund.processed', self.stub.refund(payment_id, amount=6000))
+        txn.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual((txn.status, txn.refund_amount), ('refunded', Decimal('100.00')))
+        self.assertEqual(order.payment_status, Order.Status.REFUNDED)
+        self.assertEqual(WebhookEvent.objects.filter(processed=True).count(), 3)
+
+
+class PaymentTransactionTrackingTests(TestCase):
+    """Transaction saves write only the changed columns."""
+
+    def test_status_change_is_one_partial_update(self):
+        user = User.objects.create_user(username='payer', email='payer@example.com', password='pass1234')
+        record = RTORecord.objects.create(
+            owner=user, name='Asha', contact_no='9999999999', address='12 MG Road', record_type='rto',
+        )
+        order = Order.objects.create(
+            user=user, rto_record=record, order_id='order_txn_1',
+            order_type=Order.OrderType.QR_DOWNLOAD, amount=2,
+        )
+        created = PaymentTransaction.objects.create(
+            order=order, gateway=PaymentGateway.objects.create(provider='razorpay'), amount=2,
+        )
+        txn = PaymentTransaction.objects.get(pk=created.pk)
+        txn.status = PaymentTransaction.Status.SUCCESS
+        self.assertTrue(txn.has_changed('status'))
+        self.assertEqual(txn.get_initial_value('status'), PaymentTransaction.Status.PENDING)
+
+        with CaptureQueriesContext(connection) as queries:
+            txn.save()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"completed_at"', queries[0]['sql'])
+        self.assertNotIn('"provider_response"', queries[0]['sql'])
+        self.assertIsNotNone(PaymentTransaction.objects.get(pk=txn.pk).completed_at)
+
+
+class ReconcilePaymentsTests(TestCase):
+    """Orders the browser never verified are settled from the gateway's records."""
+
+    def setUp(self):
+        self.stub = RazorpayStub().start()
+        self.addCleanup(self.stub.stop)
+        overrides = override_settings(RAZORPAY_BASE_URL=self.stub.base_url, RAZORPAY_RETRY_BACKOFF=0)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        reset_razorpay_client()
+        self.addCleanup(reset_razorpay_client)
+
+        self.user = User.objects.create_user(username='owner', email='owner@example.com', password='pass1234')
+        self.record = RTORecord.objects.create(
+            owner=self.user, name='Asha', contact_no='9999999999', address='12 MG Road', record_type='rto',
+        )
+        self.since = timezone.now() - timedelta(hours=1)
+
+    def new_orders(self, count, order_type=Order.OrderType.QR_DOWNLOAD, **fields):
+        gateway_orders = [self.stub.create_order({'amount': 200, 'currency': 'INR'}, {})[1] for _ in range(count)]
+        Order.objects.bulk_create([
+            Order(user=self.user, rto_record=self.record, order_id=gateway_order['id'], order_type=order_type,
+                  amount=2, total_amount=2, payment_provider='razorpay', **fields)
+            for gateway_order in gateway_orders
+        ])
+        return [gateway_order['id'] for gateway_order in gateway_orders]
+
+    def test_command_settles_orders_and_reports_the_diff(self):
+        abandoned, = self.new_orders(1, order_type=Order.OrderType.PVC_CARD)
+        declined, = self.new_orders(1)
+        verified, = self.new_orders(1, payment_status=Order.Status.COMPLETED)
+        self.stub.pay(abandoned)
+        self.stub.fail_payment(declined)
+        self.stub.pay(verified)
+        self.stub.pay(self.stub.create_order({'amount': 500, 'currency': 'INR'}, {})[1]['id'])  # not ours
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'diff.csv')
+            call_command('reconcile_payments', '--hours', '1', '--report', path, stdout=open(os.devnull, 'w'))
+            with open(path, newline='') as f:
+                rows = {row['order_id']: row for row in csv.DictReader(f)}
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual((rows[abandoned]['before'], rows[abandoned]['after']), ('pending', 'completed'))
+        self.assertEqual((rows[declined]['before'], rows[declined]['after']), ('pending', 'failed'))
+        self.assertNotIn(verified, rows)
+        statuses = dict(Order.objects.values_list('order_id', 'payment_status'))
+        self.assertEqual(
+            (statuses[abandoned], statuses[declined], statuses[verified]), ('completed', 'failed', 'completed')
+        )
+        self.assertEqual(PaymentTransaction.objects.count(), 3)  # including the browser-verified payment
+        self.assertTrue(PrintOrder.objects.filter(order__order_id=abandoned).exists())
+
+    def test_pages_through_the_gateway_in_bounded_chunks(self):
+        order_ids = self.new_orders(250)
+        for order_id in order_ids:
+            self.stub.pay(order_id)
+
+        dry = reconcile_payments(self.since, chunk_size=100, dry_run=True)
+        self.assertEqual((dry['payments'], dry['completed']), (250, 250))
+        self.assertFalse(Order.objects.filter(payment_status=Order.Status.COMPLETED).exists())
+
+        requests_before = self.stub.stats['requests']
+        with CaptureQueriesContext(connection) as queries:
+            stats = reconcile_payments(self.since, chunk_size=100)
+        self.assertEqual(stats['completed'], 250)
+        self.assertEqual(Order.objects.filter(payment_status=Order.Status.COMPLETED).count(), 250)
+        # Three pages each of payments and of orders; no per-order calls for settled orders
+        self.assertEqual(self.stub.stats['requests'] - requests_before, 6)
+        lookups = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'FROM "order"' in q['sql']]
+        self.assertEqual(len(lookups), 6)  # one per chunk in each pass
+
+    def test_refunded_payments_never_complete_an_order(self):
+        unfulfilled, = self.new_orders(1, order_type=Order.OrderType.PVC_CARD)
+        fulfilled, = self.new_orders(1, payment_status=Order.Status.COMPLETED)
+        for order_id in (unfulfilled, fulfilled):
+            self.stub.refund(self.stub.pay(order_id)['razorpay_payment_id'])
+
+        changes = []
+        stats = reconcile_payments(self.since, report=changes.append)
+        self.assertEqual((stats['refunded_unfulfilled'], stats['refunded']), (1, 1))
+        self.assertNotIn('completed', stats)
+
+        statuses = dict(Order.objects.values_list('order_id', 'payment_status'))
+        self.assertEqual((statuses[unfulfilled], statuses[fulfilled]), ('pending', 'refunded'))
+        self.assertFalse(PrintOrder.objects.exists())
+        self.assertEqual(
+            sorted(PaymentTransaction.objects.values_list('status', 'refund_amount')),
+            [('refunded', Decimal('2.00'))] * 2,
+        )
+        self.assertEqual(
+            {change['order_id']: (change['before'], change['after']) for change in changes},
+            {unfulfilled: ('pending', 'pending'), fulfilled: ('completed', 'refunded')},
+        )
+
+    def test_order_paid_after_the_window_is_caught(self):
+        order_id, = self.new_orders(1)
+        payment_id = self.stub.pay(order_id)['razorpay_payment_id']
+        until = timezone.now()
+        self.stub.payments[payment_id]['created_at'] += 3600
+
+        stats = reconcile_payments(self.since, until)
+        self.assertEqual((stats['payments'], stats['paid_orders'], stats['completed']), (0, 1, 1))
+        self.assertEqual(Order.objects.get().payment_provider_payment_id, payment_id)
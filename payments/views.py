@@ -1,6 +1,9 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .webhooks import ingest_event, verify_signature
 
 def create_order_view(request, record_id):
     """Create order view placeholder."""
@@ -19,8 +22,16 @@ def payment_failed_view(request, order_id):
     return render(request, 'payments/payment_failed.html')
 
 @csrf_exempt
+@require_POST
 def razorpay_webhook(request):
-    """Razorpay webhook handler placeholder."""
+    """Store a signed Razorpay event for batched processing and acknowledge it."""
+    body = request.body
+    if not verify_signature(body, request.headers.get('X-Razorpay-Signature')):
+        return HttpResponseForbidden("Invalid signature")
+    try:
+        ingest_event(body, request.headers.get('X-Razorpay-Event-Id'))
+    except ValueError:
+        return HttpResponseBadRequest("Malformed event")
     return HttpResponse("OK")
 
 @csrf_exempt
@@ -0,0 +1,339 @@
+"""Razorpay webhook ingestion and batched processing.
+
+The webhook view does as little as possible on the request path: it checks
+the ``X-Razorpay-Signature`` HMAC, stores the event with a single
+``INSERT ... ON CONFLICT DO NOTHING`` on ``WebhookEvent.event_id`` (so
+Razorpay's redeliveries are dropped by the database, not by a lookup) and
+answers 200. The first event in a ``WEBHOOK_BATCH_WINDOW`` schedules
+``process_webhook_events_task``, which drains every pending event in
+batches of ``WEBHOOK_BATCH_SIZE``:
+
+* one query loads the orders and one the transactions a batch refers to;
+* events are applied in the order they were received;
+* orders, transactions and events are written back with ``bulk_update``.
+
+Processing is idempotent, so ``python manage.py replay_webhook_events``
+can reprocess stored events at any time.
+"""
+import hashlib
+import hmac
+import json
+import logging
+from decimal import Decimal
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import Order, PrintOrder
+from core.tasks import enqueue_post_payment
+from core.utils.db_retry import atomic_with_retry
+
+from .models import PaymentGateway, PaymentTransaction, WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+PROCESS_SCHEDULED_KEY = 'webhook_process_scheduled'
+
+EVENT_TYPES = {
+    'payment.captured': WebhookEvent.EventType.PAYMENT_SUCCESS,
+    'order.paid': WebhookEvent.EventType.PAYMENT_SUCCESS,
+    'payment.failed': WebhookEvent.EventType.PAYMENT_FAILED,
+    'refund.processed': WebhookEvent.EventType.REFUND_PROCESSED,
+}
+
+# enqueue_post_payment's order types, as verify_payment passes them
+PIPELINE_ORDER_TYPES = {
+    Order.OrderType.QR_DOWNLOAD: 'qr',
+    Order.OrderType.PVC_CARD: 'pvc',
+    Order.OrderType.NFC_CARD: 'nfc',
+}
+
+# bulk_update builds a CASE per field and row, so it only gets the fields that
+# differ between rows; the shared timestamps are set with one plain update()
+ORDER_FIELDS = ['payment_status', 'payment_provider_payment_id', 'completed_at']
+TRANSACTION_FIELDS = [
+    'status', 'provider_payment_id', 'provider_response', 'failure_reason', 'refund_amount', 'completed_at',
+]
+EVENT_FIELDS = ['processing_result', 'transaction']
+
+REFUND_STATUSES = (PaymentTransaction.Status.REFUNDED, PaymentTransaction.Status.PARTIALLY_REFUNDED)
+
+
+def verify_signature(body, signature, secret=None):
+    """Check Razorpay's hex HMAC-SHA256 of the raw request body."""
+    secret = settings.RAZORPAY_WEBHOOK_SECRET if secret is None else secret
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def ingest_event(body, event_id=None):
+    """Store a verified webhook body; a redelivered event is dropped.
+
+    Razorpay sends the event id in ``X-Razorpay-Event-Id``; without one the
+    body hash stands in, which still drops byte-identical redeliveries.
+    Raises ``ValueError`` for a body that isn't a JSON event.
+    """
+    data = json.loads(body)
+    if not isinstance(data, dict) or 'event' not in data:
+        raise ValueError("Not a Razorpay event")
+    event = WebhookEvent(
+        event_id=event_id or hashlib.sha256(body).hexdigest(),
+        provider=PaymentGateway.Provider.RAZORPAY,
+        event_type=EVENT_TYPES.get(data['event'], WebhookEvent.EventType.OTHER),
+        raw_data=data,
+    )
+    store_event(event)
+    schedule_processing()
+
+
+@atomic_with_retry
+def store_event(event):
+    WebhookEvent.objects.bulk_create([event], ignore_conflicts=True)
+
+
+def schedule_processing():
+    """Schedule one processing run per ``WEBHOOK_BATCH_WINDOW``."""
+    if cache.add(PROCESS_SCHEDULED_KEY, True, timeout=settings.WEBHOOK_BATCH_WINDOW):
+        process_webhook_events_task.apply_async(countdown=settings.WEBHOOK_BATCH_WINDOW)
+
+
+@shared_task(bind=True, acks_late=True, autoretry_for=(Exception,), retry_backoff=True, max_retries=5)
+def process_webhook_events_task(self):
+    cache.delete(PROCESS_SCHEDULED_KEY)
+    return process_webhook_events()
+
+
+def _entity(data, name):
+    return ((data.get('payload') or {}).get(name) or {}).get('entity') or {}
+
+
+class PaymentBatch:
+    """Applies gateway payment and refund states to orders and transactions.
+
+    Everything the given payments and refunds refer to is loaded up front in
+    two queries; ``save()`` writes the changes back in bulk. Shared by webhook
+    processing and ``reconcile_payments``.
+    """
+
+    def __init__(self, payments=(), refunds=()):
+        order_ids = {p['order_id'] for p in payments if p.get('order_id')}
+        refunded_ids = {r['payment_id'] for r in refunds if r.get('payment_id')}
+        payment_ids = {p['id'] for p in payments if p.get('id')} | refunded_ids
+
+        orders = Order.objects.filter(
+            Q(order_id__in=order_ids) | Q(payment_provider_payment_id__in=refunded_ids)
+        ).select_related('rto_record')
+        self.orders = {order.order_id: order for order in orders}
+        self.transactions = {
+            txn.provider_payment_id: txn
+            for txn in PaymentTransaction.objects.filter(
+                provider_payment_id__in=payment_ids
+            ).select_related('order__rto_record')
+        }
+        # One instance per order, so every event in the batch sees earlier changes
+        for txn in self.transactions.values():
+            txn.order = self.orders.setdefault(txn.order.order_id, txn.order)
+        # Payments verified in the browser have an order but no transaction yet
+        self.paid_orders = {
+            order.payment_provider_payment_id: order
+            for order in self.orders.values() if order.payment_provider_payment_id
+        }
+        self.gateway = None
+        self.new_transactions = []
+        self.changed_orders = {}
+        self.changed_transactions = {}
+        self.completed_orders = []
+
+    def gateway_for_new(self):
+        if self.gateway is None:
+            self.gateway, _ = PaymentGateway.objects.get_or_create(provider=PaymentGateway.Provider.RAZORPAY)
+        return self.gateway
+
+    def transaction_for(self, payment, order, now):
+        txn = self.transactions.get(payment['id'])
+        if txn is None:
+            txn = PaymentTransaction(
+                order=order, gateway=self.gateway_for_new(), provider_payment_id=payment['id'],
+                provider_transaction_id=payment.get('order_id', ''),
+                amount=Decimal(payment.get('amount', 0)) / 100, currency=payment.get('currency', 'INR'),
+            )
+            txn.transaction_id = txn.generate_transaction_id()
+            self.transactions[payment['id']] = txn
+            self.new_transactions.append(txn)
+        elif txn.pk is not None:
+            self.changed_transactions[txn.pk] = txn
+        return txn
+
+    def _payment_order(self, payment):
+        order = self.orders.get(payment.get('order_id'))
+        if order is None:
+            return None, {'status': 'ignored', 'reason': 'unknown order'}
+        return order, None
+
+    def paid(self, payment, now):
+        order, skipped = self._payment_order(payment)
+        if skipped:
+            return None, skipped
+        txn = self.transaction_for(payment, order, now)
+        if txn.status not in REFUND_STATUSES:
+            txn.status = PaymentTransaction.Status.SUCCESS
+        txn.provider_response = {**txn.provider_response, **payment}
+        txn.completed_at = txn.completed_at or now
+
+        if order.payment_status in (Order.Status.COMPLETED, Order.Status.REFUNDED):
+            return txn, {'status': 'ok', 'order': order.order_id, 'changed': False}
+        order.payment_status = Order.Status.COMPLETED
+        order.payment_provider_payment_id = payment['id']
+        order.completed_at = order.completed_at or now
+        self.changed_orders[order.pk] = order
+        self.completed_orders.append(order)
+        return txn, {'status': 'ok', 'order': order.order_id, 'changed': True}
+
+    def failed(self, payment, now):
+        order, skipped = self._payment_order(payment)
+        if skipped:
+            return None, skipped
+        txn = self.transaction_for(payment, order, now)
+        # Razorpay doesn't order its deliveries: never undo a success
+        if txn.status == PaymentTransaction.Status.PENDING:
+            txn.status = PaymentTransaction.Status.FAILED
+            txn.provider_response = {**txn.provider_response, **payment}
+            txn.failure_reason = payment.get('error_description') or ''
+        if order.payment_status not in (Order.Status.PENDING, Order.Status.PROCESSING):
+            return txn, {'status': 'ok', 'order': order.order_id, 'changed': False}
+        order.payment_status = Order.Status.FAILED
+        self.changed_orders[order.pk] = order
+        return txn, {'status': 'ok', 'order': order.order_id, 'changed': True}
+
+    def refunded(self, refund, now):
+        payment_id = refund.get('payment_id')
+        txn = self.transactions.get(payment_id)
+        if txn is None:
+            order = self.paid_orders.get(payment_id)
+            if order is None:
+                return None, {'status': 'ignored', 'reason': 'unknown payment'}
+            txn = self.transaction_for(
+                {'id': payment_id, 'order_id': order.order_id, 'amount': int(order.amount * 100)}, order, now
+            )
+            txn.completed_at = order.completed_at
+        if txn.pk is not None:
+            self.changed_transactions[txn.pk] = txn
+        # Keyed by refund id, so a replayed refund isn't counted twice
+        refunds = txn.provider_response.setdefault('refunds', {})
+        refunds[refund['id']] = refund.get('amount', 0)
+        txn.refund_amount = Decimal(sum(refunds.values())) / 100
+        txn.status = (
+            PaymentTransaction.Status.REFUNDED if txn.refund_amount >= txn.amount
+            else PaymentTransaction.Status.PARTIALLY_REFUNDED
+        )
+
+        order = txn.order
+        if txn.status == PaymentTransaction.Status.REFUNDED and order.payment_status != Order.Status.REFUNDED:
+            order.payment_status = Order.Status.REFUNDED
+            self.changed_orders[order.pk] = order
+        return txn, {'status': 'ok', 'order': order.order_id, 'refund': refund['id']}
+
+    def refunded_payment(self, payment, now):
+        """A payment the gateway lists as refunded in full (reconciliation).
+
+        The transaction is recorded as refunded. A completed order becomes
+        refunded; one that never completed is left as it is, so nothing is
+        printed or shipped for money that was given back.
+        """
+        order, skipped = self._payment_order(payment)
+        if skipped:
+            return None, skipped
+        txn = self.transaction_for(payment, order, now)
+        txn.provider_response = {**txn.provider_response, **payment}
+        refunded = Decimal(payment.get('amount_refunded') or payment.get('amount', 0)) / 100
+        txn.refund_amount = max(txn.refund_amount, refunded)
+        txn.status = PaymentTransaction.Status.REFUNDED
+
+        if order.payment_status != Order.Status.COMPLETED:
+            return txn, {'status': 'ok', 'order': order.order_id, 'changed': False}
+        order.payment_status = Order.Status.REFUNDED
+        self.changed_orders[order.pk] = order
+        return txn, {'status': 'ok', 'order': order.order_id, 'changed': True}
+
+    def save(self, now):
+        if self.new_transactions:
+            PaymentTransaction.objects.bulk_create(self.new_transactions)
+        if self.changed_transactions:
+            PaymentTransaction.objects.bulk_update(self.changed_transactions.values(), TRANSACTION_FIELDS)
+            PaymentTransaction.objects.filter(pk__in=self.changed_transactions).update(updated_at=now)
+        if self.changed_orders:
+            Order.objects.bulk_update(self.changed_orders.values(), ORDER_FIELDS)
+            Order.objects.filter(pk__in=self.changed_orders).update(updated_at=now)
+
+        print_orders = [
+            PrintOrder(order=order, rto_record=order.rto_record)
+            for order in self.completed_orders
+            if order.order_type in (Order.OrderType.PVC_CARD, Order.OrderType.NFC_CARD)
+        ]
+        if print_orders:
+            # The API's verify_payment may have got there first
+            PrintOrder.objects.bulk_create(print_orders, ignore_conflicts=True)
+        for order in self.completed_orders:
+            enqueue_post_payment(order, PIPELINE_ORDER_TYPES.get(order.order_type, 'qr'))
+
+
+def _apply(batch, event, now):
+    name = event.raw_data.get('event')
+    if name in ('payment.captured', 'order.paid'):
+        return batch.paid(_entity(event.raw_data, 'payment'), now)
+    if name == 'payment.failed':
+        return batch.failed(_entity(event.raw_data, 'payment'), now)
+    if name == 'refund.processed':
+        return batch.refunded(_entity(event.raw_data, 'refund'), now)
+    return None, {'status': 'ignored', 'reason': f'unhandled event {name}'}
+
+
+def process_batch(events):
+    """Apply ``events`` (in received order) and mark them processed."""
+    now = timezone.now()
+    batch = PaymentBatch(
+        payments=[_entity(event.raw_data, 'payment') for event in events],
+        refunds=[_entity(event.raw_data, 'refund') for event in events],
+    )
+    for event in events:
+        try:
+            txn, result = _apply(batch, event, now)
+        except (KeyError, TypeError, ValueError) as e:
+            txn, result = None, {'status': 'error', 'reason': f'malformed payload: {e}'}
+            logger.warning("Webhook event %s is malformed: %s", event.event_id, e)
+        event.transaction = txn
+        event.processing_result = result
+
+    batch.save(now)
+    WebhookEvent.objects.bulk_update(events, EVENT_FIELDS)
+    WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(processed=True, processed_at=now)
+
+
+def process_webhook_events(queryset=None, batch_size=None):
+    """Process pending events in ``queryset`` (all of them by default) until none are left.
+
+    Each batch runs in its own transaction and, on PostgreSQL, locks its rows
+    with ``SKIP LOCKED`` so concurrent workers take different batches.
+    Returns the number of events processed.
+    """
+    queryset = WebhookEvent.objects.all() if queryset is None else queryset
+    pending = queryset.filter(processed=False).order_by('received_at', 'pk')
+    batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+
+    total = 0
+    while True:
+        with transaction.atomic():
+            events = list(pending.select_for_update(skip_locked=True)[:batch_size])
+            if not events:
+                break
+            process_batch(events)
+        total += len(events)
+    if total:
+        logger.info("Processed %d webhook events", total)
+    return total
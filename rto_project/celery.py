@@ -0,0 +1,11 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rto_project.settings')
+
+app = Celery('rto_project')
+
+# Read CELERY_* settings from the Django settings module
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
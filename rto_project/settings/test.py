@@ -0,0 +1,27 @@
+import tempfile
+
+from .base import *
+
+# Run background jobs in-process so tests see their results immediately
+CELERY_TASK_ALWAYS_EAGER = True
+CELERY_TASK_EAGER_PROPAGATES = True
+QUERY_BUDGET_STRICT = True
+
+# Keep generated files out of the project tree
+MEDIA_ROOT = tempfile.mkdtemp(prefix='rto_test_media_')
+DEPLOY_REPO_DIR = tempfile.mkdtemp(prefix='rto_test_repo_')
+DEPLOY_SITE_DIR = os.path.join(DEPLOY_REPO_DIR, 'deploy_site')
+
+EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+LOGGING['handlers']['file']['filename'] = os.devnull
+
+# A file database so concurrent tests get SQLite's locking and busy timeout
+# instead of the shared-cache in-memory database's immediate "table is locked".
+# With DATABASE_URL pointing at PostgreSQL the suite runs against that server.
+if DATABASES['default']['ENGINE'] == 'rto_project.sqlite3':
+    DATABASES['default']['TEST'] = {'NAME': os.path.join(tempfile.mkdtemp(prefix='rto_test_db_'), 'test.sqlite3')}
+    SQLITE_PRAGMAS['busy_timeout'] = 30000
+    DATABASES['default']['OPTIONS']['init_command'] = ';'.join(
+        f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()
+    )
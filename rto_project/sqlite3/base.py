@@ -0,0 +1,39 @@
+"""SQLite backend with connection init commands and ``BEGIN IMMEDIATE``.
+
+Backports two ``OPTIONS`` of Django 5.1's SQLite backend so production can
+run several gunicorn workers against one database file:
+
+* ``init_command``: ``;``-separated statements run on every new connection,
+  used for the WAL/busy-timeout/cache ``PRAGMA``\\s in settings;
+* ``transaction_mode``: how ``atomic()`` begins its transaction. With the
+  default deferred ``BEGIN`` a transaction that reads and then writes can't
+  wait for the write lock (SQLite fails it at once to avoid a deadlock), so
+  ``IMMEDIATE`` takes the lock up front, where ``busy_timeout`` applies.
+
+Both keys mean the same on Django 5.1+, so this engine can be swapped back
+for ``django.db.backends.sqlite3`` after an upgrade.
+"""
+from django.db.backends.sqlite3 import base
+
+BACKPORTED_OPTIONS = ('init_command', 'transaction_mode')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for option in BACKPORTED_OPTIONS:
+            params.pop(option, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        init_command = self.settings_dict['OPTIONS'].get('init_command', '')
+        for statement in init_command.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        self.cursor().execute(f'BEGIN {mode}' if mode else 'BEGIN')